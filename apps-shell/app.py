@@ -2,6 +2,12 @@ import dash_mantine_components as dmc
 from dash import html, dcc, Dash, page_registry, page_container, get_asset_url
 from dash_iconify import DashIconify
 from collections import defaultdict
+from flask import jsonify
+
+from components.tables.admission import admission
+from components.tables.catalog import catalog_browser
+from components.tables.functions import sql_pool
+from components.tables.resilience import circuit_breaker
 
 
 def get_icon(icon):
@@ -13,6 +19,23 @@ app = Dash(
     use_pages=True,
     pages_folder="components",
 )
+server = app.server
+
+
+@server.route("/api/connection-stats")
+def connection_stats():
+    # Statements running and queued per warehouse in this worker, the state of
+    # each warehouse's circuit breaker, the connections in the SQL pool and the
+    # catalog listings loaded for the table name suggestions.
+    return jsonify(
+        {
+            "admission": admission.stats(),
+            "circuits": circuit_breaker.stats(),
+            "pool": sql_pool.stats(),
+            "catalog_browser": catalog_browser.stats(),
+        }
+    )
+
 
 pages_by_category = defaultdict(list)
 root_pages = []
@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+WAREHOUSE_MAX_CONCURRENT = int(os.getenv("WAREHOUSE_MAX_CONCURRENT", "4"))
+WAREHOUSE_MAX_QUEUED = int(os.getenv("WAREHOUSE_MAX_QUEUED", "32"))
+WAREHOUSE_QUEUE_TIMEOUT = float(os.getenv("WAREHOUSE_QUEUE_TIMEOUT", "10"))
+
+
+class WarehouseBusy(Exception):
+    def __init__(self, message, position=None):
+        super().__init__(message)
+        self.position = position
+
+
+class _Waiter:
+    def __init__(self, key):
+        self.key = key
+        self.admitted = False
+        self.event = threading.Event()
+
+
+class _Warehouse:
+    def __init__(self):
+        self.running = 0
+        self.queued = 0
+        # Waiters by user, in the order the users are served next.
+        self.queues = OrderedDict()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+
+class AdmissionController:
+    """Limits the number of statements the app runs on each warehouse at once.
+
+    Up to `max_concurrent` statements run on a warehouse at the same time. Further
+    callers wait in a queue of at most `max_queued`; they are rejected with
+    `WarehouseBusy` straight away when the queue is full, or after waiting
+    `timeout` seconds. Waiting callers are admitted round-robin by user, so a
+    burst of queries from one user does not hold up everyone else. The limits
+    apply to each server worker process.
+    """
+
+    def __init__(
+        self,
+        max_concurrent=WAREHOUSE_MAX_CONCURRENT,
+        max_queued=WAREHOUSE_MAX_QUEUED,
+        timeout=WAREHOUSE_QUEUE_TIMEOUT,
+        check_interval=0.2,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._warehouses = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def admit(self, http_path, key, on_wait=None):
+        """Holds one of the warehouse's slots while the block runs.
+
+        `on_wait(position)` is called periodically while queued; it can raise
+        to give up waiting (e.g. when the query is cancelled).
+        """
+        if self.max_concurrent <= 0:
+            yield
+            return
+        self._acquire(http_path, key, on_wait)
+        try:
+            yield
+        finally:
+            self.release(http_path)
+
+    def release(self, http_path):
+        if self.max_concurrent <= 0:
+            return
+        with self._lock:
+            warehouse = self._warehouses[http_path]
+            warehouse.running -= 1
+            self._admit_waiting(warehouse)
+
+    def reset_after_fork(self):
+        self._warehouses = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                http_path: {
+                    "running": warehouse.running,
+                    "queued": warehouse.queued,
+                    "admitted": warehouse.admitted,
+                    "rejected": warehouse.rejected,
+                    "timed_out": warehouse.timed_out,
+                }
+                for http_path, warehouse in self._warehouses.items()
+            }
+
+    def _acquire(self, http_path, key, on_wait):
+        with self._lock:
+            warehouse = self._warehouses.get(http_path)
+            if warehouse is None:
+                warehouse = self._warehouses[http_path] = _Warehouse()
+            if warehouse.running < self.max_concurrent and not warehouse.queued:
+                warehouse.running += 1
+                warehouse.admitted += 1
+                return
+            if warehouse.queued >= self.max_queued:
+                warehouse.rejected += 1
+                raise WarehouseBusy(
+                    f"The SQL warehouse is busy: {warehouse.running} queries are "
+                    f"running and {warehouse.queued} are waiting. Try again shortly.",
+                    warehouse.queued + 1,
+                )
+            waiter = _Waiter(key)
+            warehouse.queues.setdefault(key, deque()).append(waiter)
+            warehouse.queued += 1
+
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        if waiter.admitted:
+                            return
+                        position = self._position(warehouse, waiter)
+                        warehouse.timed_out += 1
+                    raise WarehouseBusy(
+                        f"The SQL warehouse is busy: still at position {position} "
+                        f"in the queue after {self.timeout:g}s. Try again shortly.",
+                        position,
+                    )
+                if waiter.event.wait(min(self.check_interval, remaining)):
+                    return
+                if on_wait:
+                    with self._lock:
+                        position = self._position(warehouse, waiter)
+                    if position:
+                        on_wait(position)
+        except BaseException:
+            with self._lock:
+                if waiter.admitted:
+                    # Admitted just as it gave up: hand the slot on.
+                    warehouse.running -= 1
+                    self._admit_waiting(warehouse)
+                else:
+                    self._remove(warehouse, waiter)
+            raise
+
+    def _admit_waiting(self, warehouse):
+        # Called with the lock held.
+        while warehouse.queued and warehouse.running < self.max_concurrent:
+            key, queue = next(iter(warehouse.queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                warehouse.queues.move_to_end(key)
+            else:
+                del warehouse.queues[key]
+            warehouse.queued -= 1
+            warehouse.running += 1
+            warehouse.admitted += 1
+            waiter.admitted = True
+            waiter.event.set()
+
+    def _remove(self, warehouse, waiter):
+        # Called with the lock held.
+        queue = warehouse.queues.get(waiter.key)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        warehouse.queued -= 1
+        if not queue:
+            del warehouse.queues[waiter.key]
+
+    def _position(self, warehouse, waiter):
+        # Called with the lock held. Users are served one waiter at a time in the
+        # order of `queues`, so a waiter that is n-th for its user goes after up
+        # to n waiters of every other user (n + 1 for users served before its
+        # own).
+        queue = warehouse.queues.get(waiter.key)
+        if queue is None or waiter not in queue:
+            return 0
+        index = queue.index(waiter)
+        position = index + 1
+        before = True
+        for key, other in warehouse.queues.items():
+            if key == waiter.key:
+                before = False
+                continue
+            position += min(len(other), index + 1 if before else index)
+        return position
+
+
+admission = AdmissionController()
@@ -1,24 +1,520 @@
+import atexit
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from cachetools import TTLCache
 from databricks import sql
 from databricks.sdk.core import Config
 
+from .admission import WarehouseBusy, admission
+from .catalog import catalog_browser
+from .pool import SQL_POOL_SIZE, ConnectionPool
+from .querybuilder import (
+    build_count,
+    build_select,
+    quote_identifier,
+    quote_table_name,
+    split_table_name,
+)
+from .resilience import (
+    CircuitOpen,
+    circuit_breaker,
+    connect_options,
+    execute,
+    is_transient,
+    with_retries,
+)
+from .writeback import (
+    build_conflict_query,
+    build_duplicate_key_query,
+    build_merge,
+    source_rows,
+    validate_changes,
+)
+
 DATABRICKS_SQL_WAREHOUSE_ID = os.getenv("DATABRICKS_SQL_WAREHOUSE_ID")
+ROW_LIMIT = int(os.getenv("ROW_LIMIT", "100"))
+ROW_LIMIT_MAX = int(os.getenv("ROW_LIMIT_MAX", "10000"))
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "600"))
+SCHEMA_ERROR_TTL = float(os.getenv("SCHEMA_ERROR_TTL", "30"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "64"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+EDIT_CHUNK_SIZE = int(os.getenv("EDIT_CHUNK_SIZE", "1000"))
+EDIT_CONFLICT_RETRIES = int(os.getenv("EDIT_CONFLICT_RETRIES", "2"))
+COMPARE_MAX_TABLES = int(os.getenv("COMPARE_MAX_TABLES", "8"))
+# More workers than pooled connections would only wait for a connection.
+COMPARE_WORKERS = int(os.getenv("COMPARE_WORKERS", str(SQL_POOL_SIZE)))
+COMPARE_TABLE_TIMEOUT = float(os.getenv("COMPARE_TABLE_TIMEOUT", "60"))
+# Tables of one comparison read at the same time. Fewer than the pooled
+# connections, so a comparison leaves some for the other pages.
+COMPARE_CONNECTIONS = int(
+    os.getenv("COMPARE_CONNECTIONS", str(max(1, SQL_POOL_SIZE // 2)))
+)
+
+# Table columns from DESCRIBE TABLE, by quoted table name.
+schema_cache = TTLCache(maxsize=256, ttl=SCHEMA_CACHE_TTL)
+# Failed DESCRIBE TABLEs (e.g. a mistyped name), raised again for a short time
+# instead of querying the warehouse each time the name is looked up.
+schema_errors = TTLCache(maxsize=256, ttl=SCHEMA_ERROR_TTL)
+schema_cache_lock = threading.Lock()
+
+# Query results by table, columns and row limit. Entries expire after
+# RESULT_CACHE_TTL seconds and the least recently used are dropped once there
+# are RESULT_CACHE_SIZE of them. cachetools caches are not thread-safe.
+result_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+result_cache_lock = threading.Lock()
+
+
+class QuerySuperseded(Exception):
+    pass
+
+
+class LatestQueries:
+    """Tracks the latest query of each user, so that starting a new one cancels
+    the statement of the query it replaces."""
+
+    def __init__(self):
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def start(self, key):
+        # The token is set once the query is replaced or cancelled.
+        token = threading.Event()
+        with self._lock:
+            previous = self._latest.get(key)
+            self._latest[key] = [token, None]
+        if previous:
+            previous[0].set()
+        if previous and previous[1] is not None:
+            cancel_quietly(previous[1])
+        return token
+
+    def check(self, key, token):
+        with self._lock:
+            entry = self._latest.get(key)
+        # The entry is removed when the latest query finishes or is cancelled.
+        if token.is_set() or (entry is not None and entry[0] is not token):
+            raise QuerySuperseded()
+
+    def cancel(self, key, token):
+        """Cancels the query started with `token` and forgets it, if it is still
+        the latest one for `key`."""
+        token.set()
+        with self._lock:
+            entry = self._latest.get(key)
+            if entry is None or entry[0] is not token:
+                return
+            del self._latest[key]
+        if entry[1] is not None:
+            cancel_quietly(entry[1])
+
+    @contextmanager
+    def running(self, key, token, cursor):
+        with self._lock:
+            entry = self._latest.get(key)
+            current = entry is not None and entry[0] is token
+            if current:
+                entry[1] = cursor
+        if not current:
+            raise QuerySuperseded()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._latest.get(key) is entry:
+                    del self._latest[key]
+
+    def reset_after_fork(self):
+        self._latest = {}
+        self._lock = threading.Lock()
+
+
+latest_queries = LatestQueries()
+
+
+def cancel_quietly(cursor):
+    try:
+        cursor.cancel()
+    except Exception as e:
+        print(f"Error cancelling query: {e}")
+
 
 cfg = Config()
 
 
+def reset_after_fork():
+    # Each server worker needs its own SDK config (and OAuth token state).
+    global cfg
+    cfg = Config()
+    admission.reset_after_fork()
+    circuit_breaker.reset_after_fork()
+    with schema_cache_lock:
+        schema_cache.clear()
+        schema_errors.clear()
+    result_cache.clear()
+    latest_queries.reset_after_fork()
+    sql_pool.reset_after_fork()
+    catalog_browser.reset_after_fork()
+    # Threads do not survive a fork.
+    global compare_executor
+    compare_executor = new_compare_executor()
+
+
 def get_connection():
-    return sql.connect(
-        server_hostname=cfg.host,
-        http_path=f"/sql/1.0/warehouses/{DATABRICKS_SQL_WAREHOUSE_ID}",
-        credentials_provider=lambda: cfg.authenticate,
+    # Fails fast while the warehouse is failing (see resilience.py).
+    with circuit_breaker.guard(DATABRICKS_SQL_WAREHOUSE_ID):
+        return with_retries(
+            lambda: sql.connect(
+                server_hostname=cfg.host,
+                http_path=f"/sql/1.0/warehouses/{DATABRICKS_SQL_WAREHOUSE_ID}",
+                credentials_provider=lambda: cfg.authenticate,
+                **connect_options(),
+            ),
+            "connect",
+        )
+
+
+# Connections to the warehouse, shared by every page in this worker.
+sql_pool = ConnectionPool(get_connection)
+atexit.register(sql_pool.close_all)
+
+
+def is_table_error(e):
+    """True for errors about the table itself, such as a missing table or no
+    permission. A busy or unreachable warehouse says nothing about the table."""
+    if isinstance(e, (WarehouseBusy, CircuitOpen, TimeoutError)):
+        return False
+    return not is_transient(e)
+
+
+def describe_table(table_name, conn=None, user=None):
+    """Returns the table's columns as (name, type) pairs.
+
+    Without `conn`, a connection is borrowed from `sql_pool`.
+    """
+    quoted = quote_table_name(table_name)
+    with schema_cache_lock:
+        columns = schema_cache.get(quoted)
+        error = schema_errors.get(quoted)
+    if columns is not None:
+        return columns
+    if error is not None:
+        raise error
+    if conn is None:
+        with sql_pool.connection() as conn:
+            return describe_table(table_name, conn, user)
+    try:
+        with admission.admit(DATABRICKS_SQL_WAREHOUSE_ID, user or "app"):
+            with circuit_breaker.guard(DATABRICKS_SQL_WAREHOUSE_ID):
+                with conn.cursor() as cursor:
+                    execute(cursor, f"DESCRIBE TABLE {quoted}")
+                    rows = cursor.fetchall()
+    except Exception as e:
+        if is_table_error(e):
+            with schema_cache_lock:
+                schema_errors[quoted] = e
+        raise
+    columns = []
+    # The columns are followed by a blank row and sections such as
+    # "# Partition Information".
+    for row in rows:
+        if not row[0] or row[0].startswith("#"):
+            break
+        columns.append((row[0], row[1]))
+    with schema_cache_lock:
+        schema_cache[quoted] = columns
+    return columns
+
+
+def primary_key(table_name, conn=None, user=None):
+    """Returns the columns of the table's primary key, or [] if it has none."""
+    parts = split_table_name(table_name)
+    if len(parts) != 3:
+        return []
+    cache_key = ("primary key", quote_table_name(table_name))
+    with schema_cache_lock:
+        columns = schema_cache.get(cache_key)
+    if columns is not None:
+        return columns
+    if conn is None:
+        with sql_pool.connection() as conn:
+            return primary_key(table_name, conn, user)
+    catalog, schema, table = parts
+    information_schema = f"{quote_identifier(catalog)}.information_schema"
+    query = (
+        f"SELECT k.column_name FROM {information_schema}.table_constraints AS c "
+        f"JOIN {information_schema}.key_column_usage AS k "
+        "ON k.constraint_schema = c.constraint_schema "
+        "AND k.constraint_name = c.constraint_name "
+        "WHERE c.constraint_type = 'PRIMARY KEY' "
+        "AND c.table_schema = :schema AND c.table_name = :table "
+        "ORDER BY k.ordinal_position"
     )
+    try:
+        with admission.admit(DATABRICKS_SQL_WAREHOUSE_ID, user or "app"):
+            with circuit_breaker.guard(DATABRICKS_SQL_WAREHOUSE_ID):
+                with conn.cursor() as cursor:
+                    # Unity Catalog stores names in lower case.
+                    parameters = {"schema": schema.lower(), "table": table.lower()}
+                    execute(cursor, query, parameters=parameters)
+                    columns = [row[0] for row in cursor.fetchall()]
+    except Exception as e:
+        # e.g. hive_metastore, which has no constraints.
+        print(f"Could not read the primary key of {table_name}: {e}")
+        if not is_table_error(e):
+            return []
+        columns = []
+    with schema_cache_lock:
+        schema_cache[cache_key] = columns
+    return columns
+
+
+def row_limit(limit):
+    return max(1, min(int(limit or ROW_LIMIT), ROW_LIMIT_MAX))
+
+
+def result_key(table_name, columns=None, limit=ROW_LIMIT):
+    return (quote_table_name(table_name), tuple(columns or ()), row_limit(limit))
+
+
+def get_cached_result(key):
+    """Returns (df, cached_at) or None."""
+    with result_cache_lock:
+        return result_cache.get(key)
+
+
+def read_table(
+    table_name, conn=None, user=None, columns=None, limit=ROW_LIMIT, latest=None
+):
+    """Reads up to `limit` rows of `columns` (all by default) from the table.
+
+    Without `conn`, a connection is borrowed from `sql_pool`. With
+    `latest=(key, token)` from `latest_queries.start`, the query gives up with
+    QuerySuperseded, cancelling its statement, once a newer query is started for
+    the same key. The result is stored in `result_cache`.
+    """
+    if conn is None:
+        with sql_pool.connection() as conn:
+            return read_table(table_name, conn, user, columns, limit, latest)
+    key = result_key(table_name, columns, limit)
+    check = (lambda _=None: latest_queries.check(*latest)) if latest else None
+    if columns:
+        known = {name for name, _ in describe_table(table_name, conn, user)}
+        unknown = set(columns) - known
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(sorted(unknown))}")
+    try:
+        # Waits for a slot on the warehouse; raises WarehouseBusy if there is none.
+        with admission.admit(DATABRICKS_SQL_WAREHOUSE_ID, user or "app", check):
+            with circuit_breaker.guard(DATABRICKS_SQL_WAREHOUSE_ID):
+                with conn.cursor() as cursor:
+                    with ExitStack() as stack:
+                        if latest:
+                            stack.enter_context(latest_queries.running(*latest, cursor))
+                        query = build_select(table_name, columns, key[2])
+                        execute(cursor, query, check)
+                        df = cursor.fetchall_arrow().to_pandas()
+    except QuerySuperseded:
+        raise
+    except Exception:
+        # A superseded query fails once its statement is cancelled.
+        if check:
+            check()
+        raise
+    with result_cache_lock:
+        result_cache[key] = (df, time.time())
+    if check:
+        check()
+    return df
+
+
+def _updated_rows(cursor):
+    # MERGE returns one row of counts.
+    row = cursor.fetchone()
+    names = [column[0] for column in cursor.description or []]
+    if row is None or "num_updated_rows" not in names:
+        return None
+    return row[names.index("num_updated_rows")]
+
+
+def _merge(cursor, query, parameters):
+    # Delta rejects a commit that conflicts with one made at the same time (e.g.
+    # an OPTIMIZE or another MERGE on the same files). Nothing was written, so
+    # the chunk can be applied again.
+    for attempt in range(EDIT_CONFLICT_RETRIES + 1):
+        try:
+            execute(cursor, query, parameters=parameters)
+            return _updated_rows(cursor)
+        except Exception as e:
+            if attempt == EDIT_CONFLICT_RETRIES or "CONCURRENT" not in str(e).upper():
+                raise
+            print(f"Retrying MERGE after a concurrent write: {e}")
+
+
+def write_changes(
+    table_name, keys, changes, conn=None, user=None, chunk_size=EDIT_CHUNK_SIZE
+):
+    """Writes edited rows back to the table with one MERGE per `chunk_size` rows.
+
+    `changes` are the rows changed on the page (see writeback.validate_changes),
+    matched to the table's rows by the `keys` columns. Each chunk is committed on
+    its own, so a large edit does not hold one long transaction and an error
+    keeps the chunks already written. Rows whose changed cells no longer hold
+    the loaded values are not updated and are returned as conflicts.
+
+    Returns {"saved": [...], "conflicts": [...], "error": None or message} with
+    the rows' indices on the page.
+    """
+    if conn is None:
+        with sql_pool.connection() as conn:
+            return write_changes(table_name, keys, changes, conn, user, chunk_size)
+    types = dict(describe_table(table_name, conn, user))
+    validate_changes(changes, keys, types)
+    # A MERGE on a key that is not unique would update every row that shares
+    # it. Unity Catalog does not enforce primary keys, so even the declared
+    # primary key is checked; keys found unique are cached like the schema.
+    unique_key = ("unique key", quote_table_name(table_name), tuple(sorted(keys)))
+    result = {"saved": [], "conflicts": [], "error": None}
+    with admission.admit(DATABRICKS_SQL_WAREHOUSE_ID, user or "app"):
+        with circuit_breaker.guard(DATABRICKS_SQL_WAREHOUSE_ID):
+            with conn.cursor() as cursor:
+                with schema_cache_lock:
+                    checked = schema_cache.get(unique_key)
+                if checked is None:
+                    execute(cursor, build_duplicate_key_query(table_name, keys))
+                    if cursor.fetchall():
+                        raise ValueError(
+                            "The key columns do not identify rows uniquely"
+                        )
+                    with schema_cache_lock:
+                        schema_cache[unique_key] = True
+                for start in range(0, len(changes), chunk_size):
+                    chunk = changes[start : start + chunk_size]
+                    # Only the columns changed somewhere in the chunk are sent.
+                    changed = set().union(*(change["new"] for change in chunk))
+                    columns = [column for column in types if column in changed]
+                    parameters = {"rows": source_rows(chunk, keys, columns)}
+                    conflicts = set()
+                    try:
+                        query = build_merge(table_name, keys, columns, types)
+                        updated = _merge(cursor, query, parameters)
+                        if updated is None or updated < len(chunk):
+                            query = build_conflict_query(
+                                table_name, keys, columns, types
+                            )
+                            execute(cursor, query, parameters=parameters)
+                            conflicts = {row[0] for row in cursor.fetchall()}
+                    except Exception as e:
+                        print(f"Error saving changes to {table_name}: {e}")
+                        result["error"] = str(e)
+                        break
+                    for change in chunk:
+                        if change["index"] in conflicts:
+                            result["conflicts"].append(change["index"])
+                        else:
+                            result["saved"].append(change["index"])
+    if result["saved"]:
+        # Cached reads of the table are out of date.
+        quoted = quote_table_name(table_name)
+        with result_cache_lock:
+            for key in [key for key in result_cache if key[0] == quoted]:
+                result_cache.pop(key, None)
+    return result
+
+
+def count_rows(table_name, conn, user=None, latest=None):
+    """Returns the number of rows in the table. `latest` is as for read_table."""
+    check = (lambda _=None: latest_queries.check(*latest)) if latest else None
+    with admission.admit(DATABRICKS_SQL_WAREHOUSE_ID, user or "app", check):
+        with circuit_breaker.guard(DATABRICKS_SQL_WAREHOUSE_ID):
+            with conn.cursor() as cursor:
+                with ExitStack() as stack:
+                    if latest:
+                        stack.enter_context(latest_queries.running(*latest, cursor))
+                    execute(cursor, build_count(table_name), check)
+                    return cursor.fetchone()[0]
+
+
+def new_compare_executor():
+    return ThreadPoolExecutor(max_workers=COMPARE_WORKERS, thread_name_prefix="compare")
+
+
+# Reads of the tables being compared, shared by all users of this worker.
+compare_executor = new_compare_executor()
+
+
+def _compare_one(table_name, user, limit, timeout, deadline):
+    """Reads and counts one table for read_tables. Never raises."""
+    result = {"table": table_name, "df": None, "total": None, "error": None}
+    # Comparing the same table again cancels the earlier read of it.
+    key = f"{user or 'app'}:compare:{table_name}"
+    lock = threading.Lock()
+    timed_out = threading.Event()
+    tokens = []
+
+    def begin():
+        with lock:
+            if timed_out.is_set():
+                raise QuerySuperseded()
+            tokens.append(latest_queries.start(key))
+            return key, tokens[-1]
+
+    def stop():
+        with lock:
+            timed_out.set()
+        # Cancels the running statement; its read then fails the check.
+        for token in tokens:
+            latest_queries.cancel(key, token)
+
+    started = time.monotonic()
+    # The time spent waiting to start counts towards the timeout.
+    timer = threading.Timer(max(deadline - started, 0), stop)
+    timer.daemon = True
+    timer.start()
+    try:
+        with sql_pool.connection(deadline - time.monotonic()) as conn:
+            result["df"] = read_table(table_name, conn, user, None, limit, begin())
+            result["total"] = count_rows(table_name, conn, user, begin())
+    except Exception as e:
+        if timed_out.is_set() or time.monotonic() >= deadline:
+            result["error"] = f"Timed out after {timeout:g}s"
+        elif isinstance(e, QuerySuperseded):
+            result["error"] = "Replaced by a newer comparison"
+        else:
+            print(f"Error comparing {table_name}: {e}")
+            result["error"] = str(e)
+    finally:
+        timer.cancel()
+        result["seconds"] = time.monotonic() - started
+    return result
+
 
+def read_tables(table_names, user=None, limit=ROW_LIMIT, timeout=COMPARE_TABLE_TIMEOUT):
+    """Reads up to `limit` rows of each table and counts its rows, in parallel.
 
-def read_table(table_name, conn):
-    with conn.cursor() as cursor:
-        query = f"SELECT * FROM {table_name} LIMIT 100"
-        cursor.execute(query)
-        df = cursor.fetchall_arrow().to_pandas()
-        print(df)
-        return df
+    The tables are read on `compare_executor` with pooled connections, at most
+    COMPARE_CONNECTIONS at a time, and each read is cancelled `timeout` seconds
+    after the comparison started. A table that fails or times out does not
+    affect the others. Returns one dict per table, in order, with "table",
+    "df", "total", "seconds" and "error" (None on success).
+    """
+    if len(table_names) > COMPARE_MAX_TABLES:
+        raise ValueError(f"Compare at most {COMPARE_MAX_TABLES} tables at a time")
+    limit = row_limit(limit)
+    deadline = time.monotonic() + timeout
+    slots = threading.BoundedSemaphore(COMPARE_CONNECTIONS)
+    futures = []
+    for table_name in table_names:
+        # Waits here rather than on a worker thread, so a large comparison does
+        # not hold workers that other comparisons could use. The reads holding
+        # the slots end by the deadline.
+        slots.acquire()
+        future = compare_executor.submit(
+            _compare_one, table_name, user, limit, timeout, deadline
+        )
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+    return [future.result() for future in futures]
@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+SQL_POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "4"))
+SQL_POOL_IDLE_TIMEOUT = float(os.getenv("SQL_POOL_IDLE_TIMEOUT", "300"))
+SQL_POOL_CHECKOUT_TIMEOUT = float(os.getenv("SQL_POOL_CHECKOUT_TIMEOUT", "30"))
+SQL_POOL_HEALTH_CHECK_AFTER = float(os.getenv("SQL_POOL_HEALTH_CHECK_AFTER", "60"))
+
+
+def is_open(conn):
+    return getattr(conn, "open", True)
+
+
+def ping(conn):
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        return True
+    except Exception:
+        return False
+
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception as e:
+        print(f"Error closing connection: {e}")
+
+
+class ConnectionPool:
+    """Process-wide pool of SQL connections to one warehouse.
+
+    Connections are opened when they are first needed, up to `size` at a time.
+    One that has been idle for `health_check_after` seconds is pinged before it
+    is handed out again, and a background thread closes connections that have
+    been idle for `idle_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        connect,
+        size=SQL_POOL_SIZE,
+        idle_timeout=SQL_POOL_IDLE_TIMEOUT,
+        checkout_timeout=SQL_POOL_CHECKOUT_TIMEOUT,
+        health_check_after=SQL_POOL_HEALTH_CHECK_AFTER,
+    ):
+        self._connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        # (connection, last_used), most recently used on the right
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._closed = False
+        self.opened = 0
+        self.reaped = 0
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=not is_open(conn))
+            raise
+        else:
+            self.release(conn)
+
+    def acquire(self, timeout=None):
+        """Waits up to `timeout` seconds (at most `checkout_timeout`) for a
+        connection and raises TimeoutError if none is free."""
+        if timeout is None or timeout > self.checkout_timeout:
+            timeout = self.checkout_timeout
+        deadline = time.monotonic() + timeout
+        conn = None
+        with self._cond:
+            self._start_reaper()
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.size:
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"Timed out waiting for a SQL connection ({self.size} in use)"
+                    )
+                self._cond.wait(remaining)
+
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+                self.opened += 1
+        except BaseException:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, discard=False):
+        with self._cond:
+            self._in_use -= 1
+            keep = not discard and not self._closed and is_open(conn)
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if not keep:
+            close_quietly(conn)
+
+    def reap(self):
+        """Closes connections that have been idle for longer than `idle_timeout`."""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            # The oldest connections are on the left.
+            while self._idle and now - self._idle[0][1] > self.idle_timeout:
+                expired.append(self._idle.popleft()[0])
+            self.reaped += len(expired)
+        for conn in expired:
+            close_quietly(conn)
+        return len(expired)
+
+    def close_all(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            close_quietly(conn)
+
+    def reset_after_fork(self):
+        # Connections opened before a fork belong to the parent process, so they
+        # are forgotten here rather than closed, and the reaper thread did not
+        # survive the fork.
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._closed = False
+
+    def stats(self):
+        with self._cond:
+            return {
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "opened": self.opened,
+                "reaped": self.reaped,
+            }
+
+    def _is_healthy(self, conn, last_used):
+        if not is_open(conn):
+            return False
+        if time.monotonic() - last_used > self.health_check_after:
+            return ping(conn)
+        return True
+
+    def _start_reaper(self):
+        # Called with the lock held.
+        if self._reaper is not None:
+            return
+
+        def reap_forever():
+            while not self._closed:
+                time.sleep(min(self.idle_timeout, 60))
+                self.reap()
+
+        self._reaper = threading.Thread(
+            target=reap_forever, name="sql-pool-reaper", daemon=True
+        )
+        self._reaper.start()
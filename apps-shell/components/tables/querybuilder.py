@@ -0,0 +1,58 @@
+import re
+
+
+def quote_identifier(name):
+    name = str(name)
+    if not name or "\x00" in name:
+        raise ValueError(f"Invalid identifier: {name!r}")
+    return "`" + name.replace("`", "``") + "`"
+
+
+def split_table_name(table_name):
+    parts = []
+    current = ""
+    quoted = False
+    i = 0
+    name = table_name.strip()
+    while i < len(name):
+        char = name[i]
+        if quoted:
+            if char == "`" and name[i + 1 : i + 2] == "`":
+                current += "`"
+                i += 1
+            elif char == "`":
+                quoted = False
+            else:
+                current += char
+        elif char == "`":
+            quoted = True
+        elif char == ".":
+            parts.append(current)
+            current = ""
+        elif re.match(r"[\w-]", char):
+            current += char
+        else:
+            raise ValueError(f"Invalid character {char!r} in table name {table_name!r}")
+        i += 1
+    parts.append(current)
+    if quoted or not 1 <= len(parts) <= 3 or not all(parts):
+        raise ValueError(
+            f"Invalid table name {table_name!r}, expected catalog.schema.table"
+        )
+    return parts
+
+
+def quote_table_name(table_name):
+    return ".".join(quote_identifier(part) for part in split_table_name(table_name))
+
+
+def build_select(table_name, columns=None, limit=None):
+    projection = ", ".join(quote_identifier(c) for c in columns) if columns else "*"
+    query = f"SELECT {projection} FROM {quote_table_name(table_name)}"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    return query
+
+
+def build_count(table_name):
+    return f"SELECT COUNT(*) FROM {quote_table_name(table_name)}"
@@ -0,0 +1,196 @@
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from databricks.sql.exc import (
+    MaxRetryDurationError,
+    NonRecoverableNetworkError,
+    RequestError,
+    UnsafeToRetryError,
+)
+
+SQL_CONNECT_TIMEOUT = float(os.getenv("SQL_CONNECT_TIMEOUT", "30"))
+SQL_STATEMENT_TIMEOUT = int(os.getenv("SQL_STATEMENT_TIMEOUT", "600"))
+SQL_RETRIES = int(os.getenv("SQL_RETRIES", "2"))
+SQL_RETRY_BACKOFF = float(os.getenv("SQL_RETRY_BACKOFF", "0.5"))
+SQL_RETRY_BACKOFF_MAX = float(os.getenv("SQL_RETRY_BACKOFF_MAX", "5"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Errors the server reports when it is overloaded or restarting.
+TRANSIENT_MESSAGES = ("TEMPORARILY_UNAVAILABLE", "Service Unavailable", "429")
+
+
+def connect_options():
+    """Timeout settings for `sql.connect`.
+
+    The connector's own request retries stop after SQL_CONNECT_TIMEOUT seconds
+    (its default is 15 minutes), and statements are cancelled by the warehouse
+    after SQL_STATEMENT_TIMEOUT seconds.
+    """
+    options = {
+        "_socket_timeout": SQL_CONNECT_TIMEOUT,
+        "_retry_stop_after_attempts_duration": SQL_CONNECT_TIMEOUT,
+    }
+    if SQL_STATEMENT_TIMEOUT > 0:
+        options["session_configuration"] = {
+            "STATEMENT_TIMEOUT": str(SQL_STATEMENT_TIMEOUT)
+        }
+    return options
+
+
+def is_transient(e):
+    """True for network and availability errors, which say nothing about the
+    query itself. Syntax, permission and missing table errors are not."""
+    if isinstance(e, (NonRecoverableNetworkError, UnsafeToRetryError)):
+        return False
+    if isinstance(e, (RequestError, ConnectionError)):
+        return True
+    message = str(e)
+    return any(hint in message for hint in TRANSIENT_MESSAGES)
+
+
+def with_retries(fn, operation, retries=SQL_RETRIES, check=None):
+    """Calls `fn`, retrying transient errors with jittered exponential backoff.
+
+    `check` is called before each retry and can raise to stop (e.g. when the
+    query has been cancelled).
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            # The connector has already retried for SQL_CONNECT_TIMEOUT seconds.
+            give_up = isinstance(e, MaxRetryDurationError) or not is_transient(e)
+            if give_up or attempt == retries:
+                raise
+            delay = random.uniform(
+                0, min(SQL_RETRY_BACKOFF_MAX, SQL_RETRY_BACKOFF * 2**attempt)
+            )
+            print(f"Retrying {operation} in {delay:.2f}s after error: {e}")
+            time.sleep(delay)
+            if check:
+                check()
+
+
+def execute(cursor, query, check=None, parameters=None):
+    with_retries(lambda: cursor.execute(query, parameters), "execute", check=check)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class _Circuit:
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opens = 0
+
+
+class CircuitBreaker:
+    """Stops sending queries to a warehouse that keeps failing.
+
+    After `failure_threshold` transient errors in a row the circuit for that
+    warehouse opens and queries fail with `CircuitOpen` straight away instead of
+    waiting for timeouts. After `reset_timeout` seconds one query is let through
+    as a probe: if it succeeds the circuit closes, otherwise it stays open for
+    another `reset_timeout`.
+    """
+
+    def __init__(
+        self,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=CIRCUIT_RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def guard(self, key):
+        if self.failure_threshold <= 0:
+            yield
+            return
+        self._before(key)
+        try:
+            yield
+        except Exception as e:
+            # Errors that are not transient mean the warehouse answered.
+            self._after(key, failed=is_transient(e))
+            raise
+        except BaseException:
+            self._after(key, failed=None)
+            raise
+        else:
+            self._after(key, failed=False)
+
+    def reset_after_fork(self):
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                key: {
+                    "state": circuit.state,
+                    "failures": circuit.failures,
+                    "opens": circuit.opens,
+                }
+                for key, circuit in self._circuits.items()
+            }
+
+    def _before(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                circuit = self._circuits[key] = _Circuit()
+            if circuit.state == "closed":
+                return
+            if circuit.state == "open":
+                wait = circuit.opened_at + self.reset_timeout - time.monotonic()
+                if wait > 0:
+                    raise CircuitOpen(
+                        "The SQL warehouse is not responding. Queries to it are "
+                        f"paused for another {math.ceil(wait)}s after repeated errors."
+                    )
+                circuit.state = "half-open"
+            if circuit.probing:
+                raise CircuitOpen(
+                    "The SQL warehouse is not responding. Checking whether it has "
+                    "recovered; try again shortly."
+                )
+            circuit.probing = True
+
+    def _after(self, key, failed):
+        with self._lock:
+            circuit = self._circuits[key]
+            if failed is None:
+                # Interrupted: neither a success nor a failure, but let another
+                # query probe the warehouse.
+                circuit.probing = False
+                return
+            if not failed:
+                circuit.state = "closed"
+                circuit.failures = 0
+                circuit.probing = False
+                return
+            circuit.failures += 1
+            if (
+                circuit.state == "half-open"
+                or circuit.failures >= self.failure_threshold
+            ):
+                if circuit.state != "open":
+                    circuit.opens += 1
+                circuit.state = "open"
+                circuit.opened_at = time.monotonic()
+                circuit.probing = False
+
+
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,145 @@
+import time
+
+import dash
+import dash_mantine_components as dmc
+from dash import callback, Input, Output, State, dash_table
+from flask import request
+from .functions import (
+    COMPARE_MAX_TABLES,
+    COMPARE_TABLE_TIMEOUT,
+    ROW_LIMIT,
+    ROW_LIMIT_MAX,
+    read_tables,
+)
+
+dash.register_page(
+    module=__name__,
+    name="Compare tables",
+    path="/tables/compare",
+    category="tables",
+)
+
+layout = dmc.Stack(
+    children=[
+        dmc.Title("Compare tables", order=1),
+        dmc.TagsInput(
+            id="compare-tables",
+            label="Table names",
+            description=f"Enter up to {COMPARE_MAX_TABLES} tables to read side by "
+            "side; press Enter after each",
+            value=["samples.nyctaxi.trips", "samples.tpch.orders"],
+            maxTags=COMPARE_MAX_TABLES,
+            splitChars=[",", " "],
+            clearable=True,
+            w=700,
+            styles={"input": {"font-family": "monospace"}},
+        ),
+        dmc.NumberInput(
+            id="compare-row-limit",
+            label="Row limit",
+            description="Rows to read from each table",
+            value=ROW_LIMIT,
+            min=1,
+            max=ROW_LIMIT_MAX,
+            step=100,
+            allowDecimal=False,
+            w=150,
+        ),
+        dmc.Button("Compare", id="run-compare", variant="outline"),
+        dmc.Text(id="compare-status", size="sm", c="dimmed"),
+        dmc.SimpleGrid(id="compare-output", cols=1, spacing="lg", w="100%"),
+    ],
+    align="flex-start",
+    gap="md",
+    style={"padding": "20px"},
+)
+
+
+def result_panel(result):
+    if result["error"]:
+        timed_out = result["error"].startswith("Timed out")
+        body = dmc.Alert(
+            result["error"],
+            title="Timed out" if timed_out else "Could not read the table",
+            color="orange" if timed_out else "red",
+        )
+        badges = []
+    else:
+        df = result["df"]
+        body = dash_table.DataTable(
+            data=df.to_dict("records"),
+            columns=[{"name": col, "id": col} for col in df.columns],
+            style_table={"overflowX": "auto", "width": "100%"},
+            style_header={
+                "backgroundColor": "#EEEDE9",
+                "fontWeight": "bold",
+            },
+            style_cell={
+                "textAlign": "left",
+                "padding": "8px",
+                "fontFamily": "DM Sans",
+                "maxWidth": "240px",
+                "overflow": "hidden",
+                "textOverflow": "ellipsis",
+            },
+            style_data_conditional=[
+                {
+                    "if": {"row_index": "odd"},
+                    "backgroundColor": "#F9F7F4",
+                }
+            ],
+            page_size=10,
+            sort_action="native",
+        )
+        badges = [
+            dmc.Badge(f"{result['total']:,} rows", variant="light"),
+            dmc.Badge(f"{len(df):,} shown", variant="outline", color="gray"),
+        ]
+    badges.append(dmc.Badge(f"{result['seconds']:.2f}s", variant="outline"))
+    return dmc.Paper(
+        [
+            dmc.Text(result["table"], fw=700, ff="monospace", mb="xs"),
+            dmc.Group(badges, gap="xs", mb="sm"),
+            body,
+        ],
+        p="md",
+        withBorder=True,
+        style={"minWidth": 0},
+    )
+
+
+@callback(
+    Output("compare-output", "children"),
+    Output("compare-output", "cols"),
+    Output("compare-status", "children"),
+    Input("run-compare", "n_clicks"),
+    State("compare-tables", "value"),
+    State("compare-row-limit", "value"),
+    running=[(Output("run-compare", "loading"), True, False)],
+    prevent_initial_call=True,
+)
+def compare_tables(n_clicks, table_names, limit):
+    # Each table is listed once, in the order it was entered.
+    table_names = list(dict.fromkeys(name.strip() for name in table_names or []))
+    table_names = [name for name in table_names if name]
+    if not table_names:
+        return [], 1, "Enter at least one table name."
+
+    user = request.headers.get("X-Forwarded-Email")
+    started = time.monotonic()
+    try:
+        results = read_tables(table_names, user, limit)
+    except ValueError as e:
+        return [], 1, str(e)
+    elapsed = time.monotonic() - started
+
+    failed = sum(1 for result in results if result["error"])
+    total = sum(result["seconds"] for result in results)
+    status = (
+        f"Read {len(results) - failed} of {len(results)} tables in {elapsed:.2f}s "
+        f"({total:.2f}s one after another). Tables not read within "
+        f"{COMPARE_TABLE_TIMEOUT:g}s are cancelled."
+    )
+    # Side by side, three to a row.
+    cols = min(len(results), 3)
+    return [result_panel(result) for result in results], cols, status
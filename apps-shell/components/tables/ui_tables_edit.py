@@ -1,6 +1,27 @@
 import dash
-from dash import html, dcc
+from dash import (
+    html,
+    dcc,
+    callback,
+    clientside_callback,
+    Input,
+    Output,
+    State,
+    dash_table,
+)
 import dash_mantine_components as dmc
+from flask import request
+from .admission import WarehouseBusy
+from .resilience import CircuitOpen, is_transient
+from .functions import (
+    ROW_LIMIT,
+    ROW_LIMIT_MAX,
+    describe_table,
+    primary_key,
+    read_table,
+    write_changes,
+)
+from .writeback import is_editable_type
 
 dash.register_page(
     module=__name__,
@@ -9,9 +30,262 @@ dash.register_page(
     category="tables",
 )
 
+NUMERIC_TYPES = {"tinyint", "smallint", "int", "bigint", "float", "double", "decimal"}
+
 layout = html.Div(
     [
         dmc.Title("Edit a table", order=1),
+        dmc.Stack(
+            [
+                dmc.TextInput(
+                    id="edit-table-name",
+                    label="Table name",
+                    description="Enter the table to edit",
+                    placeholder="catalog.schema.table",
+                    debounce=500,
+                    w=500,
+                    styles={"wrapper": {"font-family": "monospace"}},
+                ),
+                dmc.Group(
+                    [
+                        dmc.MultiSelect(
+                            id="edit-key-columns",
+                            label="Key columns",
+                            description="Identify each row; defaults to the "
+                            "primary key",
+                            data=[],
+                            value=[],
+                            searchable=True,
+                            w=500,
+                        ),
+                        dmc.NumberInput(
+                            id="edit-row-limit",
+                            label="Row limit",
+                            description="Rows to load",
+                            value=ROW_LIMIT,
+                            min=1,
+                            max=ROW_LIMIT_MAX,
+                            step=100,
+                            allowDecimal=False,
+                            w=150,
+                        ),
+                    ],
+                    align="flex-start",
+                ),
+                dmc.Group(
+                    [
+                        dmc.Button("Load rows", id="edit-load", variant="outline"),
+                        dmc.Button("Save changes", id="edit-save", disabled=True),
+                        dmc.Text(id="edit-change-count", size="sm"),
+                    ],
+                ),
+                dmc.Text(id="edit-status", size="sm", c="dimmed"),
+                # The rows as loaded, the table and key they were loaded with,
+                # the changes made since, and the rows just saved.
+                dcc.Store(id="edit-original"),
+                dcc.Store(id="edit-target"),
+                dcc.Store(id="edit-changes"),
+                dcc.Store(id="edit-saved"),
+                dash_table.DataTable(
+                    id="edit-table",
+                    editable=True,
+                    style_table={"marginTop": "20px", "width": "100%"},
+                    style_header={
+                        "backgroundColor": "#EEEDE9",
+                        "fontWeight": "bold",
+                    },
+                    style_cell={
+                        "textAlign": "left",
+                        "padding": "12px",
+                        "fontFamily": "DM Sans",
+                    },
+                    style_data={
+                        "whiteSpace": "normal",
+                        "height": "auto",
+                    },
+                    style_data_conditional=[
+                        {
+                            "if": {"row_index": "odd"},
+                            "backgroundColor": "#F9F7F4",
+                        },
+                        {
+                            "if": {"column_editable": False},
+                            "color": "#6F6F6F",
+                        },
+                    ],
+                    page_size=25,
+                    sort_action="native",
+                ),
+            ],
+            align="flex-start",
+            gap="md",
+        ),
     ],
     style={"padding": "20px"},
 )
+
+
+@callback(
+    Output("edit-key-columns", "data"),
+    Output("edit-key-columns", "value"),
+    Output("edit-key-columns", "error"),
+    Input("edit-table-name", "value"),
+)
+def load_key_columns(table_name):
+    if not table_name:
+        return [], [], None
+    user = request.headers.get("X-Forwarded-Email")
+    try:
+        columns = describe_table(table_name, user=user)
+        keys = primary_key(table_name, user=user)
+    except Exception as e:
+        return [], [], f"Could not read the table's columns: {e}"
+    data = [{"value": name, "label": f"{name} ({type_})"} for name, type_ in columns]
+    return data, keys, None
+
+
+@callback(
+    Output("edit-table", "data"),
+    Output("edit-table", "columns"),
+    Output("edit-original", "data"),
+    Output("edit-target", "data"),
+    Output("edit-status", "children", allow_duplicate=True),
+    Input("edit-load", "n_clicks"),
+    State("edit-table-name", "value"),
+    State("edit-key-columns", "value"),
+    State("edit-row-limit", "value"),
+    running=[(Output("edit-load", "loading"), True, False)],
+    prevent_initial_call=True,
+)
+def load_rows(n_clicks, table_name, keys, limit):
+    if not table_name:
+        return [], [], None, None, "Enter a table name."
+    if not keys:
+        return [], [], None, None, "Choose the key columns that identify each row."
+    user = request.headers.get("X-Forwarded-Email")
+    try:
+        types = dict(describe_table(table_name, user=user))
+        df = read_table(table_name, None, user, None, limit)
+    except (WarehouseBusy, CircuitOpen, ValueError) as e:
+        return [], [], None, None, str(e)
+    except Exception as e:
+        if is_transient(e):
+            return [], [], None, None, f"The SQL warehouse could not be reached: {e}"
+        return [], [], None, None, f"Could not load the table: {e}"
+
+    columns = [
+        {
+            "name": col,
+            "id": col,
+            # Key columns identify the rows to update, so they cannot change.
+            "editable": col not in keys and is_editable_type(types.get(col, "")),
+            "type": (
+                "numeric"
+                if types.get(col, "").split("(")[0].lower() in NUMERIC_TYPES
+                else "any"
+            ),
+        }
+        for col in df.columns
+    ]
+    data = df.to_dict("records")
+    target = {"table": table_name, "keys": keys}
+    return data, columns, data, target, f"Loaded {len(data)} rows."
+
+
+# Compares the grid with the rows as loaded in the browser, so only the changed
+# cells of the changed rows are sent when saving.
+clientside_callback(
+    """
+    function (data, original, target) {
+        if (!data || !original || !target) {
+            return [[], true, ""];
+        }
+        const changes = [];
+        let cells = 0;
+        for (let i = 0; i < data.length && i < original.length; i++) {
+            const before = original[i];
+            const after = data[i];
+            const old = {};
+            const edited = {};
+            let count = 0;
+            for (const col in after) {
+                if (JSON.stringify(after[col]) !== JSON.stringify(before[col])) {
+                    old[col] = before[col] === undefined ? null : before[col];
+                    edited[col] = after[col];
+                    count++;
+                }
+            }
+            if (count) {
+                const key = {};
+                target.keys.forEach((col) => (key[col] = before[col]));
+                changes.push({index: i, key: key, old: old, new: edited});
+                cells += count;
+            }
+        }
+        const summary = changes.length
+            ? `${cells} cells changed in ${changes.length} rows`
+            : "";
+        return [changes, changes.length === 0, summary];
+    }
+    """,
+    Output("edit-changes", "data"),
+    Output("edit-save", "disabled"),
+    Output("edit-change-count", "children"),
+    Input("edit-table", "data"),
+    Input("edit-original", "data"),
+    State("edit-target", "data"),
+)
+
+
+@callback(
+    Output("edit-saved", "data"),
+    Output("edit-status", "children"),
+    Input("edit-save", "n_clicks"),
+    State("edit-target", "data"),
+    State("edit-changes", "data"),
+    running=[(Output("edit-save", "loading"), True, False)],
+    prevent_initial_call=True,
+)
+def save_changes(n_clicks, target, changes):
+    if not target or not changes:
+        return dash.no_update, "There are no changes to save."
+    user = request.headers.get("X-Forwarded-Email")
+    try:
+        result = write_changes(target["table"], target["keys"], changes, user=user)
+    except (WarehouseBusy, CircuitOpen, ValueError) as e:
+        return dash.no_update, str(e)
+    except Exception as e:
+        if is_transient(e):
+            return dash.no_update, f"The SQL warehouse could not be reached: {e}"
+        return dash.no_update, f"Could not save the changes: {e}"
+
+    messages = [f"Saved {len(result['saved'])} of {len(changes)} changed rows."]
+    if result["conflicts"]:
+        messages.append(
+            f"{len(result['conflicts'])} rows were changed by someone else since "
+            "they were loaded and were not saved; load the rows again to see "
+            "the current values."
+        )
+    if result["error"]:
+        messages.append(f"The remaining rows were not saved: {result['error']}")
+    return result["saved"], " ".join(messages)
+
+
+# Saved rows become the new loaded values, so they no longer count as changes.
+clientside_callback(
+    """
+    function (saved, data, original) {
+        if (!saved || !saved.length || !original) {
+            return window.dash_clientside.no_update;
+        }
+        const updated = original.slice();
+        saved.forEach((i) => (updated[i] = data[i]));
+        return updated;
+    }
+    """,
+    Output("edit-original", "data", allow_duplicate=True),
+    Input("edit-saved", "data"),
+    State("edit-table", "data"),
+    State("edit-original", "data"),
+    prevent_initial_call=True,
+)
@@ -1,7 +1,24 @@
+import time
+
 import dash
 import dash_mantine_components as dmc
-from dash import callback, Input, Output, dash_table
-from .functions import get_connection, read_table
+from dash import callback, clientside_callback, dcc, Input, Output, State, dash_table
+from dash.exceptions import PreventUpdate
+from dash_iconify import DashIconify
+from flask import request
+from .admission import WarehouseBusy
+from .catalog import BROWSER_SUGGESTIONS, PLACEHOLDER, catalog_browser
+from .resilience import CircuitOpen, is_transient
+from .functions import (
+    ROW_LIMIT,
+    ROW_LIMIT_MAX,
+    QuerySuperseded,
+    describe_table,
+    get_cached_result,
+    latest_queries,
+    read_table,
+    result_key,
+)
 
 dash.register_page(
     module=__name__,
@@ -13,15 +30,75 @@ dash.register_page(
 layout = dmc.Stack(
     children=[
         dmc.Title("Read a table", order=1),
-        dmc.TextInput(
+        dmc.Autocomplete(
             id="table-name",
             label="Table name",
             description="Enter a table name to read from",
             value="samples.nyctaxi.trips",
+            data=[],
+            limit=BROWSER_SUGGESTIONS,
             w=500,
             styles={"wrapper": {"font-family": "monospace"}},
+            rightSection=dmc.ActionIcon(
+                DashIconify(icon="material-symbols:account-tree-outline", height=16),
+                id="read-browse-catalog",
+                variant="subtle",
+                color="gray",
+            ),
+            rightSectionPointerEvents="all",
+        ),
+        # The table name once typing has paused (see below).
+        dcc.Store(id="read-table-name-settled"),
+        dmc.Drawer(
+            dmc.Tree(
+                id="read-catalog-tree",
+                data=[],
+                selectOnClick=True,
+                expandOnClick=True,
+            ),
+            id="read-catalog-drawer",
+            title="Browse Unity Catalog",
+            position="right",
+            opened=False,
+        ),
+        dmc.Group(
+            [
+                dmc.MultiSelect(
+                    id="column-select",
+                    label="Columns",
+                    description="Leave empty to read all columns",
+                    placeholder="All columns",
+                    data=[],
+                    value=[],
+                    searchable=True,
+                    clearable=True,
+                    w=500,
+                ),
+                dmc.NumberInput(
+                    id="row-limit",
+                    label="Row limit",
+                    description="Rows to read",
+                    value=ROW_LIMIT,
+                    min=1,
+                    max=ROW_LIMIT_MAX,
+                    step=100,
+                    allowDecimal=False,
+                    w=150,
+                ),
+            ],
+            align="flex-start",
         ),
-        dmc.Button("Run query", id="run-query", variant="outline"),
+        dmc.Group(
+            [
+                dmc.Button("Run query", id="run-query", variant="outline"),
+                dmc.Switch(
+                    id="force-refresh",
+                    label="Bypass cached results",
+                    checked=False,
+                ),
+            ],
+        ),
+        dmc.Text(id="read-status", size="sm", c="dimmed"),
         dash_table.DataTable(
             id="table-output",
             style_table={"marginTop": "20px", "width": "100%"},
@@ -54,24 +131,138 @@ layout = dmc.Stack(
 )
 
 
+# The columns are loaded once the name has not changed for half a second, not on
+# every keystroke, since each lookup of an unknown name queries the warehouse.
+clientside_callback(
+    """
+    function (value) {
+        clearTimeout(window.readTableNameTimer);
+        window.readTableNameTimer = setTimeout(
+            () => dash_clientside.set_props("read-table-name-settled", {data: value}),
+            500
+        );
+        return dash_clientside.no_update;
+    }
+    """,
+    Output("read-table-name-settled", "data"),
+    Input("table-name", "value"),
+)
+
+
+@callback(
+    Output("column-select", "data"),
+    Output("column-select", "value"),
+    Output("column-select", "error"),
+    Input("read-table-name-settled", "data"),
+    State("column-select", "value"),
+)
+def load_columns(table_name, selected):
+    if not table_name:
+        return [], [], None
+    # The name is still being typed (see catalog.py).
+    if catalog_browser.is_partial(table_name):
+        raise PreventUpdate
+    try:
+        columns = describe_table(
+            table_name, user=request.headers.get("X-Forwarded-Email")
+        )
+    except Exception as e:
+        return [], [], f"Could not read the table's columns: {e}"
+    names = {name for name, _ in columns}
+    data = [{"value": name, "label": f"{name} ({type_})"} for name, type_ in columns]
+    return data, [c for c in selected or [] if c in names], None
+
+
+@callback(
+    Output("table-name", "data"),
+    Input("table-name", "value"),
+)
+def suggest_tables(text):
+    # Answered from the cached catalog listings, not an API call per keystroke.
+    return catalog_browser.suggest(text)
+
+
+@callback(
+    Output("read-catalog-drawer", "opened"),
+    Output("read-catalog-tree", "data"),
+    Output("read-catalog-tree", "expanded"),
+    Input("read-browse-catalog", "n_clicks"),
+    prevent_initial_call=True,
+)
+def open_catalog_browser(_):
+    return True, catalog_browser.tree_nodes(), []
+
+
+@callback(
+    Output("read-catalog-tree", "data", allow_duplicate=True),
+    Input("read-catalog-tree", "expanded"),
+    State("read-catalog-tree", "data"),
+    prevent_initial_call=True,
+)
+def expand_catalog_tree(expanded, data):
+    # Schemas and tables are listed when their parent is first expanded.
+    if not catalog_browser.expand_tree(data, expanded):
+        raise PreventUpdate
+    return data
+
+
+@callback(
+    Output("table-name", "value"),
+    Output("read-catalog-drawer", "opened", allow_duplicate=True),
+    Input("read-catalog-tree", "selected"),
+    prevent_initial_call=True,
+)
+def pick_table(selected):
+    value = selected[0] if selected else ""
+    if value.count(".") != 2 or value.endswith(PLACEHOLDER):
+        raise PreventUpdate
+    return value, False
+
+
 @callback(
     Output("table-output", "data"),
     Output("table-output", "columns"),
+    Output("read-status", "children"),
     Input("run-query", "n_clicks"),
-    Input("table-name", "value"),
+    State("table-name", "value"),
+    State("column-select", "value"),
+    State("row-limit", "value"),
+    State("force-refresh", "checked"),
+    running=[(Output("run-query", "loading"), True, False)],
 )
-def read_table_callback(n_clicks, table_name):
-    if not n_clicks:
-        return [], []
+def read_table_callback(
+    n_clicks, table_name, columns=None, limit=None, force_refresh=False
+):
+    # The table name is only read when the button is clicked, so typing in the
+    # text box does not run any queries.
+    if not n_clicks or not table_name:
+        return [], [], ""
 
+    user = request.headers.get("X-Forwarded-Email")
     try:
-        conn = get_connection()
-        df = read_table(table_name, conn)
+        key = result_key(table_name, columns, limit)
+        cached = None if force_refresh else get_cached_result(key)
+        if cached is not None:
+            df, cached_at = cached
+            status = f"Cached result from {time.time() - cached_at:.0f}s ago."
+        else:
+            # Clicking again while a query is running cancels the earlier one.
+            latest_key = user or "app"
+            latest = (latest_key, latest_queries.start(latest_key))
+            df = read_table(table_name, None, user, columns, limit, latest)
+            status = ""
 
         data = df.to_dict("records")
 
         columns = [{"name": col, "id": col, "deletable": False} for col in df.columns]
 
-        return data, columns
+        return data, columns, status
+    except QuerySuperseded:
+        # The page is waiting for the newer query instead.
+        raise PreventUpdate
+    except (WarehouseBusy, CircuitOpen, ValueError) as e:
+        return [], [], str(e)
     except Exception as e:
-        return [], []
+        if is_transient(e):
+            return [], [], f"The SQL warehouse could not be reached: {e}"
+        return [], [], f"Could not read the table: {e}"
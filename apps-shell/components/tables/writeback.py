@@ -0,0 +1,136 @@
+import json
+
+from .querybuilder import quote_identifier, quote_table_name
+
+# Types that cannot be typed into a grid cell and cast back from text.
+NOT_EDITABLE_TYPES = ("array", "map", "struct", "binary", "variant")
+
+
+def is_editable_type(type_):
+    return not type_.lower().startswith(NOT_EDITABLE_TYPES)
+
+
+def as_text(value):
+    """Cell values are sent to the warehouse as text and cast to the column type
+    there, so a value that does not fit the column fails the statement instead
+    of being written as NULL."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def validate_changes(changes, keys, types):
+    """Checks the changes sent by the page against the table's columns.
+
+    Each change is {"index": row index in the grid, "key": {key column: value},
+    "old": {column: loaded value}, "new": {column: edited value}}.
+    """
+    if not keys:
+        raise ValueError("Choose the key columns that identify each row")
+    unknown = set(keys) - set(types)
+    if unknown:
+        raise ValueError(f"Unknown key column(s): {', '.join(sorted(unknown))}")
+    for change in changes:
+        if set(change["key"]) != set(keys):
+            raise ValueError("The changes were made with different key columns")
+        columns = set(change["new"])
+        if columns != set(change["old"]):
+            raise ValueError("Each changed cell needs its loaded value")
+        unknown = columns - set(types)
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(sorted(unknown))}")
+        if columns & set(keys):
+            raise ValueError("Key columns cannot be edited")
+        for column in columns:
+            if not is_editable_type(types[column]):
+                raise ValueError(f"Column {column} ({types[column]}) is not editable")
+
+
+def source_rows(chunk, keys, columns):
+    """The chunk as JSON for `build_source`, with positional field names."""
+    rows = []
+    for change in chunk:
+        row = {"i": change["index"], "changed": []}
+        for j, key in enumerate(keys):
+            row[f"k{j}"] = as_text(change["key"][key])
+        for j, column in enumerate(columns):
+            if column in change["new"]:
+                row["changed"].append(j)
+                row[f"n{j}"] = as_text(change["new"][column])
+                row[f"o{j}"] = as_text(change["old"][column])
+        rows.append(row)
+    return json.dumps(rows)
+
+
+def build_source(keys, columns):
+    """Subquery that unpacks the `:rows` parameter into one row per change.
+
+    Sending a chunk as a single JSON parameter keeps the statement the same size
+    however many rows changed, and no values are spliced into the SQL.
+    """
+    fields = ["i: int", "changed: array<int>"]
+    fields += [f"k{j}: string" for j in range(len(keys))]
+    for j in range(len(columns)):
+        fields += [f"n{j}: string", f"o{j}: string"]
+    schema = f"array<struct<{', '.join(fields)}>>"
+    return f"(SELECT inline(from_json(:rows, '{schema}')))"
+
+
+def _key_condition(keys, types):
+    return " AND ".join(
+        f"t.{quote_identifier(key)} = CAST(s.k{j} AS {types[key]})"
+        for j, key in enumerate(keys)
+    )
+
+
+def _cells_match(columns, types, prefix):
+    # True when every changed cell of the row holds the `prefix` (old or new)
+    # value. Unchanged cells are not compared.
+    return " AND ".join(
+        f"(NOT array_contains(s.changed, {j}) OR "
+        f"t.{quote_identifier(column)} <=> CAST(s.{prefix}{j} AS {types[column]}))"
+        for j, column in enumerate(columns)
+    )
+
+
+def build_merge(table_name, keys, columns, types):
+    """One MERGE for a chunk of changed rows.
+
+    A row is only updated if the cells being changed still hold the values the
+    page loaded, so edits made by someone else in the meantime are not
+    overwritten (optimistic concurrency).
+    """
+    assignments = ", ".join(
+        f"{quote_identifier(column)} = CASE WHEN array_contains(s.changed, {j}) "
+        f"THEN CAST(s.n{j} AS {types[column]}) ELSE t.{quote_identifier(column)} END"
+        for j, column in enumerate(columns)
+    )
+    return (
+        f"MERGE INTO {quote_table_name(table_name)} AS t "
+        f"USING {build_source(keys, columns)} AS s "
+        f"ON {_key_condition(keys, types)} "
+        f"WHEN MATCHED AND {_cells_match(columns, types, 'o')} "
+        f"THEN UPDATE SET {assignments}"
+    )
+
+
+def build_conflict_query(table_name, keys, columns, types):
+    """Grid row indices of the chunk's rows that do not hold the new values,
+    because they were changed or deleted by someone else."""
+    return (
+        f"SELECT s.i FROM {build_source(keys, columns)} AS s "
+        f"LEFT JOIN (SELECT *, true AS `__found` "
+        f"FROM {quote_table_name(table_name)}) AS t "
+        f"ON {_key_condition(keys, types)} "
+        f"WHERE t.`__found` IS NULL OR NOT ({_cells_match(columns, types, 'n')})"
+    )
+
+
+def build_duplicate_key_query(table_name, keys):
+    key_list = ", ".join(quote_identifier(key) for key in keys)
+    return (
+        f"SELECT 1 FROM {quote_table_name(table_name)} "
+        f"GROUP BY {key_list} HAVING COUNT(*) > 1 LIMIT 1"
+    )
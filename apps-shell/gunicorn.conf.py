@@ -0,0 +1,25 @@
+import os
+
+bind = f"0.0.0.0:{os.getenv('DATABRICKS_APP_PORT', '8000')}"
+worker_class = "gthread"
+# Cancelling a superseded query, the result and schema caches, the connection
+# pool and the per-warehouse query limits all live in the memory of one worker,
+# and a browser's requests are not routed back to the same worker. The app
+# therefore runs as one process with many threads unless GUNICORN_WORKERS is
+# set; each extra worker multiplies the warehouse limits and splits the caches.
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+# Import the app (and register its pages) once in the master so workers start
+# from a warm copy.
+preload_app = True
+
+
+def post_fork(server, worker):
+    from components.tables.functions import reset_after_fork
+
+    reset_after_fork()
@@ -1,22 +1,71 @@
+import hmac
+import math
+import os
+from urllib.parse import urlencode
+
 import dash
 import dash_mantine_components as dmc
-from dash import Dash, Input, Output, State, callback, dcc, html
+from dash import (
+    Dash,
+    Input,
+    Output,
+    Patch,
+    State,
+    callback,
+    clientside_callback,
+    ctx,
+    dcc,
+    html,
+)
+from dash.exceptions import PreventUpdate
+from flask import Response, jsonify, request
 
+import auth
 from auth import (
-    cfg,
+    connection_for,
     fetch_sp_details,
-    get_connection_obo,
-    get_connection_sp,
     get_user_token,
+    obo_sessions,
+    request_auth,
+    sp_credentials,
+    sp_pool,
 )
+from export import EXPORT_FORMATS
 from sql import (
+    export_table,
+    admitted,
+    SQL_ROW_LIMIT,
+    SQL_ROW_LIMIT_MAX,
+    describe_table,
+    fetch_table_cached,
     fetch_warehouses,
-    run_query,
+    is_listed_warehouse,
+    warehouse_status,
+    run_page_query,
+    select_columns,
+    sp_queries,
+)
+from admission import WarehouseBusy, admission
+from cache import schema_cache, workspace_cache
+from catalog import BROWSER_SUGGESTIONS, PLACEHOLDER, catalog_browser
+from jobs import job_runner
+from metrics import (
+    METRICS_ENABLED,
+    GaugeFunction,
+    StageTimer,
+    queries_total,
+    render,
+    warehouse_label,
 )
-from utils import create_data_table, get_icon
+from resilience import CircuitOpen, circuit_breaker
+from resultcache import result_cache
+from utils import create_data_table, create_tooltips, get_icon
+from warehouses import WAREHOUSE_AUTO_START, warehouse_starter
+from warmup import start_warmup, warmup_state
 
 app = Dash(external_stylesheets=[dmc.styles.ALL])
 app.title = "Databricks Auth Demo"
+server = app.server
 
 app.layout = dmc.MantineProvider(
     theme={
@@ -88,41 +137,127 @@ app.layout = dmc.MantineProvider(
                         dmc.Grid(
                             [
                                 dmc.GridCol(
-                                    dmc.Select(
-                                        id="sql-http-path",
-                                        label="Select SQL Warehouse",
-                                        description="Choose a running SQL warehouse.",
-                                        data=[],
-                                        value=None,
-                                        required=True,
-                                        style={"width": "100%"},
-                                        searchable=True,
-                                        nothingFoundMessage="No warehouses found",
-                                        leftSection=get_icon(
-                                            "material-symbols:database-outline"
+                                    [
+                                        dmc.Select(
+                                            id="sql-http-path",
+                                            label="Select SQL Warehouse",
+                                            description="Choose a running SQL warehouse.",
+                                            data=[],
+                                            value=None,
+                                            required=True,
+                                            style={"width": "100%"},
+                                            searchable=True,
+                                            nothingFoundMessage="No warehouses found",
+                                            leftSection=get_icon(
+                                                "material-symbols:database-outline"
+                                            ),
                                         ),
-                                    ),
+                                        dmc.Button(
+                                            "Start warehouse",
+                                            id="start-warehouse",
+                                            size="xs",
+                                            variant="light",
+                                            mt="xs",
+                                            display="none",
+                                            leftSection=get_icon(
+                                                "material-symbols:play-arrow-outline"
+                                            ),
+                                        ),
+                                    ],
                                     span=6,
                                 ),
                                 dmc.GridCol(
-                                    dmc.TextInput(
+                                    dmc.Autocomplete(
                                         id="table-name-input",
                                         label="Unity Catalog Table Name",
                                         description="Format: catalog.schema.table",
                                         placeholder="main.sandbox.my_table",
                                         value="samples.nyctaxi.trips",
+                                        data=[],
+                                        limit=BROWSER_SUGGESTIONS,
                                         required=True,
                                         style={"width": "100%"},
                                         leftSection=get_icon(
                                             "material-symbols:table-outline"
                                         ),
+                                        rightSection=dmc.ActionIcon(
+                                            get_icon(
+                                                "material-symbols:account-tree-outline"
+                                            ),
+                                            id="browse-catalog",
+                                            variant="subtle",
+                                            color="gray",
+                                        ),
+                                        rightSectionPointerEvents="all",
                                     ),
                                     span=6,
                                 ),
+                                dmc.GridCol(
+                                    dmc.MultiSelect(
+                                        id="column-select",
+                                        label="Columns",
+                                        description="Leave empty to select all columns.",
+                                        placeholder="All columns",
+                                        data=[],
+                                        value=[],
+                                        searchable=True,
+                                        clearable=True,
+                                        style={"width": "100%"},
+                                        leftSection=get_icon(
+                                            "material-symbols:view-column-outline"
+                                        ),
+                                    ),
+                                    span=9,
+                                ),
+                                dmc.GridCol(
+                                    dmc.NumberInput(
+                                        id="row-limit",
+                                        label="Row limit",
+                                        description="Rows to load without server-side paging.",
+                                        value=SQL_ROW_LIMIT,
+                                        min=1,
+                                        max=SQL_ROW_LIMIT_MAX,
+                                        step=100,
+                                        allowDecimal=False,
+                                        style={"width": "100%"},
+                                    ),
+                                    span=3,
+                                ),
                             ],
                             mb="lg",
                             gutter="xl",
                         ),
+                        dmc.Drawer(
+                            dmc.Tree(
+                                id="catalog-tree",
+                                data=[],
+                                selectOnClick=True,
+                                expandOnClick=True,
+                            ),
+                            id="catalog-drawer",
+                            title="Browse Unity Catalog",
+                            position="right",
+                            opened=False,
+                        ),
+                        dmc.Group(
+                            [
+                                dmc.Switch(
+                                    id="server-side-switch",
+                                    label="Server-side paging, sorting and filtering",
+                                    description="Push paging, sorting and filtering down to the SQL warehouse instead of loading the first 1,000 rows.",
+                                    checked=False,
+                                ),
+                                dmc.Switch(
+                                    id="force-refresh-switch",
+                                    label="Force refresh",
+                                    description="Bypass cached results and re-run the query on the SQL warehouse.",
+                                    checked=False,
+                                ),
+                            ],
+                            align="flex-start",
+                            grow=True,
+                            mb="lg",
+                        ),
                         dmc.Stack(
                             [
                                 dmc.Paper(
@@ -155,19 +290,56 @@ app.layout = dmc.MantineProvider(
                                             size="sm",
                                             mb="md",
                                         ),
-                                        dmc.Button(
-                                            "Run Query (SP)",
-                                            id="run-query-sp",
-                                            variant="outline",
-                                            leftSection=get_icon(
-                                                "material-symbols:play-arrow-outline"
-                                            ),
+                                        dmc.Group(
+                                            [
+                                                dmc.Button(
+                                                    "Run Query (SP)",
+                                                    id="run-query-sp",
+                                                    variant="outline",
+                                                    leftSection=get_icon(
+                                                        "material-symbols:play-arrow-outline"
+                                                    ),
+                                                    loading=False,
+                                                    loaderProps={
+                                                        "variant": "dots",
+                                                        "size": "sm",
+                                                    },
+                                                ),
+                                                dmc.Button(
+                                                    "Cancel",
+                                                    id="cancel-query-sp",
+                                                    variant="subtle",
+                                                    color="gray",
+                                                    leftSection=get_icon(
+                                                        "material-symbols:stop-outline"
+                                                    ),
+                                                    disabled=True,
+                                                ),
+                                                html.A(
+                                                    dmc.Button(
+                                                        "CSV",
+                                                        variant="subtle",
+                                                        leftSection=get_icon(
+                                                            "material-symbols:download"
+                                                        ),
+                                                    ),
+                                                    id="download-csv-sp",
+                                                    download="",
+                                                ),
+                                                html.A(
+                                                    dmc.Button(
+                                                        "Parquet",
+                                                        variant="subtle",
+                                                        leftSection=get_icon(
+                                                            "material-symbols:download"
+                                                        ),
+                                                    ),
+                                                    id="download-parquet-sp",
+                                                    download="",
+                                                ),
+                                            ],
+                                            gap="sm",
                                             mb="md",
-                                            loading=False,
-                                            loaderProps={
-                                                "variant": "dots",
-                                                "size": "sm",
-                                            },
                                         ),
                                         dmc.Alert(
                                             id="alert-sp",
@@ -225,19 +397,56 @@ app.layout = dmc.MantineProvider(
                                             mb="md",
                                             radius="sm",
                                         ),
-                                        dmc.Button(
-                                            "Run Query (OBO)",
-                                            id="run-query-obo",
-                                            variant="outline",
-                                            leftSection=get_icon(
-                                                "material-symbols:play-arrow-outline"
-                                            ),
+                                        dmc.Group(
+                                            [
+                                                dmc.Button(
+                                                    "Run Query (OBO)",
+                                                    id="run-query-obo",
+                                                    variant="outline",
+                                                    leftSection=get_icon(
+                                                        "material-symbols:play-arrow-outline"
+                                                    ),
+                                                    loading=False,
+                                                    loaderProps={
+                                                        "variant": "dots",
+                                                        "size": "sm",
+                                                    },
+                                                ),
+                                                dmc.Button(
+                                                    "Cancel",
+                                                    id="cancel-query-obo",
+                                                    variant="subtle",
+                                                    color="gray",
+                                                    leftSection=get_icon(
+                                                        "material-symbols:stop-outline"
+                                                    ),
+                                                    disabled=True,
+                                                ),
+                                                html.A(
+                                                    dmc.Button(
+                                                        "CSV",
+                                                        variant="subtle",
+                                                        leftSection=get_icon(
+                                                            "material-symbols:download"
+                                                        ),
+                                                    ),
+                                                    id="download-csv-obo",
+                                                    download="",
+                                                ),
+                                                html.A(
+                                                    dmc.Button(
+                                                        "Parquet",
+                                                        variant="subtle",
+                                                        leftSection=get_icon(
+                                                            "material-symbols:download"
+                                                        ),
+                                                    ),
+                                                    id="download-parquet-obo",
+                                                    download="",
+                                                ),
+                                            ],
+                                            gap="sm",
                                             mb="md",
-                                            loading=False,
-                                            loaderProps={
-                                                "variant": "dots",
-                                                "size": "sm",
-                                            },
                                         ),
                                         dmc.Alert(
                                             id="alert-obo",
@@ -271,6 +480,15 @@ app.layout = dmc.MantineProvider(
                         ),
                         html.Div(id="initial-load-trigger", style={"display": "none"}),
                         dcc.Store(id="obo-token-store"),
+                        dcc.Store(id="table-name-settled"),
+                        dcc.Store(id="warehouse-default"),
+                        dcc.Store(id="query-sp"),
+                        dcc.Store(id="query-obo"),
+                        dcc.Store(id="job-sp"),
+                        dcc.Store(id="job-obo"),
+                        dcc.Interval(id="poll-sp", interval=500, disabled=True),
+                        dcc.Interval(id="poll-obo", interval=500, disabled=True),
+                        dcc.Interval(id="poll-warehouse", interval=3000, disabled=True),
                     ],
                     fluid=False,
                     p="0",
@@ -292,6 +510,7 @@ app.layout = dmc.MantineProvider(
         Output("obo-username", "children"),
         Output("sql-http-path", "data"),
         Output("sql-http-path", "value"),
+        Output("warehouse-default", "data"),
         Output("sp-name-display", "children"),
     ],
     Input("initial-load-trigger", "children"),
@@ -312,8 +531,6 @@ def update_header_and_warehouses(_):
     obo_username = ["Current user: ", html.B("Unknown")]
 
     try:
-        from flask import request
-
         headers = dict(request.headers)
         username = headers.get("X-Forwarded-Preferred-Username")
         obo_token = headers.get("X-Forwarded-Access-Token")
@@ -373,305 +590,910 @@ def update_header_and_warehouses(_):
         # Return warehouse data and initial value
         wh_options,
         wh_value,
+        wh_value,
         # Return SP name
         sp_name,
     )
 
 
 @callback(
-    [
-        Output("table-output-sp", "data"),
-        Output("table-output-sp", "columns"),
-        Output("table-output-sp", "tooltip_data"),
-        Output("alert-sp", "children"),
-        Output("alert-sp", "color"),
-        Output("alert-sp", "hide"),
-        Output("alert-sp", "title"),
-        Output("table-container-sp", "style"),
-        Output("loading-overlay-sp", "visible"),
-        Output("run-query-sp", "loading"),
-    ],
-    Input("run-query-sp", "n_clicks"),
-    State("sql-http-path", "value"),
-    State("table-name-input", "value"),
-    running=[
-        (Output("run-query-sp", "loading"), True, False),
-    ],
+    Output("sql-http-path", "description"),
+    Output("sql-http-path", "error"),
+    Output("poll-warehouse", "disabled"),
+    Output("start-warehouse", "display"),
+    Input("sql-http-path", "value"),
+    Input("start-warehouse", "n_clicks"),
+    Input("poll-warehouse", "n_intervals"),
+    State("warehouse-default", "data"),
     prevent_initial_call=True,
 )
-def run_sp_query_callback(n_clicks, http_path, table_name):
-    container_style = {"display": "none"}
-    loading_visible = False
+def update_warehouse_status(http_path, _, __, default_path):
+    if not http_path:
+        return "Choose a running SQL warehouse.", None, True, "none"
+    # A stopped warehouse is only started when the user asks for it, so it can
+    # warm up while the table name is filled in; the interval then follows it
+    # until it is running. With WAREHOUSE_AUTO_START, choosing it in the list
+    # is enough, but not the warehouse selected when the page loads.
+    start = ctx.triggered_id == "start-warehouse" or (
+        WAREHOUSE_AUTO_START
+        and ctx.triggered_id == "sql-http-path"
+        and http_path != default_path
+    )
+    description, error, polling, startable = warehouse_status(http_path, start)
+    return description, error, not polling, "block" if startable else "none"
 
-    if not n_clicks or not http_path or not table_name:
-        return dash.no_update + (False, False)
 
-    if not cfg:
-        return (
-            [],
-            [],
-            [],
-            [
-                "Error: Databricks SDK not configured. Check environment variables like ",
-                dmc.InlineCodeHighlight(code="DATABRICKS_HOST"),
-                " etc.",
-            ],
-            "red",
-            False,
-            "Configuration Error",
-            container_style,
-            False,
-            False,
+# The table name is copied to a store once it has not changed for half a second,
+# so the columns are looked up when typing pauses instead of on every keystroke.
+clientside_callback(
+    """
+    function (value) {
+        clearTimeout(window.tableNameTimer);
+        window.tableNameTimer = setTimeout(
+            () => dash_clientside.set_props("table-name-settled", {data: value}),
+            500
+        );
+        return dash_clientside.no_update;
+    }
+    """,
+    Output("table-name-settled", "data"),
+    Input("table-name-input", "value"),
+)
+
+
+@callback(
+    Output("column-select", "data"),
+    Output("column-select", "value"),
+    Output("column-select", "error"),
+    Input("table-name-settled", "data"),
+    Input("sql-http-path", "value"),
+    State("column-select", "value"),
+)
+def load_columns(table_name, http_path, selected):
+    if not table_name or not http_path or not auth.config_available():
+        return [], [], None
+    # The name is still being typed (see catalog.py).
+    if catalog_browser.is_partial(table_name):
+        raise PreventUpdate
+    # The picker is shared by both panels, so the columns are read as the service
+    # principal, or as the user if the service principal cannot see the table.
+    auth_modes = ["sp", "obo"] if get_user_token() else ["sp"]
+    for auth_mode in auth_modes:
+        try:
+            columns = describe_table(request_auth(auth_mode), http_path, table_name)
+            break
+        except Exception as e:
+            error = f"Could not read the table's columns: {e}"
+    else:
+        return [], [], error
+    data = [
+        {"value": name, "label": f"{name} ({data_type})"} for name, data_type in columns
+    ]
+    names = {name for name, _ in columns}
+    # Keep the selection when the same table is loaded on another warehouse.
+    return data, [c for c in selected or [] if c in names], None
+
+
+@callback(
+    Output("table-name-input", "data"),
+    Input("table-name-input", "value"),
+)
+def suggest_tables(text):
+    # Answered from the cached catalog listings, not an API call per keystroke.
+    if not auth.config_available():
+        return []
+    return catalog_browser.suggest(text)
+
+
+@callback(
+    Output("catalog-drawer", "opened"),
+    Output("catalog-tree", "data"),
+    Output("catalog-tree", "expanded"),
+    Input("browse-catalog", "n_clicks"),
+    prevent_initial_call=True,
+)
+def open_catalog_browser(_):
+    if not auth.config_available():
+        raise PreventUpdate
+    return True, catalog_browser.tree_nodes(), []
+
+
+@callback(
+    Output("catalog-tree", "data", allow_duplicate=True),
+    Input("catalog-tree", "expanded"),
+    State("catalog-tree", "data"),
+    prevent_initial_call=True,
+)
+def expand_catalog_tree(expanded, data):
+    # Schemas and tables are listed when their parent is first expanded.
+    if not catalog_browser.expand_tree(data, expanded):
+        raise PreventUpdate
+    return data
+
+
+@callback(
+    Output("table-name-input", "value"),
+    Output("catalog-drawer", "opened", allow_duplicate=True),
+    Input("catalog-tree", "selected"),
+    prevent_initial_call=True,
+)
+def pick_table(selected):
+    value = selected[0] if selected else ""
+    if value.count(".") != 2 or value.endswith(PLACEHOLDER):
+        raise PreventUpdate
+    return value, False
+
+
+def query_outputs(
+    alert_msg,
+    alert_color,
+    alert_title,
+    data=None,
+    columns=None,
+    query=None,
+    alert_hide=False,
+    job=None,
+    tooltips=None,
+):
+    running = job is not None
+    return (
+        data or [],
+        columns or [],
+        create_tooltips(data or []) if tooltips is None else tooltips,
+        alert_msg,
+        alert_color,
+        alert_hide,
+        alert_title,
+        {"display": "block" if data else "none"},
+        False,
+        running,
+        query,
+        0,
+        [],
+        "",
+        1,
+        job,
+        not running,
+        not running,
+    )
+
+
+def serialize_rows(table, timer):
+    # pyarrow is only imported once the first result arrives (or by the
+    # startup warm-up), to keep it out of the app's import time.
+    from normalize import to_records
+
+    with timer.stage("records"):
+        records = to_records(table)
+    with timer.stage("tooltips"):
+        tooltips = create_tooltips(records)
+    return records, tooltips
+
+
+def append_rows(outputs, batches, timer):
+    # Streamed batches are appended to the rows already in the browser.
+    outputs = list(outputs)
+    batches = [batch for batch in batches if batch.num_rows]
+    if batches:
+        import pyarrow as pa
+
+        table = pa.concat_tables(batches)
+        records, tooltip_rows = serialize_rows(table, timer)
+        data, tooltips = Patch(), Patch()
+        data.extend(records)
+        tooltips.extend(tooltip_rows)
+        outputs[0:3] = [
+            data,
+            [{"name": i, "id": i} for i in table.column_names],
+            tooltips,
+        ]
+        outputs[7] = {"display": "block"}
+    else:
+        outputs[0:3] = [dash.no_update] * 3
+        outputs[7] = dash.no_update
+    return tuple(outputs)
+
+
+def progress_outputs(job, batches, offset, job_info, timer):
+    outputs = [dash.no_update] * len(query_outputs(None, None, None))
+    outputs[3:7] = [
+        [job.progress, " (", html.B(f"{job.elapsed:.0f}s"), ")"],
+        "blue",
+        False,
+        "Running",
+    ]
+    if batches:
+        # Sent back by the next poll to acknowledge the rows appended here.
+        outputs[15] = {**job_info, "offset": offset}
+    return append_rows(outputs, batches, timer)
+
+
+def config_error_outputs():
+    return query_outputs(
+        [
+            "Error: Databricks SDK not configured. Check environment variables like ",
+            dmc.InlineCodeHighlight(code="DATABRICKS_HOST"),
+            " etc.",
+        ],
+        "red",
+        "Configuration Error",
+    )
+
+
+def obo_token_missing_message():
+    return [
+        "Error: ",
+        dmc.InlineCodeHighlight(code="X-Forwarded-Access-Token"),
+        " not found in this request's headers. Cannot run OBO query. Ensure OBO is enabled for the App.",
+    ]
+
+
+def cached_at_message(cached_at):
+    if not cached_at:
+        return []
+    return [
+        " Served from cache at ",
+        html.B(cached_at.strftime("%H:%M:%S")),
+        "; turn on Force refresh to re-run it.",
+    ]
+
+
+def unavailable_title(e):
+    # Titles for queries that were turned away before reaching the warehouse.
+    if isinstance(e, CircuitOpen):
+        return "Warehouse unavailable"
+    return "Warehouse busy"
+
+
+def query_error_message(auth_mode, e):
+    if auth_mode == "sp":
+        return ["Error querying with Service Principal: ", dmc.Code(str(e))]
+
+    alert_msg_base = ["Error querying with OBO: ", dmc.Code(str(e))]
+    if (
+        "PERMISSION_DENIED" in str(e).upper()
+        or "DOES NOT HAVE PRIVILEGE" in str(e).upper()
+    ):
+        return alert_msg_base + [
+            " | Check if the user has SELECT permissions on the table and USE on the warehouse/catalog/schema."
+        ]
+    elif "OBO token not found" in str(e):
+        return [
+            "Error: OBO token missing ( ",
+            dmc.InlineCodeHighlight(code="X-Forwarded-Access-Token"),
+            " ). Ensure OBO is enabled for this App and you are accessing it through Databricks.",
+        ]
+    return alert_msg_base
+
+
+def query_callback_outputs(auth_mode, allow_duplicate=False):
+    table_id = f"table-output-{auth_mode}"
+    return [
+        Output(component_id, prop, allow_duplicate=allow_duplicate)
+        for component_id, prop in (
+            (table_id, "data"),
+            (table_id, "columns"),
+            (table_id, "tooltip_data"),
+            (f"alert-{auth_mode}", "children"),
+            (f"alert-{auth_mode}", "color"),
+            (f"alert-{auth_mode}", "hide"),
+            (f"alert-{auth_mode}", "title"),
+            (f"table-container-{auth_mode}", "style"),
+            (f"loading-overlay-{auth_mode}", "visible"),
+            (f"run-query-{auth_mode}", "loading"),
+            (f"query-{auth_mode}", "data"),
+            (table_id, "page_current"),
+            (table_id, "sort_by"),
+            (table_id, "filter_query"),
+            (table_id, "page_count"),
+            (f"job-{auth_mode}", "data"),
+            (f"poll-{auth_mode}", "disabled"),
+            (f"cancel-query-{auth_mode}", "disabled"),
         )
+    ]
 
-    loading_visible = True
 
-    alert_hide = False
+def submit_query(
+    auth, http_path, table_name, force_refresh, previous_job, columns, limit
+):
+    def run(job):
+        return fetch_table_cached(
+            auth, http_path, table_name, force_refresh, job, columns, limit
+        )
 
-    try:
-        conn = get_connection_sp(http_path)
-        df = run_query(table_name, conn)
-        conn.close()
-        loading_visible = False
-
-        if not df.empty:
-            data = df.to_dict("records")
-            columns = [{"name": i, "id": i} for i in df.columns]
-            tooltips = [
-                {
-                    column: {"value": str(value), "type": "markdown"}
-                    for column, value in row.items()
-                }
-                for row in data
-            ]
-            alert_msg = [
-                "Success! Fetched ",
-                html.B(f"{len(df)}"),
-                " rows from ",
-                dmc.Code(f"{table_name}"),
-                " using the service principal's permissions.",
-            ]
-            alert_color = "green"
-            alert_title = "Success"
-            container_style = {"display": "block"}
-            return (
-                data,
-                columns,
-                tooltips,
-                alert_msg,
-                alert_color,
-                alert_hide,
-                alert_title,
-                container_style,
-                loading_visible,
-                False,
-            )
-        else:
-            alert_msg = [
-                "Query ran successfully using Service Principal but returned no data from ",
-                dmc.Code(f"'{table_name}'"),
-                ".",
-            ]
-            alert_color = "yellow"
-            alert_title = "No Data"
-            return (
-                [],
-                [],
-                [],
-                alert_msg,
-                alert_color,
-                alert_hide,
-                alert_title,
-                container_style,
-                loading_visible,
-                False,
-            )
+    job = job_runner.submit(
+        run, supersedes=previous_job["id"] if previous_job else None
+    )
+    return query_outputs(
+        ["Running query on ", dmc.Code(f"{table_name}"), "..."],
+        "blue",
+        "Running",
+        job={
+            "id": job.id,
+            "table_name": table_name,
+            "http_path": http_path,
+            "offset": 0,
+        },
+    )
 
-    except Exception as e:
-        loading_visible = False
-        alert_msg = ["Error querying with Service Principal: ", dmc.Code(str(e))]
-        alert_color = "red"
-        alert_title = "Error"
-        return (
-            [],
-            [],
-            [],
-            alert_msg,
-            alert_color,
-            alert_hide,
-            alert_title,
-            container_style,
-            loading_visible,
-            False,
+
+def start_server_side_query(http_path, table_name, previous_job, columns):
+    if previous_job:
+        job_runner.cancel(previous_job["id"])
+    # The page callback below runs the first page query for this table.
+    return query_outputs(
+        "Loading the first page...",
+        "gray",
+        "Running",
+        query={"http_path": http_path, "table_name": table_name, "columns": columns},
+        alert_hide=True,
+    )
+
+
+def result_outputs(
+    auth_mode, table_name, table, cached_at, timer, streamed_batches=None
+):
+    if table.num_rows:
+        alert_msg = [
+            "Success! Fetched ",
+            html.B(f"{table.num_rows}"),
+            " rows from ",
+            dmc.Code(f"{table_name}"),
+            (
+                " using the service principal's permissions."
+                if auth_mode == "sp"
+                else " using OBO authorization."
+            ),
+        ]
+        alert_msg += cached_at_message(cached_at)
+        if streamed_batches is not None:
+            # Earlier rows are already in the table, only append the rest.
+            return append_rows(
+                query_outputs(alert_msg, "green", "Success"), streamed_batches, timer
+            )
+        data, tooltips = serialize_rows(table, timer)
+        columns = [{"name": i, "id": i} for i in table.column_names]
+        return query_outputs(
+            alert_msg, "green", "Success", data, columns, tooltips=tooltips
         )
 
+    alert_msg = [
+        (
+            "Query ran successfully using Service Principal but returned no data from "
+            if auth_mode == "sp"
+            else "OBO Query ran successfully but returned no data from "
+        ),
+        dmc.Code(f"'{table_name}'"),
+        ".",
+    ]
+    return query_outputs(alert_msg, "yellow", "No Data")
+
 
 @callback(
-    [
-        Output("table-output-obo", "data"),
-        Output("table-output-obo", "columns"),
-        Output("table-output-obo", "tooltip_data"),
-        Output("alert-obo", "children"),
-        Output("alert-obo", "color"),
-        Output("alert-obo", "hide"),
-        Output("alert-obo", "title"),
-        Output("table-container-obo", "style"),
-        Output("loading-overlay-obo", "visible"),
-        Output("run-query-obo", "loading"),
-    ],
-    Input("run-query-obo", "n_clicks"),
+    query_callback_outputs("sp"),
+    Input("run-query-sp", "n_clicks"),
     State("sql-http-path", "value"),
     State("table-name-input", "value"),
-    running=[
-        (Output("run-query-obo", "loading"), True, False),
-    ],
+    State("server-side-switch", "checked"),
+    State("force-refresh-switch", "checked"),
+    State("job-sp", "data"),
+    State("column-select", "value"),
+    State("row-limit", "value"),
     prevent_initial_call=True,
 )
-def run_obo_query_callback(n_clicks, http_path, table_name):
-    container_style = {"display": "none"}
-    loading_visible = False
+def run_sp_query_callback(
+    n_clicks,
+    http_path,
+    table_name,
+    server_side,
+    force_refresh,
+    previous_job,
+    columns=None,
+    limit=None,
+):
+    if not n_clicks or not http_path or not table_name:
+        raise PreventUpdate
+
+    if not auth.config_available():
+        return config_error_outputs()
+
+    if server_side:
+        return start_server_side_query(http_path, table_name, previous_job, columns)
+
+    return submit_query(
+        request_auth("sp"),
+        http_path,
+        table_name,
+        force_refresh,
+        previous_job,
+        columns,
+        limit,
+    )
 
+
+@callback(
+    query_callback_outputs("obo"),
+    Input("run-query-obo", "n_clicks"),
+    State("sql-http-path", "value"),
+    State("table-name-input", "value"),
+    State("server-side-switch", "checked"),
+    State("force-refresh-switch", "checked"),
+    State("job-obo", "data"),
+    State("column-select", "value"),
+    State("row-limit", "value"),
+    prevent_initial_call=True,
+)
+def run_obo_query_callback(
+    n_clicks,
+    http_path,
+    table_name,
+    server_side,
+    force_refresh,
+    previous_job,
+    columns=None,
+    limit=None,
+):
     if not n_clicks or not http_path or not table_name:
-        return dash.no_update + (False, False)
+        raise PreventUpdate
 
-    if not cfg:
-        return (
-            [],
-            [],
-            [],
-            [
-                "Error: Databricks SDK not configured. Check environment variables like ",
-                dmc.InlineCodeHighlight(code="DATABRICKS_HOST"),
-                " etc.",
-            ],
-            "red",
-            False,
-            "Configuration Error",
-            container_style,
-            False,
-            False,
-        )
+    if not auth.config_available():
+        return config_error_outputs()
 
-    loading_visible = True
+    user_token = get_user_token()
+    if not user_token:
+        return query_outputs(obo_token_missing_message(), "red", "OBO Token Missing")
 
-    alert_hide = False
+    if server_side:
+        return start_server_side_query(http_path, table_name, previous_job, columns)
 
-    try:
-        user_token = get_user_token()
-        if not user_token:
-            alert_msg = [
-                "Error: ",
-                dmc.InlineCodeHighlight(code="X-Forwarded-Access-Token"),
-                " not found in this request's headers. Cannot run OBO query. Ensure OBO is enabled for the App.",
-            ]
-            alert_color = "red"
-            alert_title = "OBO Token Missing"
-            loading_visible = False
-            return (
-                [],
-                [],
-                [],
-                alert_msg,
-                alert_color,
-                alert_hide,
-                alert_title,
-                container_style,
-                loading_visible,
-                False,
+    return submit_query(
+        request_auth("obo"),
+        http_path,
+        table_name,
+        force_refresh,
+        previous_job,
+        columns,
+        limit,
+    )
+
+
+def register_job_callbacks(auth_mode):
+    @callback(
+        query_callback_outputs(auth_mode, allow_duplicate=True),
+        Input(f"poll-{auth_mode}", "n_intervals"),
+        State(f"job-{auth_mode}", "data"),
+        prevent_initial_call=True,
+    )
+    def poll_query_callback(_, job_info):
+        if not job_info:
+            raise PreventUpdate
+
+        job = job_runner.get(job_info["id"])
+        if job is None:
+            # Dropped after QUERY_JOB_RETENTION seconds (or lost in a restart):
+            # only stop polling and leave the panel as it is.
+            outputs = [dash.no_update] * len(query_outputs(None, None, None))
+            outputs[9] = False
+            outputs[-2:] = [True, True]
+            return tuple(outputs)
+        http_path = job_info["http_path"]
+        timer = StageTimer(auth_mode, http_path)
+        # Read before getting the batches: a job that finishes in between has
+        # added its last batch after they were read, so it is delivered on the
+        # next poll.
+        done = job.done
+        # Rows are only dropped once the browser has acknowledged them, so the
+        # rows of a lost or discarded response are sent again.
+        batches, offset = job.batches_after(job_info.get("offset", 0))
+        try:
+            if not done:
+                return progress_outputs(job, batches, offset, job_info, timer)
+
+            # The job is kept until it expires, so if this final response is
+            # lost the next poll sends it again.
+            if job.report_once():
+                queries_total.inc(auth_mode, warehouse_label(http_path), job.status)
+            if job.status == "cancelled":
+                return query_outputs("The query was cancelled.", "gray", "Cancelled")
+            if isinstance(job.error, (WarehouseBusy, CircuitOpen)):
+                return query_outputs(
+                    str(job.error), "orange", unavailable_title(job.error)
+                )
+            if job.status == "error":
+                return query_outputs(
+                    query_error_message(auth_mode, job.error), "red", "Error"
+                )
+            table, cached_at = job.result
+            return result_outputs(
+                auth_mode,
+                job_info["table_name"],
+                table,
+                cached_at,
+                timer,
+                batches if job.rows_streamed else None,
             )
+        finally:
+            timer.observe()
 
-        conn = get_connection_obo(http_path, user_token)
-        df = run_query(table_name, conn)
-        conn.close()
-        loading_visible = False
-
-        if not df.empty:
-            data = df.to_dict("records")
-            columns = [{"name": i, "id": i} for i in df.columns]
-            tooltips = [
-                {
-                    column: {"value": str(value), "type": "markdown"}
-                    for column, value in row.items()
-                }
-                for row in data
-            ]
-            alert_msg = [
-                "Success! Fetched ",
-                html.B(f"{len(df)}"),
-                " rows from ",
-                dmc.Code(f"{table_name}"),
-                " using OBO authorization.",
-            ]
-            alert_color = "green"
-            alert_title = "Success"
-            container_style = {"display": "block"}
+    @callback(
+        Output(f"alert-{auth_mode}", "children", allow_duplicate=True),
+        Output(f"cancel-query-{auth_mode}", "disabled", allow_duplicate=True),
+        Input(f"cancel-query-{auth_mode}", "n_clicks"),
+        State(f"job-{auth_mode}", "data"),
+        prevent_initial_call=True,
+    )
+    def cancel_query_callback(n_clicks, job_info):
+        if not n_clicks or not job_info:
+            raise PreventUpdate
+        job_runner.cancel(job_info["id"])
+        return "Cancelling the query...", True
+
+    return poll_query_callback, cancel_query_callback
+
+
+register_job_callbacks("sp")
+register_job_callbacks("obo")
+
+
+@callback(
+    [
+        Output(f"table-output-{auth_mode}", action)
+        for auth_mode in ("sp", "obo")
+        for action in ("page_action", "sort_action", "filter_action")
+    ]
+    + [
+        Output(f"table-container-{auth_mode}", "style", allow_duplicate=True)
+        for auth_mode in ("sp", "obo")
+    ],
+    Input("server-side-switch", "checked"),
+    prevent_initial_call=True,
+)
+def set_table_mode(server_side):
+    action = "custom" if server_side else "native"
+    # Results loaded in the other mode are hidden until the query is run again.
+    return [action] * 6 + [{"display": "none"}] * 2
+
+
+def register_page_callback(auth_mode):
+    table_id = f"table-output-{auth_mode}"
+
+    @callback(
+        Output(table_id, "data", allow_duplicate=True),
+        Output(table_id, "columns", allow_duplicate=True),
+        Output(table_id, "tooltip_data", allow_duplicate=True),
+        Output(table_id, "page_count", allow_duplicate=True),
+        Output(f"alert-{auth_mode}", "children", allow_duplicate=True),
+        Output(f"alert-{auth_mode}", "color", allow_duplicate=True),
+        Output(f"alert-{auth_mode}", "hide", allow_duplicate=True),
+        Output(f"alert-{auth_mode}", "title", allow_duplicate=True),
+        Output(f"table-container-{auth_mode}", "style", allow_duplicate=True),
+        Input(f"query-{auth_mode}", "data"),
+        Input(table_id, "page_current"),
+        Input(table_id, "page_size"),
+        Input(table_id, "sort_by"),
+        Input(table_id, "filter_query"),
+        State("server-side-switch", "checked"),
+        prevent_initial_call=True,
+    )
+    def page_query_callback(
+        query, page_current, page_size, sort_by, filter_query, server_side
+    ):
+        if not server_side or not query:
+            raise PreventUpdate
+
+        triggered = ctx.triggered_prop_ids
+        with_count = (
+            f"query-{auth_mode}.data" in triggered
+            or f"{table_id}.filter_query" in triggered
+        )
+        page_current = page_current or 0
+        table_name = query["table_name"]
+        http_path = query["http_path"]
+        timer = StageTimer(auth_mode, http_path)
+
+        try:
+            auth = request_auth(auth_mode)
+            columns = select_columns(auth, http_path, table_name, query.get("columns"))
+            with admitted(auth, http_path, timer=timer):
+                with connection_for(auth, http_path) as conn:
+                    table, total_rows = run_page_query(
+                        table_name,
+                        conn,
+                        page_current,
+                        page_size,
+                        sort_by,
+                        filter_query,
+                        with_count=with_count,
+                        timer=timer,
+                        columns=columns,
+                    )
+        except (WarehouseBusy, CircuitOpen) as e:
+            timer.observe()
+            queries_total.inc(auth_mode, warehouse_label(http_path), "busy")
             return (
-                data,
-                columns,
-                tooltips,
-                alert_msg,
-                alert_color,
-                alert_hide,
-                alert_title,
-                container_style,
-                loading_visible,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                str(e),
+                "orange",
                 False,
+                unavailable_title(e),
+                dash.no_update,
             )
-        else:
-            alert_msg = [
-                "OBO Query ran successfully but returned no data from ",
-                dmc.Code(f"'{table_name}'"),
-                ".",
-            ]
-            alert_color = "yellow"
-            alert_title = "No Data"
+        except Exception as e:
+            timer.observe()
+            queries_total.inc(auth_mode, warehouse_label(http_path), "error")
             return (
                 [],
+                dash.no_update,
                 [],
-                [],
-                alert_msg,
-                alert_color,
-                alert_hide,
-                alert_title,
-                container_style,
-                loading_visible,
+                dash.no_update,
+                query_error_message(auth_mode, e),
+                "red",
                 False,
+                "Error",
+                dash.no_update,
             )
 
-    except Exception as e:
-        loading_visible = False
-        alert_msg_base = ["Error querying with OBO: ", dmc.Code(str(e))]
-        alert_color = "red"
-        alert_title = "Error"
-        if (
-            "PERMISSION_DENIED" in str(e).upper()
-            or "DOES NOT HAVE PRIVILEGE" in str(e).upper()
-        ):
-            alert_msg = alert_msg_base + [
-                " | Check if the user has SELECT permissions on the table and USE on the warehouse/catalog/schema."
-            ]
-        elif "OBO token not found" in str(e):
-            alert_msg = [
-                "Error: OBO token missing ( ",
-                dmc.InlineCodeHighlight(code="X-Forwarded-Access-Token"),
-                " ). Ensure OBO is enabled for this App and you are accessing it through Databricks.",
-            ]
-        else:
-            alert_msg = alert_msg_base
-
+        queries_total.inc(auth_mode, warehouse_label(http_path), "done")
+        data, tooltips = serialize_rows(table, timer)
+        timer.observe()
+        first_row = page_current * page_size
+        alert_msg = [
+            "Showing rows ",
+            html.B(f"{first_row + 1 if data else 0}-{first_row + len(data)}"),
+        ]
+        if total_rows is not None:
+            alert_msg += [" of ", html.B(f"{total_rows}")]
+        alert_msg += [" from ", dmc.Code(f"{table_name}"), "."]
         return (
-            [],
-            [],
-            [],
+            data,
+            (
+                [{"name": i, "id": i} for i in table.column_names]
+                if data
+                else dash.no_update
+            ),
+            tooltips,
+            (
+                max(1, math.ceil(total_rows / page_size))
+                if total_rows is not None
+                else dash.no_update
+            ),
             alert_msg,
-            alert_color,
-            alert_hide,
-            alert_title,
-            container_style,
-            loading_visible,
+            "green",
             False,
+            "Success",
+            {"display": "block"},
+        )
+
+    return page_query_callback
+
+
+register_page_callback("sp")
+register_page_callback("obo")
+
+
+def export_url(auth_mode, http_path, table_name, export_format, columns=None):
+    return "/api/export?" + urlencode(
+        {
+            "table": table_name,
+            "http_path": http_path,
+            "format": export_format,
+            "auth": auth_mode,
+            "column": columns or [],
+        },
+        doseq=True,
+    )
+
+
+def register_download_callback(auth_mode):
+    @callback(
+        Output(f"download-csv-{auth_mode}", "href"),
+        Output(f"download-parquet-{auth_mode}", "href"),
+        Input("sql-http-path", "value"),
+        Input("table-name-input", "value"),
+        Input("column-select", "value"),
+    )
+    def update_download_links(http_path, table_name, columns):
+        # The downloads stream the whole table from /api/export, not just the
+        # rows shown in the table.
+        if not http_path or not table_name:
+            return None, None
+        return (
+            export_url(auth_mode, http_path, table_name, "csv", columns),
+            export_url(auth_mode, http_path, table_name, "parquet", columns),
+        )
+
+    return update_download_links
+
+
+register_download_callback("sp")
+register_download_callback("obo")
+
+
+def pool_connections():
+    return {
+        (warehouse_label(path), state): count
+        for path, counts in sp_pool.stats().items()
+        for state, count in counts.items()
+    }
+
+
+def obo_session_stats():
+    stats = obo_sessions.stats()
+    return {(key,): stats[key] for key in ("size", "hits", "misses", "evictions")}
+
+
+def result_cache_stats():
+    return {(key,): value for key, value in result_cache.stats().items()}
+
+
+def admission_stats():
+    return {
+        (warehouse_label(path), key): value
+        for path, stats in admission.stats().items()
+        for key, value in stats.items()
+    }
+
+
+def circuit_stats():
+    states = {"closed": 0, "half-open": 1, "open": 2}
+    return {
+        (warehouse_label(path),): states[stats["state"]]
+        for path, stats in circuit_breaker.stats().items()
+    }
+
+
+def sp_query_stats():
+    return {(key,): value for key, value in sp_queries.stats().items()}
+
+
+GaugeFunction(
+    "auth_demo_sp_pool_connections",
+    "Pooled service principal connections by warehouse and state.",
+    ("warehouse", "state"),
+    pool_connections,
+)
+GaugeFunction(
+    "auth_demo_obo_sessions",
+    "On-behalf-of session cache size and lookup counters.",
+    ("stat",),
+    obo_session_stats,
+)
+GaugeFunction(
+    "auth_demo_result_cache",
+    "Result cache entries, bytes and lookup counters.",
+    ("stat",),
+    result_cache_stats,
+)
+GaugeFunction(
+    "auth_demo_warehouse_admission",
+    "Statements running and waiting for a slot on each warehouse, and admission counters.",
+    ("warehouse", "stat"),
+    admission_stats,
+)
+GaugeFunction(
+    "auth_demo_circuit_state",
+    "Circuit breaker state by warehouse: 0 closed, 1 half-open (probing), 2 open.",
+    ("warehouse",),
+    circuit_stats,
+)
+GaugeFunction(
+    "auth_demo_sp_queries",
+    "Service principal queries in flight, executed and coalesced into one "
+    "already running.",
+    ("stat",),
+    sp_query_stats,
+)
+
+
+@server.route("/metrics")
+def metrics():
+    if not METRICS_ENABLED:
+        return Response("Metrics are disabled.\n", status=404, mimetype="text/plain")
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+@server.route("/api/connection-stats")
+def connection_stats():
+    return jsonify(
+        {
+            "sp_pool": sp_pool.stats(),
+            "obo_sessions": obo_sessions.stats(),
+            "result_cache": result_cache.stats(),
+            "sp_queries": sp_queries.stats(),
+            "admission": admission.stats(),
+            "circuits": circuit_breaker.stats(),
+            "sp_credentials": sp_credentials.stats(),
+            "warmup": warmup_state,
+            "warehouse_starts": warehouse_starter.stats(),
+            "catalog_browser": catalog_browser.stats(),
+        }
+    )
+
+
+@server.route("/api/export")
+def export():
+    table_name = request.args.get("table")
+    http_path = request.args.get("http_path")
+    export_format = request.args.get("format", "csv")
+    auth_mode = request.args.get("auth", "sp")
+    if not table_name or not http_path:
+        return jsonify({"error": "table and http_path are required"}), 400
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format {export_format!r}"}), 400
+    if auth_mode not in ("sp", "obo"):
+        return jsonify({"error": f"Unsupported auth mode {auth_mode!r}"}), 400
+    # The same checks as the query panels: the service principal is only used
+    # when the app is configured, and only warehouses from the list can be used,
+    # so a typed-in path cannot open connections to any other warehouse.
+    if not auth.config_available():
+        return jsonify({"error": "The Databricks SDK is not configured"}), 503
+    if not is_listed_warehouse(http_path):
+        return jsonify({"error": "Unknown SQL warehouse"}), 403
+
+    try:
+        query_auth = request_auth(auth_mode)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 401
+    try:
+        chunks, close = export_table(
+            query_auth,
+            http_path,
+            table_name,
+            export_format,
+            request.args.getlist("column"),
         )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (WarehouseBusy, CircuitOpen) as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 502
+
+    filename = table_name.replace("`", "").split(".")[-1] or "export"
+    response = Response(chunks, mimetype=EXPORT_FORMATS[export_format])
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename="{filename}.{export_format}"'
+    )
+    response.call_on_close(close)
+    return response
+
+
+# Token for /api/cache/invalidate; the route is disabled without one.
+CACHE_INVALIDATE_TOKEN = os.getenv("CACHE_INVALIDATE_TOKEN")
+
+
+@server.route("/api/cache/invalidate", methods=["POST"])
+def invalidate_workspace_cache():
+    # Clearing the caches makes the next requests list warehouses, catalogs
+    # and schemas again, so only callers holding the token may do it.
+    if not CACHE_INVALIDATE_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    # Not the Authorization header, which the Databricks Apps proxy uses itself.
+    token = request.headers.get("X-Cache-Invalidate-Token", "")
+    if not hmac.compare_digest(token.encode(), CACHE_INVALIDATE_TOKEN.encode()):
+        return jsonify({"error": "Forbidden"}), 403
+    workspace_cache.invalidate()
+    schema_cache.invalidate()
+    catalog_browser.invalidate()
+    return jsonify({"invalidated": True})
+
+
+def reset_after_fork():
+    # Called by the gunicorn post_fork hook in each worker (see gunicorn.conf.py).
+    auth.reset_after_fork()
+    workspace_cache.reset_after_fork()
+    schema_cache.reset_after_fork()
+    result_cache.reset_after_fork()
+    job_runner.reset_after_fork()
+    sp_queries.reset_after_fork()
+    admission.reset_after_fork()
+    warehouse_starter.reset_after_fork()
+    catalog_browser.reset_after_fork()
 
 
 if __name__ == "__main__":
+    start_warmup()
     app.run()
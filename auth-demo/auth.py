@@ -1,26 +1,73 @@
+import atexit
+import threading
+from contextlib import ExitStack, contextmanager
+
 from databricks import sql
-from databricks.sdk import WorkspaceClient
-from databricks.sdk.core import Config
 from flask import request
 
-cfg = Config()
-w = WorkspaceClient()
+from cache import workspace_cache
+from credentials import TokenCache
+from metrics import timed
+from pool import ConnectionPool, SessionCache, hash_token
+from resilience import circuit_breaker, connect_options, with_retries
+
+# The SDK takes about a second to import, so the config and workspace client
+# are created on first use (or by the startup warm-up in warmup.py).
+_cfg = None
+_w = None
+_clients_lock = threading.Lock()
+
+
+def get_config():
+    global _cfg
+    if _cfg is None:
+        with _clients_lock:
+            if _cfg is None:
+                from databricks.sdk.core import Config
+
+                _cfg = Config()
+    return _cfg
+
+
+def get_workspace_client():
+    global _w
+    if _w is None:
+        with _clients_lock:
+            if _w is None:
+                from databricks.sdk import WorkspaceClient
+
+                _w = WorkspaceClient()
+    return _w
+
+
+def config_available():
+    try:
+        get_config()
+        return True
+    except Exception as e:
+        print(f"Error loading Databricks config: {e}")
+        return False
+
+
+sp_credentials = TokenCache(get_config)
+
+
+def get_sp_display_name():
+    me = get_workspace_client().current_user.me()
+    if hasattr(me, "service_principal_name") and me.service_principal_name:
+        return me.service_principal_name
+    elif hasattr(me, "user_name") and me.user_name:
+        return me.user_name
+    return "Unknown"
 
 
 def fetch_sp_details():
     local_sp_display_info = "Unknown"
-    if w:
-        try:
-            me = w.current_user.me()
-            if hasattr(me, "service_principal_name") and me.service_principal_name:
-                local_sp_display_info = me.service_principal_name
-            elif hasattr(me, "user_name") and me.user_name:
-                local_sp_display_info = me.user_name
-            else:
-                local_sp_display_info = "Unknown"
-        except Exception as e:
-            local_sp_display_info = f"Error ({e})"
-            print(f"Error fetching SP details: {e}")
+    try:
+        local_sp_display_info = workspace_cache.get("sp_details", get_sp_display_name)
+    except Exception as e:
+        local_sp_display_info = f"Error ({e})"
+        print(f"Error fetching SP details: {e}")
     return local_sp_display_info
 
 
@@ -30,17 +77,88 @@ def get_user_token():
     return token
 
 
-def get_connection_sp(http_path):
-    return sql.connect(
-        server_hostname=cfg.host,
-        http_path=http_path,
-        credentials_provider=lambda: cfg.authenticate,
+def get_user_name():
+    headers = request.headers
+    return headers.get("X-Forwarded-Email") or headers.get(
+        "X-Forwarded-Preferred-Username"
     )
 
 
+def get_connection_sp(http_path):
+    with timed("connect", "sp", http_path):
+        return with_retries(
+            lambda: sql.connect(
+                server_hostname=get_config().host,
+                http_path=http_path,
+                credentials_provider=lambda: sp_credentials.headers,
+                **connect_options(),
+            ),
+            "connect",
+        )
+
+
 def get_connection_obo(http_path, user_token):
-    return sql.connect(
-        server_hostname=cfg.host,
-        http_path=http_path,
-        access_token=user_token,
-    )
+    with timed("connect", "obo", http_path):
+        return with_retries(
+            lambda: sql.connect(
+                server_hostname=get_config().host,
+                http_path=http_path,
+                access_token=user_token,
+                **connect_options(),
+            ),
+            "connect",
+        )
+
+
+sp_pool = ConnectionPool(get_connection_sp)
+atexit.register(sp_pool.close_all)
+
+obo_sessions = SessionCache(get_connection_obo)
+atexit.register(obo_sessions.close_all)
+
+
+def reset_after_fork():
+    # Server workers forked from a preloaded app must not share the parent's
+    # HTTP sessions, OAuth token state or SQL connections.
+    global _cfg, _w, _clients_lock
+    _cfg = None
+    _w = None
+    _clients_lock = threading.Lock()
+    sp_credentials.reset_after_fork()
+    sp_pool.reset_after_fork()
+    obo_sessions.reset_after_fork()
+    circuit_breaker.reset_after_fork()
+
+
+def request_auth(auth_mode):
+    # Captures what a query needs from the current request, so it can run on a
+    # worker thread outside the request context.
+    if auth_mode == "sp":
+        return {"mode": "sp"}
+    user_token = get_user_token()
+    if not user_token:
+        raise ValueError("OBO token not found in request headers")
+    return {"mode": "obo", "token": user_token, "user": get_user_name()}
+
+
+@contextmanager
+def connection_for(auth, http_path):
+    with ExitStack() as stack:
+        # Fails fast while the warehouse is failing (see resilience.py).
+        stack.enter_context(circuit_breaker.guard(http_path))
+        # "checkout" includes waiting for a pooled connection and, on a miss,
+        # the "connect" stage recorded above.
+        with timed("checkout", auth["mode"], http_path):
+            if auth["mode"] == "sp":
+                conn = stack.enter_context(sp_pool.connection(http_path))
+            else:
+                conn = stack.enter_context(
+                    obo_sessions.connection(http_path, auth["token"], auth["user"])
+                )
+        yield conn
+
+
+def cache_identity(auth):
+    if auth["mode"] == "sp":
+        return "sp"
+    return f"obo:{auth['user'] or hash_token(auth['token'])}"
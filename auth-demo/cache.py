@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from admission import WarehouseBusy
+from resilience import CircuitOpen, is_transient
+
+WORKSPACE_CACHE_TTL = float(os.getenv("WORKSPACE_CACHE_TTL", "300"))
+WORKSPACE_CACHE_REFRESH_AFTER = float(os.getenv("WORKSPACE_CACHE_REFRESH_AFTER", "240"))
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "600"))
+SCHEMA_CACHE_SIZE = int(os.getenv("SCHEMA_CACHE_SIZE", "256"))
+SCHEMA_ERROR_TTL = float(os.getenv("SCHEMA_ERROR_TTL", "30"))
+
+
+class TTLCache:
+    """Shared cache for slow-changing lookups.
+
+    Entries older than `refresh_after` are still served while a background thread
+    reloads them; entries older than `ttl` are reloaded before they are returned.
+    With `maxsize`, the least recently used entries are dropped once there are
+    more. Loader errors for which `cache_error(e)` is true are raised again for
+    `error_ttl` seconds (by default errors are not cached).
+    """
+
+    def __init__(
+        self,
+        ttl=WORKSPACE_CACHE_TTL,
+        refresh_after=WORKSPACE_CACHE_REFRESH_AFTER,
+        maxsize=None,
+        error_ttl=0,
+        cache_error=lambda e: True,
+    ):
+        self.ttl = ttl
+        self.refresh_after = min(refresh_after, ttl)
+        self.maxsize = maxsize
+        self.error_ttl = error_ttl
+        self.cache_error = cache_error
+        self._entries = OrderedDict()
+        self._errors = OrderedDict()
+        self._refreshing = set()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            error = self._errors.get(key)
+        if entry is not None:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if age < self.refresh_after:
+                return value
+            if age < self.ttl:
+                self._refresh_in_background(key, loader)
+                return value
+        elif error is not None and time.monotonic() - error[1] < self.error_ttl:
+            # A recent failure, e.g. a table that does not exist.
+            raise error[0]
+        return self._load(key, loader)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._errors.clear()
+            else:
+                self._entries.pop(key, None)
+                self._errors.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def reset_after_fork(self):
+        # Loaded values are kept, but refresh threads and locks do not survive a fork.
+        self._refreshing = set()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _load(self, key, loader):
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Concurrent misses for the same key wait for a single load.
+        try:
+            with key_lock:
+                with self._lock:
+                    entry = self._entries.get(key)
+                if (
+                    entry is not None
+                    and time.monotonic() - entry[1] < self.refresh_after
+                ):
+                    return entry[0]
+                try:
+                    value = loader()
+                except Exception as e:
+                    if self.error_ttl and self.cache_error(e):
+                        with self._lock:
+                            self._store(self._errors, key, (e, time.monotonic()))
+                    raise
+                with self._lock:
+                    self._errors.pop(key, None)
+                    self._store(self._entries, key, (value, time.monotonic()))
+                return value
+        finally:
+            # Waiters already hold the lock object, so the entry is only needed
+            # while a load is running; keeping it would grow with every key.
+            with self._lock:
+                if self._key_locks.get(key) is key_lock and not key_lock.locked():
+                    del self._key_locks[key]
+
+    def _store(self, entries, key, entry):
+        # Called with self._lock held.
+        entries[key] = entry
+        entries.move_to_end(key)
+        if self.maxsize is None:
+            return
+        # Expired entries go first, then the least recently used.
+        now = time.monotonic()
+        ttl = self.ttl if entries is self._entries else self.error_ttl
+        for old_key in [k for k, (_, at) in entries.items() if now - at >= ttl]:
+            if old_key != key:
+                del entries[old_key]
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._load(key, loader)
+            except Exception as e:
+                print(f"Error refreshing cached {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+workspace_cache = TTLCache()
+
+
+# Table columns from DESCRIBE TABLE, per identity, warehouse and table.
+def is_table_error(e):
+    """True for errors about the table itself, such as a missing table or no
+    permission, which are worth remembering. A busy or unreachable warehouse
+    says nothing about the table and is tried again straight away."""
+    if isinstance(e, (WarehouseBusy, CircuitOpen, TimeoutError)):
+        return False
+    return not is_transient(e)
+
+
+schema_cache = TTLCache(
+    ttl=SCHEMA_CACHE_TTL,
+    refresh_after=SCHEMA_CACHE_TTL * 0.8,
+    maxsize=SCHEMA_CACHE_SIZE,
+    error_ttl=SCHEMA_ERROR_TTL,
+    cache_error=is_table_error,
+)
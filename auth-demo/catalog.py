@@ -0,0 +1,269 @@
+import bisect
+import os
+import threading
+import time
+
+import auth
+from cache import TTLCache
+
+BROWSER_CATALOG_TTL = float(os.getenv("BROWSER_CATALOG_TTL", "600"))
+BROWSER_SCHEMA_TTL = float(os.getenv("BROWSER_SCHEMA_TTL", "600"))
+BROWSER_TABLE_TTL = float(os.getenv("BROWSER_TABLE_TTL", "300"))
+BROWSER_ERROR_TTL = float(os.getenv("BROWSER_ERROR_TTL", "30"))
+BROWSER_SUGGESTIONS = int(os.getenv("BROWSER_SUGGESTIONS", "50"))
+BROWSER_TREE_LIMIT = int(os.getenv("BROWSER_TREE_LIMIT", "200"))
+
+# Children of a tree node that has not been expanded yet.
+PLACEHOLDER = "__loading__"
+
+
+class PrefixIndex:
+    """Names sorted case-insensitively, for prefix lookups with bisect.
+
+    A lookup costs O(log n) plus the matches returned, so a schema with tens of
+    thousands of tables can be searched on every keystroke.
+    """
+
+    def __init__(self, names):
+        self._names = sorted(set(names), key=str.lower)
+        self._keys = [name.lower() for name in self._names]
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        key = name.lower()
+        i = bisect.bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def _range(self, prefix):
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self._keys, prefix)
+        # Every key that starts with the prefix sorts before this one.
+        end = bisect.bisect_left(self._keys, prefix + "\U0010ffff", start)
+        return start, end
+
+    def search(self, prefix, limit=None):
+        start, end = self._range(prefix)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self._names[start:end]
+
+    def count(self, prefix):
+        start, end = self._range(prefix)
+        return end - start
+
+
+class CatalogBrowser:
+    """Unity Catalog names for the table picker, loaded lazily a level at a time.
+
+    Catalogs, the schemas of a catalog and the tables of a schema are each
+    listed through the SDK the first time they are needed and cached with their
+    own TTL, so typing a table name is answered from the cached indexes instead
+    of an API call per keystroke. Names are listed as the app's service
+    principal. Listing errors are remembered for BROWSER_ERROR_TTL seconds.
+    """
+
+    def __init__(
+        self,
+        get_client=None,
+        catalog_ttl=BROWSER_CATALOG_TTL,
+        schema_ttl=BROWSER_SCHEMA_TTL,
+        table_ttl=BROWSER_TABLE_TTL,
+        error_ttl=BROWSER_ERROR_TTL,
+    ):
+        self.get_client = get_client or (lambda: auth.get_workspace_client())
+        self.error_ttl = error_ttl
+        self._caches = {
+            level: TTLCache(ttl=ttl, refresh_after=ttl * 0.8)
+            for level, ttl in (
+                ("catalogs", catalog_ttl),
+                ("schemas", schema_ttl),
+                ("tables", table_ttl),
+            )
+        }
+        self._errors = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def catalogs(self):
+        return self._index(
+            "catalogs",
+            (),
+            lambda client: (c.name for c in client.catalogs.list()),
+        )
+
+    def schemas(self, catalog):
+        if catalog not in self.catalogs():
+            return PrefixIndex([])
+        return self._index(
+            "schemas",
+            (catalog.lower(),),
+            lambda client: (s.name for s in client.schemas.list(catalog_name=catalog)),
+        )
+
+    def tables(self, catalog, schema):
+        if schema not in self.schemas(catalog):
+            return PrefixIndex([])
+        return self._index(
+            "tables",
+            (catalog.lower(), schema.lower()),
+            lambda client: (
+                t.name
+                for t in client.tables.list(
+                    catalog_name=catalog,
+                    schema_name=schema,
+                    omit_columns=True,
+                    omit_properties=True,
+                )
+            ),
+        )
+
+    def suggest(self, text, limit=BROWSER_SUGGESTIONS):
+        """Completions for a partly typed `catalog.schema.table`.
+
+        Catalogs and schemas are suggested with a trailing dot, so picking one
+        goes on to list its children.
+        """
+        parts = (text or "").replace("`", "").strip().split(".")
+        if len(parts) == 1:
+            return [f"{c}." for c in self.catalogs().search(parts[0], limit)]
+        if len(parts) == 2:
+            catalog, prefix = parts
+            return [
+                f"{catalog}.{s}." for s in self.schemas(catalog).search(prefix, limit)
+            ]
+        if len(parts) == 3:
+            catalog, schema, prefix = parts
+            return [
+                f"{catalog}.{schema}.{t}"
+                for t in self.tables(catalog, schema).search(prefix, limit)
+            ]
+        return []
+
+    def is_partial(self, text):
+        """True while `text` is still being typed: it is the start of a listed
+        name but not a table itself. Used to skip DESCRIBE on every keystroke."""
+        parts = (text or "").replace("`", "").strip().split(".")
+        if len(parts) == 1:
+            return self.catalogs().count(parts[0]) > 0
+        if len(parts) == 2:
+            return self.schemas(parts[0]).count(parts[1]) > 0
+        if len(parts) == 3:
+            tables = self.tables(parts[0], parts[1])
+            return parts[2] not in tables and tables.count(parts[2]) > 0
+        return False
+
+    def tree_nodes(self, value="", limit=BROWSER_TREE_LIMIT):
+        """Children of a node of the browser tree (the catalogs for the root).
+
+        Catalogs and schemas get a placeholder child until they are expanded.
+        Long lists end with a node saying how many more there are.
+        """
+        parts = value.split(".") if value else []
+        if len(parts) == 0:
+            index = self.catalogs()
+        elif len(parts) == 1:
+            index = self.schemas(parts[0])
+        else:
+            index = self.tables(*parts[:2])
+        prefix = f"{value}." if value else ""
+        nodes = []
+        for name in index.search("", limit):
+            node = {"label": name, "value": prefix + name}
+            if len(parts) < 2:
+                node["children"] = [
+                    {"label": "Loading...", "value": f"{prefix}{name}.{PLACEHOLDER}"}
+                ]
+            nodes.append(node)
+        if len(index) > limit:
+            nodes.append(
+                {
+                    "label": f"... {len(index) - limit} more, type the name to search",
+                    "value": f"{prefix}{PLACEHOLDER}",
+                    "nodeProps": {"disabled": True},
+                }
+            )
+        if not nodes:
+            error = self.error(parts)
+            nodes.append(
+                {
+                    "label": error or "Nothing here",
+                    "value": f"{prefix}{PLACEHOLDER}",
+                    "nodeProps": {"disabled": True},
+                }
+            )
+        return nodes
+
+    def expand_tree(self, data, expanded):
+        """Loads the children of expanded nodes that still have a placeholder.
+
+        Updates `data` in place and returns whether anything was loaded.
+        """
+        expanded = set(expanded or [])
+        loaded = False
+
+        def expand(nodes):
+            nonlocal loaded
+            for node in nodes:
+                children = node.get("children")
+                if not children:
+                    continue
+                placeholder = f"{node['value']}.{PLACEHOLDER}"
+                if node["value"] in expanded and children[0]["value"] == placeholder:
+                    node["children"] = self.tree_nodes(node["value"])
+                    loaded = True
+                else:
+                    expand(children)
+
+        expand(data or [])
+        return loaded
+
+    def error(self, parts=()):
+        """The last error listing the children of `parts`, if there was one."""
+        level = ("catalogs", "schemas", "tables")[len(parts)]
+        with self._lock:
+            entry = self._errors.get((level, tuple(p.lower() for p in parts)))
+        return entry[0] if entry else None
+
+    def invalidate(self):
+        for cache in self._caches.values():
+            cache.invalidate()
+        with self._lock:
+            self._errors = {}
+
+    def reset_after_fork(self):
+        for cache in self._caches.values():
+            cache.reset_after_fork()
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {"loads": self.loads, "errors": len(self._errors)}
+
+    def _index(self, level, key, list_names):
+        with self._lock:
+            failed = self._errors.get((level, key))
+        if failed and time.monotonic() - failed[1] < self.error_ttl:
+            return PrefixIndex([])
+
+        def load():
+            names = list(list_names(self.get_client()))
+            with self._lock:
+                self.loads += 1
+            return PrefixIndex(names)
+
+        try:
+            index = self._caches[level].get(key, load)
+        except Exception as e:
+            print(f"Error listing {level} {'.'.join(key)}: {e}")
+            with self._lock:
+                self._errors[(level, key)] = (str(e), time.monotonic())
+            return PrefixIndex([])
+        with self._lock:
+            self._errors.pop((level, key), None)
+        return index
+
+
+catalog_browser = CatalogBrowser()
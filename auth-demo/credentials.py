@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+SP_TOKEN_REFRESH_MARGIN = float(os.getenv("SP_TOKEN_REFRESH_MARGIN", "300"))
+SP_TOKEN_FALLBACK_TTL = float(os.getenv("SP_TOKEN_FALLBACK_TTL", "30"))
+
+# Databricks rejects tokens that expire within 30 seconds, so cached headers are
+# not used in the last minute of the token's lifetime.
+EXPIRY_BUFFER = 60
+
+
+class TokenCache:
+    """Caches the service principal's auth headers for `credentials_provider`.
+
+    Headers built from an OAuth token are reused until shortly before the token
+    expires and refreshed on a background thread once the token is within
+    `refresh_margin` seconds of expiring, so queries do not wait for a new
+    token. Only one refresh runs at a time; callers that find no usable token
+    wait for it. Credentials without an expiry (such as personal access tokens)
+    are cached for `fallback_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        get_config,
+        refresh_margin=SP_TOKEN_REFRESH_MARGIN,
+        fallback_ttl=SP_TOKEN_FALLBACK_TTL,
+    ):
+        self.get_config = get_config
+        self.refresh_margin = refresh_margin
+        self.fallback_ttl = fallback_ttl
+        self._headers = None
+        self._expires = 0.0
+        self._refresh_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.errors = 0
+
+    def headers(self):
+        headers, expires, refresh_at = self._headers, self._expires, self._refresh_at
+        now = time.monotonic()
+        if headers is not None and now < expires:
+            if now >= refresh_at:
+                self._refresh_in_background()
+            return headers
+        with self._lock:
+            if self._headers is not None and time.monotonic() < self._expires:
+                return self._headers
+            return self._refresh()
+
+    def prefetch(self):
+        try:
+            self.headers()
+        except Exception as e:
+            print(f"Error fetching service principal token: {e}")
+
+    def reset_after_fork(self):
+        # The cached token is only a string and stays valid in the worker, so
+        # forked workers do not all request a new one at startup.
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def stats(self):
+        headers, expires = self._headers, self._expires
+        return {
+            "cached": headers is not None,
+            "expires_in": max(expires - time.monotonic(), 0.0) if headers else 0.0,
+            "refreshes": self.refreshes,
+            "background_refreshes": self.background_refreshes,
+            "errors": self.errors,
+        }
+
+    def _mint(self):
+        config = self.get_config()
+        try:
+            token = config.oauth_token()
+        except Exception:
+            # Not an OAuth credential (or the SDK cannot tell its expiry).
+            token = None
+        if token is not None and token.access_token and token.expiry:
+            now = datetime.now(tz=token.expiry.tzinfo)
+            lifetime = (token.expiry - now).total_seconds()
+            headers = {
+                "Authorization": f"{token.token_type or 'Bearer'} {token.access_token}"
+            }
+            return headers, lifetime - EXPIRY_BUFFER, lifetime - self.refresh_margin
+        return config.authenticate(), self.fallback_ttl, self.fallback_ttl
+
+    def _refresh(self):
+        # Called with the lock held.
+        try:
+            headers, usable_for, refresh_after = self._mint()
+        except Exception:
+            self.errors += 1
+            raise
+        now = time.monotonic()
+        self._headers = headers
+        self._expires = now + max(usable_for, 0.0)
+        self._refresh_at = now + max(min(refresh_after, usable_for), 0.0)
+        self.refreshes += 1
+        return headers
+
+    def _refresh_in_background(self):
+        # Never wait here: if a refresh is already running, keep using the
+        # cached headers.
+        if self._refreshing or not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        finally:
+            self._lock.release()
+
+        def refresh():
+            try:
+                with self._lock:
+                    if time.monotonic() < self._refresh_at:
+                        return
+                    self._refresh()
+                    self.background_refreshes += 1
+            except Exception as e:
+                print(f"Error refreshing service principal token: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
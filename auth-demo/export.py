@@ -0,0 +1,95 @@
+import os
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class _ChunkSink:
+    """File-like object that keeps what an Arrow writer wrote until it is taken."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def _csv_ready(table):
+    import pyarrow as pa
+
+    from normalize import normalize_column
+
+    # The CSV writer has no representation for nested types or durations.
+    columns = [
+        (
+            normalize_column(column)
+            if pa.types.is_nested(column.type) or pa.types.is_duration(column.type)
+            else column
+        )
+        for column in table.columns
+    ]
+    return pa.table(columns, names=table.column_names)
+
+
+def export_chunks(cursor, export_format, batch_size=EXPORT_BATCH_SIZE):
+    """Yields the result of the statement executed on `cursor` as CSV or Parquet.
+
+    Rows are fetched `batch_size` at a time and each batch is encoded and yielded
+    before the next one is fetched, so memory use does not grow with the size of
+    the result. Parquet files get one row group per batch.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    out = pa.PythonFile(sink, mode="w")
+    writer = None
+    try:
+        while True:
+            batch = cursor.fetchmany_arrow(batch_size)
+            if export_format == "csv":
+                batch = _csv_ready(batch)
+            if writer is None:
+                if export_format == "csv":
+                    writer = pa_csv.CSVWriter(out, batch.schema)
+                else:
+                    writer = pq.ParquetWriter(out, batch.schema)
+            if batch.num_rows:
+                writer.write_table(batch)
+            data = sink.take()
+            if data:
+                yield data
+            if batch.num_rows < batch_size:
+                break
+        writer.close()
+        writer = None
+        data = sink.take()
+        if data:
+            yield data
+    finally:
+        if writer is not None:
+            writer.close()
+        out.close()
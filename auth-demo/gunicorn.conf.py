@@ -0,0 +1,34 @@
+import os
+
+bind = f"0.0.0.0:{os.getenv('DATABRICKS_APP_PORT', '8000')}"
+worker_class = "gthread"
+# Background queries, cached results and pooled connections live in the memory
+# of the worker that created them, and the page polls for its query results, so
+# the app runs as one process with many threads unless GUNICORN_WORKERS is set.
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+# Import the app once in the master so workers start from a warm copy.
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master before the workers are forked: modules imported here
+    # are shared with the workers, and they all start with the same service
+    # principal token instead of each requesting one.
+    from auth import sp_credentials
+    from warmup import import_query_modules
+
+    import_query_modules()
+    sp_credentials.prefetch()
+
+
+def post_fork(server, worker):
+    from app import reset_after_fork, start_warmup
+
+    reset_after_fork()
+    start_warmup()
@@ -0,0 +1,180 @@
+import atexit
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.getenv("QUERY_JOB_WORKERS", "16"))
+JOB_RETENTION = float(os.getenv("QUERY_JOB_RETENTION", "600"))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueryJob:
+    def __init__(self, fn):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.status = "queued"
+        self.progress = "Queued"
+        self.result = None
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+        self.rows_streamed = 0
+        self._reported = False
+        # (first row, batch) for the streamed batches the browser has not
+        # acknowledged yet, oldest first.
+        self._batches = []
+        self._cursor = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        return self.status in ("done", "error", "cancelled")
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def set_progress(self, message):
+        self.check_cancelled()
+        self.progress = message
+
+    def set_cursor(self, cursor):
+        with self._lock:
+            self._cursor = cursor
+        self.check_cancelled()
+
+    def add_batch(self, batch):
+        self.check_cancelled()
+        with self._lock:
+            self._batches.append((self.rows_streamed, batch))
+            self.rows_streamed += batch.num_rows
+
+    def batches_after(self, offset):
+        """Returns the batches from row `offset` on and the row they end at.
+
+        `offset` is the number of rows the browser has applied, so the batches
+        before it are dropped. Later ones are kept until they are acknowledged
+        the same way, in case the response carrying them is lost.
+        """
+        with self._lock:
+            self._batches = [
+                (start, batch)
+                for start, batch in self._batches
+                if start + batch.num_rows > offset
+            ]
+            batches = [batch for start, batch in self._batches if start >= offset]
+            return batches, self.rows_streamed
+
+    def report_once(self):
+        """True the first time it is called, so a finished job is only counted
+        once however often its result is sent."""
+        with self._lock:
+            first, self._reported = not self._reported, True
+        return first
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled("The query was cancelled")
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            cursor = self._cursor
+        if cursor is not None and not self.done:
+            try:
+                cursor.cancel()
+            except Exception as e:
+                print(f"Error cancelling query: {e}")
+
+    def run(self):
+        self.status = "running"
+        try:
+            self.check_cancelled()
+            self.result = self.fn(self)
+            self.check_cancelled()
+            self.status = "done"
+        except Exception as e:
+            if self.cancelled:
+                self.status = "cancelled"
+            else:
+                self.error = e
+                self.status = "error"
+        finally:
+            with self._lock:
+                self._cursor = None
+            self.finished = time.monotonic()
+
+
+class JobRunner:
+    """Runs queries on a worker thread pool so Flask workers are not blocked.
+
+    `fn(job)` receives the job and reports progress and its cursor through it,
+    so that `cancel` can stop the statement on the warehouse.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, retention=JOB_RETENTION):
+        self.workers = workers
+        self.retention = retention
+        self._start()
+
+    def submit(self, fn, supersedes=None):
+        if supersedes:
+            self.cancel(supersedes)
+        job = QueryJob(fn)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(job.run)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pop(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def reset_after_fork(self):
+        # Worker threads are not copied into a forked process.
+        self._start()
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="query-job"
+        )
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.retention:
+                del self._jobs[job_id]
+
+
+job_runner = JobRunner()
+atexit.register(job_runner.shutdown)
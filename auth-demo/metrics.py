@@ -0,0 +1,206 @@
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in (
+    "0",
+    "false",
+    "no",
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = {
+                labels: (list(b), s, c) for labels, (b, s, c) in self._series.items()
+            }
+        for labels, (bucket_counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                label_str = _format_labels(
+                    self.labelnames, labels, [("le", _format_value(bound))]
+                )
+                lines.append(f"{self.name}_bucket{label_str} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{label_str} {count}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}{label_str} {_format_value(value)}")
+        return lines
+
+
+class GaugeFunction:
+    """Gauge whose values are read from `fn()`, a dict of label tuples to values,
+    when the metrics are scraped."""
+
+    def __init__(self, name, documentation, labelnames, fn):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        _registry.append(self)
+
+    def collect(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"Error collecting {self.name}: {e}")
+            values = {}
+        for labels, value in sorted(values.items()):
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}{label_str} {_format_value(value)}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+def warehouse_label(http_path):
+    # "/sql/1.0/warehouses/<id>" -> "<id>", to keep label values short.
+    return (http_path or "").rstrip("/").rsplit("/", 1)[-1] or "unknown"
+
+
+stage_seconds = Histogram(
+    "auth_demo_stage_seconds",
+    "Time spent in each stage of running a query.",
+    ("stage", "auth_mode", "warehouse"),
+)
+queries_total = Counter(
+    "auth_demo_queries_total",
+    "Queries run from the app by outcome.",
+    ("auth_mode", "warehouse", "status"),
+)
+
+
+@contextmanager
+def timed(stage, auth_mode, http_path):
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(
+            time.perf_counter() - start, stage, auth_mode, warehouse_label(http_path)
+        )
+
+
+class StageTimer:
+    """Adds up the time of stages that run several times for one query (such as
+    fetching batches) and records each total once in `observe`."""
+
+    def __init__(self, auth_mode, http_path, enabled=METRICS_ENABLED):
+        self.auth_mode = auth_mode
+        self.http_path = http_path
+        self.enabled = enabled
+        self.totals = {}
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+
+    def observe(self):
+        warehouse = warehouse_label(self.http_path)
+        for name, seconds in self.totals.items():
+            stage_seconds.observe(seconds, name, self.auth_mode, warehouse)
+        self.totals = {}
+
+
+NULL_TIMER = StageTimer(None, None, enabled=False)
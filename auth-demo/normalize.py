@@ -0,0 +1,63 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def _to_python_strings(column):
+    return pa.array(
+        [None if value is None else str(value) for value in column.to_pylist()],
+        type=pa.string(),
+    )
+
+
+def normalize_column(column):
+    """Makes one Arrow column JSON-ready for a Dash DataTable.
+
+    Numbers, booleans and strings are kept as they are, timestamps become
+    "YYYY-MM-DD HH:MM:SS" strings in their own time zone and everything else is
+    cast to strings with Arrow compute kernels, falling back to Python `str()`
+    for types Arrow cannot cast (nested types, durations, invalid UTF-8).
+    """
+    dtype = column.type
+    if pa.types.is_dictionary(dtype):
+        return normalize_column(column.cast(dtype.value_type))
+    if (
+        pa.types.is_integer(dtype)
+        or pa.types.is_floating(dtype)
+        or pa.types.is_boolean(dtype)
+        or pa.types.is_string(dtype)
+        or pa.types.is_large_string(dtype)
+    ):
+        return column
+    if pa.types.is_timestamp(dtype):
+        if dtype.tz is not None:
+            column = pc.local_timestamp(column)
+        # Casting whole seconds to string is an order of magnitude faster than
+        # pc.strftime, which would also keep fractional seconds.
+        return pc.cast(column.cast(pa.timestamp("s"), safe=False), pa.string())
+    if pa.types.is_nested(dtype) or pa.types.is_duration(dtype):
+        return _to_python_strings(column)
+    try:
+        return pc.cast(column, pa.string())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return _to_python_strings(column)
+
+
+def normalize_table(table):
+    return pa.table(
+        [normalize_column(column) for column in table.columns],
+        names=table.column_names,
+    )
+
+
+def _column_values(column):
+    if column.null_count:
+        return column.to_pylist()
+    # Null-free columns convert through NumPy, which is much faster than
+    # building one Arrow scalar per value.
+    return column.to_numpy(zero_copy_only=False).tolist()
+
+
+def to_records(table):
+    names = table.column_names
+    columns = [_column_values(column) for column in table.columns]
+    return [dict(zip(names, row)) for row in zip(*columns)]
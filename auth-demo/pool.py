@@ -0,0 +1,348 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "4"))
+POOL_IDLE_TIMEOUT = float(os.getenv("SQL_POOL_IDLE_TIMEOUT", "300"))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("SQL_POOL_CHECKOUT_TIMEOUT", "30"))
+POOL_HEALTH_CHECK_AFTER = float(os.getenv("SQL_POOL_HEALTH_CHECK_AFTER", "60"))
+OBO_CACHE_SIZE = int(os.getenv("OBO_CACHE_SIZE", "64"))
+OBO_CACHE_TTL = float(os.getenv("OBO_CACHE_TTL", "900"))
+
+
+def is_open(conn):
+    return getattr(conn, "open", True)
+
+
+def ping(conn):
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        return True
+    except Exception:
+        return False
+
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except Exception as e:
+        print(f"Error closing connection: {e}")
+
+
+class ConnectionPool:
+    """Thread-safe pool of SQL connections, kept separately per key (warehouse http_path).
+
+    A background thread closes connections that have been idle for
+    `idle_timeout` seconds, including those to warehouses no longer queried.
+    """
+
+    def __init__(
+        self,
+        connect,
+        size=POOL_SIZE,
+        idle_timeout=POOL_IDLE_TIMEOUT,
+        checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+        health_check_after=POOL_HEALTH_CHECK_AFTER,
+    ):
+        self._connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        # key -> deque of (connection, last_used); most recently used on the right
+        self._idle = defaultdict(deque)
+        self._in_use = defaultdict(int)
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._closed = False
+
+    def acquire(self, key):
+        deadline = time.monotonic() + self.checkout_timeout
+        expired = []
+        conn = None
+        last_used = None
+        try:
+            with self._cond:
+                self._start_reaper()
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Connection pool is closed")
+                    expired.extend(self._pop_expired(key))
+                    idle = self._idle[key]
+                    if idle:
+                        conn, last_used = idle.pop()
+                        self._in_use[key] += 1
+                        break
+                    if self._in_use[key] < self.size:
+                        self._in_use[key] += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"Timed out waiting for a connection to {key} "
+                            f"({self.size} in use)"
+                        )
+                    self._cond.wait(remaining)
+        finally:
+            for stale in expired:
+                close_quietly(stale)
+
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect(key)
+        except BaseException:
+            self._forget(key)
+            raise
+        return conn
+
+    def release(self, key, conn, discard=False):
+        with self._cond:
+            self._in_use[key] -= 1
+            keep = not discard and not self._closed and is_open(conn)
+            if keep:
+                self._idle[key].append((conn, time.monotonic()))
+            self._cond.notify()
+        if not keep:
+            close_quietly(conn)
+
+    @contextmanager
+    def connection(self, key):
+        conn = self.acquire(key)
+        try:
+            yield conn
+        except BaseException:
+            self.release(key, conn, discard=not is_open(conn))
+            raise
+        else:
+            self.release(key, conn)
+
+    def reap(self):
+        """Closes connections that have been idle for longer than `idle_timeout`."""
+        with self._cond:
+            expired = [
+                conn for key in list(self._idle) for conn in self._pop_expired(key)
+            ]
+            # Forget warehouses with no connections left.
+            for key in list(self._idle):
+                if not self._idle[key] and not self._in_use[key]:
+                    del self._idle[key]
+                    del self._in_use[key]
+        for conn in expired:
+            close_quietly(conn)
+        return len(expired)
+
+    def close_all(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conns in self._idle.values() for conn, _ in conns]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            close_quietly(conn)
+
+    def reset_after_fork(self):
+        # Connections opened before a fork belong to the parent process, so they
+        # are forgotten here rather than closed, and the reaper thread did not
+        # survive the fork.
+        self._idle = defaultdict(deque)
+        self._in_use = defaultdict(int)
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._closed = False
+
+    def stats(self):
+        with self._cond:
+            return {
+                key: {"idle": len(self._idle[key]), "in_use": self._in_use[key]}
+                for key in set(self._idle) | set(self._in_use)
+            }
+
+    def _pop_expired(self, key):
+        idle = self._idle[key]
+        now = time.monotonic()
+        expired = []
+        # Oldest connections sit on the left, so stop at the first fresh one.
+        while idle and now - idle[0][1] > self.idle_timeout:
+            expired.append(idle.popleft()[0])
+        return expired
+
+    def _is_healthy(self, conn, last_used):
+        if not is_open(conn):
+            return False
+        if time.monotonic() - last_used > self.health_check_after:
+            return ping(conn)
+        return True
+
+    def _start_reaper(self):
+        # Called with the lock held.
+        if self._reaper is not None:
+            return
+
+        def reap_forever():
+            while not self._closed:
+                time.sleep(min(self.idle_timeout, 60))
+                self.reap()
+
+        self._reaper = threading.Thread(
+            target=reap_forever, name="sql-pool-reaper", daemon=True
+        )
+        self._reaper.start()
+
+    def _forget(self, key):
+        with self._cond:
+            self._in_use[key] -= 1
+            self._cond.notify()
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class _Session:
+    def __init__(self, conn, token_hash):
+        self.conn = conn
+        self.token_hash = token_hash
+        self.created = time.monotonic()
+        self.busy = True
+
+
+class SessionCache:
+    """Bounded LRU cache of on-behalf-of sessions, one per (user, warehouse http_path).
+
+    A cached session is only handed back for the same user *and* the same access
+    token, so sessions are never shared across users and a rotated token replaces
+    the old session.
+    """
+
+    def __init__(self, connect, max_size=OBO_CACHE_SIZE, ttl=OBO_CACHE_TTL):
+        self._connect = connect
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, http_path, user_token, user=None):
+        token_hash = hash_token(user_token)
+        key = (user or token_hash, http_path)
+        stale = []
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and not session.busy:
+                if (
+                    session.token_hash != token_hash
+                    or time.monotonic() - session.created > self.ttl
+                    or not is_open(session.conn)
+                ):
+                    del self._sessions[key]
+                    self.evictions += 1
+                    stale.append(session.conn)
+                    session = None
+                else:
+                    session.busy = True
+                    self._sessions.move_to_end(key)
+                    self.hits += 1
+            elif session is not None:
+                if session.token_hash != token_hash:
+                    # Rotated token while the old session is still running a
+                    # query: drop it and let its holder close it on release.
+                    del self._sessions[key]
+                    self.evictions += 1
+                session = None
+            self.misses += session is None
+        for conn in stale:
+            close_quietly(conn)
+        if session is not None:
+            return key, session
+
+        session = _Session(self._connect(http_path, user_token), token_hash)
+        with self._lock:
+            # If the same user already has a busy cached session, this one is
+            # used once and closed on release.
+            if key not in self._sessions:
+                self._sessions[key] = session
+                stale = self._evict_overflow()
+        for conn in stale:
+            close_quietly(conn)
+        return key, session
+
+    def release(self, key, session, discard=False):
+        with self._lock:
+            cached = self._sessions.get(key) is session
+            if cached and (discard or not is_open(session.conn)):
+                del self._sessions[key]
+                self.evictions += 1
+                cached = False
+            session.busy = False
+        if not cached:
+            close_quietly(session.conn)
+
+    @contextmanager
+    def connection(self, http_path, user_token, user=None):
+        key, session = self.acquire(http_path, user_token, user)
+        try:
+            yield session.conn
+        except BaseException:
+            self.release(key, session, discard=not is_open(session.conn))
+            raise
+        else:
+            self.release(key, session)
+
+    def invalidate_user(self, user):
+        with self._lock:
+            keys = [key for key in self._sessions if key[0] == user]
+            sessions = [self._sessions.pop(key) for key in keys]
+            self.evictions += len(sessions)
+        for session in sessions:
+            if not session.busy:
+                close_quietly(session.conn)
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            if not session.busy:
+                close_quietly(session.conn)
+
+    def reset_after_fork(self):
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._sessions),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _evict_overflow(self):
+        evicted = []
+        for key in list(self._sessions):
+            if len(self._sessions) <= self.max_size:
+                break
+            session = self._sessions[key]
+            if session.busy:
+                continue
+            del self._sessions[key]
+            self.evictions += 1
+            evicted.append(session.conn)
+        return evicted
@@ -0,0 +1,164 @@
+import math
+import re
+
+_FILTER_OPERATORS = {
+    "=": "=",
+    "eq": "=",
+    "s=": "=",
+    "!=": "!=",
+    "ne": "!=",
+    "s!=": "!=",
+    "<": "<",
+    "lt": "<",
+    "s<": "<",
+    "<=": "<=",
+    "le": "<=",
+    "s<=": "<=",
+    ">": ">",
+    "gt": ">",
+    "s>": ">",
+    ">=": ">=",
+    "ge": ">=",
+    "s>=": ">=",
+    "contains": "LIKE",
+    "scontains": "LIKE",
+    "icontains": "ILIKE",
+    "datestartswith": "STARTSWITH",
+}
+
+_FILTER_PART = re.compile(
+    r"""^\s*\{(?P<column>(?:[^}\\]|\\.)+)\}\s+
+    (?P<operator>[a-z]+|s?[<>!]?=|s?[<>])\s+
+    (?P<value>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`(?:[^`\\]|\\.)*`|.+?)\s*$""",
+    re.VERBOSE,
+)
+
+_NUMBER = re.compile(r"^-?\d+(\.\d+)?([eE][-+]?\d+)?$")
+
+
+def quote_identifier(name):
+    name = str(name)
+    if not name or "\x00" in name:
+        raise ValueError(f"Invalid identifier: {name!r}")
+    return "`" + name.replace("`", "``") + "`"
+
+
+def split_table_name(table_name):
+    parts = []
+    current = ""
+    quoted = False
+    i = 0
+    name = table_name.strip()
+    while i < len(name):
+        char = name[i]
+        if quoted:
+            if char == "`" and name[i + 1 : i + 2] == "`":
+                current += "`"
+                i += 1
+            elif char == "`":
+                quoted = False
+            else:
+                current += char
+        elif char == "`":
+            quoted = True
+        elif char == ".":
+            parts.append(current)
+            current = ""
+        elif re.match(r"[\w-]", char):
+            current += char
+        else:
+            raise ValueError(f"Invalid character {char!r} in table name {table_name!r}")
+        i += 1
+    parts.append(current)
+    if quoted or not 1 <= len(parts) <= 3 or not all(parts):
+        raise ValueError(
+            f"Invalid table name {table_name!r}, expected catalog.schema.table"
+        )
+    return parts
+
+
+def quote_table_name(table_name):
+    return ".".join(quote_identifier(part) for part in split_table_name(table_name))
+
+
+def quote_literal(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            raise ValueError(f"Cannot use {value} as a SQL literal")
+        return repr(value)
+    text = str(value).replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{text}'"
+
+
+def _escape_like(value):
+    return str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _parse_filter_value(raw):
+    if len(raw) > 1 and raw[0] == raw[-1] and raw[0] in "\"'`":
+        return re.sub(r"\\(.)", r"\1", raw[1:-1])
+    if _NUMBER.match(raw):
+        return float(raw) if any(c in raw for c in ".eE") else int(raw)
+    return raw
+
+
+def build_where(filter_query):
+    """Translates a Dash DataTable `filter_query` into a SQL WHERE condition."""
+    if not filter_query or not filter_query.strip():
+        return None
+    conditions = []
+    for part in filter_query.split(" && "):
+        match = _FILTER_PART.match(part)
+        if not match or match.group("operator") not in _FILTER_OPERATORS:
+            raise ValueError(f"Unsupported filter: {part.strip()!r}")
+        column = quote_identifier(re.sub(r"\\(.)", r"\1", match.group("column")))
+        operator = _FILTER_OPERATORS[match.group("operator")]
+        value = _parse_filter_value(match.group("value"))
+        if operator in ("LIKE", "ILIKE"):
+            pattern = quote_literal(f"%{_escape_like(value)}%")
+            conditions.append(f"CAST({column} AS STRING) {operator} {pattern}")
+        elif operator == "STARTSWITH":
+            pattern = quote_literal(f"{_escape_like(value)}%")
+            conditions.append(f"CAST({column} AS STRING) LIKE {pattern}")
+        else:
+            conditions.append(f"{column} {operator} {quote_literal(value)}")
+    return " AND ".join(conditions)
+
+
+def build_order_by(sort_by):
+    """Translates a Dash DataTable `sort_by` list into a SQL ORDER BY clause."""
+    if not sort_by:
+        return None
+    return ", ".join(
+        f"{quote_identifier(s['column_id'])} {'DESC' if s.get('direction') == 'desc' else 'ASC'}"
+        for s in sort_by
+    )
+
+
+def build_select(
+    table_name, columns=None, where=None, order_by=None, limit=None, offset=None
+):
+    projection = ", ".join(quote_identifier(c) for c in columns) if columns else "*"
+    query = f"SELECT {projection} FROM {quote_table_name(table_name)}"
+    if where:
+        query += f" WHERE {where}"
+    if order_by:
+        query += f" ORDER BY {order_by}"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    if offset:
+        query += f" OFFSET {int(offset)}"
+    return query
+
+
+def build_count(table_name, where=None):
+    query = f"SELECT COUNT(*) AS row_count FROM {quote_table_name(table_name)}"
+    if where:
+        query += f" WHERE {where}"
+    return query
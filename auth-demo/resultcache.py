@@ -0,0 +1,185 @@
+import atexit
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_MEMORY_MB = float(os.getenv("RESULT_CACHE_MEMORY_MB", "256"))
+RESULT_CACHE_DISK_MB = float(os.getenv("RESULT_CACHE_DISK_MB", "2048"))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")
+
+
+def normalize_sql(query):
+    return re.sub(r"\s+", " ", query).strip().rstrip(";").strip()
+
+
+def result_key(identity, http_path, query):
+    return (identity, http_path, normalize_sql(query))
+
+
+class _Entry:
+    def __init__(self, buffer, expires):
+        self.buffer = buffer
+        self.path = None
+        self.size = buffer.size
+        self.expires = expires
+        self.cached_at = datetime.now()
+
+
+class ResultCache:
+    """LRU cache of query results stored as Arrow IPC.
+
+    Keys are (identity, warehouse http_path, normalized SQL), where identity is
+    "sp" or one OBO user, so one identity never sees another's results. Results
+    live in memory until `max_memory_bytes` is reached, then the least recently
+    used ones are spilled to files that are read back with memory mapping.
+    """
+
+    def __init__(
+        self,
+        ttl=RESULT_CACHE_TTL,
+        max_memory_bytes=int(RESULT_CACHE_MEMORY_MB * 1024 * 1024),
+        max_disk_bytes=int(RESULT_CACHE_DISK_MB * 1024 * 1024),
+        spill_dir=RESULT_CACHE_DIR,
+    ):
+        self.ttl = ttl
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._spill_root = spill_dir
+        self._spill_dir = None
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        import pyarrow as pa
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            source = entry.buffer if entry.buffer is not None else entry.path
+            cached_at = entry.cached_at
+        try:
+            if isinstance(source, str):
+                source = pa.memory_map(source)
+            return pa.ipc.open_file(source).read_all(), cached_at
+        except (OSError, pa.ArrowInvalid) as e:
+            # The spill file was removed by a concurrent eviction.
+            print(f"Error reading cached result: {e}")
+            return None
+
+    def put(self, key, table):
+        import pyarrow as pa
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        entry = _Entry(sink.getvalue(), time.monotonic() + self.ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if entry.size > self.max_memory_bytes + self.max_disk_bytes:
+                return entry.cached_at
+            self._entries[key] = entry
+            self._memory_bytes += entry.size
+            self._spill_and_evict()
+        return entry.cached_at
+
+    def invalidate(self, identity=None):
+        with self._lock:
+            for key in list(self._entries):
+                if identity is None or key[0] == identity:
+                    self._remove(key)
+
+    def close(self):
+        self.invalidate()
+        if self._spill_dir:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    def reset_after_fork(self):
+        # The spill directory belongs to the parent process, which removes it on
+        # exit, so each worker starts with an empty cache of its own.
+        self._spill_dir = None
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        if entry.buffer is not None:
+            self._memory_bytes -= entry.size
+        else:
+            self._disk_bytes -= entry.size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _spill_and_evict(self):
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if e.expires < now]:
+            self._remove(key)
+        # Entries are in LRU order, so the oldest are spilled first.
+        for key, entry in list(self._entries.items()):
+            if self._memory_bytes <= self.max_memory_bytes:
+                break
+            if entry.buffer is not None:
+                self._spill(key, entry)
+        for key, entry in list(self._entries.items()):
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            if entry.buffer is None:
+                self._remove(key)
+
+    def _spill(self, key, entry):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(
+                prefix="auth-demo-results-", dir=self._spill_root
+            )
+        path = os.path.join(
+            self._spill_dir, hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        )
+        try:
+            with open(path, "wb") as f:
+                f.write(entry.buffer)
+        except OSError as e:
+            print(f"Error spilling cached result to {path}: {e}")
+            self._remove(key)
+            return
+        self._memory_bytes -= entry.size
+        self._disk_bytes += entry.size
+        entry.buffer = None
+        entry.path = path
+
+
+result_cache = ResultCache()
+atexit.register(result_cache.close)
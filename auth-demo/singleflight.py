@@ -0,0 +1,69 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one.
+
+    The first caller for a key runs `fn`; callers arriving while it is still
+    running wait for it and get the same result (or exception). `check` is
+    called periodically while waiting so that a waiter can give up, e.g. when
+    its own query is cancelled.
+    """
+
+    def __init__(self, check_interval=0.2):
+        self.check_interval = check_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, check=None):
+        """Returns (result, shared), where `shared` is True for waiters."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result, False
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.finished.set()
+
+        while not call.finished.wait(self.check_interval):
+            if check:
+                check()
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def reset_after_fork(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+            }
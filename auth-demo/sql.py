@@ -1,68 +1,392 @@
-import pandas as pd
+import os
+from contextlib import ExitStack, contextmanager
 
-from auth import w
+import auth
+from admission import admission
+from auth import cache_identity, connection_for
+from cache import schema_cache, workspace_cache
+from jobs import JobCancelled
+from metrics import NULL_TIMER, StageTimer
+from querybuilder import (
+    build_count,
+    build_order_by,
+    build_select,
+    build_where,
+    quote_table_name,
+)
+from resilience import execute
+from resultcache import result_cache, result_key
+from singleflight import SingleFlight
+from warehouses import (
+    sort_warehouses,
+    warehouse_details,
+    warehouse_option,
+    warehouse_starter,
+    warehouse_state,
+)
+
+SQL_STREAM_BATCH_SIZE = int(os.getenv("SQL_STREAM_BATCH_SIZE", "200"))
+SQL_ROW_LIMIT = int(os.getenv("SQL_ROW_LIMIT", "1000"))
+SQL_ROW_LIMIT_MAX = int(os.getenv("SQL_ROW_LIMIT_MAX", "100000"))
+
+# Identical service principal queries running at the same time share one
+# statement. OBO queries are never shared, since each user has their own access.
+sp_queries = SingleFlight()
+
+
+def list_warehouses():
+    warehouses = auth.get_workspace_client().warehouses.list()
+    return sort_warehouses(
+        [wh for wh in warehouses if wh.odbc_params and wh.odbc_params.path]
+    )
+
+
+def find_warehouse(http_path):
+    for wh in workspace_cache.get("warehouses", list_warehouses):
+        if wh.odbc_params.path == http_path:
+            return wh
+    return None
+
+
+def is_listed_warehouse(http_path):
+    """True if `http_path` is one of the warehouses offered in the warehouse list."""
+    options, _ = fetch_warehouses()
+    return any(
+        option["value"] == http_path and not option.get("disabled")
+        for option in options
+    )
 
 
 def fetch_warehouses():
     warehouse_options = []
     warehouse_options_initial = None
-    if w:
-        try:
-            warehouses = w.warehouses.list()
-            warehouse_list = sorted(
-                [wh for wh in warehouses if wh.odbc_params and wh.odbc_params.path],
-                key=lambda x: x.name,
-            )
-            if warehouse_list:
-                warehouse_options = [
-                    {"label": wh.name, "value": wh.odbc_params.path}
-                    for wh in warehouse_list
-                ]
-                warehouse_options_initial = warehouse_options[0]["value"]
-            else:
-                warehouse_options = [
-                    {"label": "No warehouses found", "value": "", "disabled": True}
-                ]
-
-        except Exception as e:
-            print(f"Error fetching warehouses: {e}")
+    try:
+        warehouse_list = workspace_cache.get("warehouses", list_warehouses)
+        if warehouse_list:
+            warehouse_options = [warehouse_option(wh) for wh in warehouse_list]
+            # Running warehouses are listed first, so this is a running one if
+            # there is one.
+            warehouse_options_initial = warehouse_options[0]["value"]
+        else:
             warehouse_options = [
-                {"label": f"Error fetching: {e}", "value": "", "disabled": True}
+                {"label": "No warehouses found", "value": "", "disabled": True}
             ]
-    else:
+
+    except Exception as e:
+        print(f"Error fetching warehouses: {e}")
         warehouse_options = [
-            {"label": "SDK Not Configured", "value": "", "disabled": True}
+            {"label": f"Error fetching: {e}", "value": "", "disabled": True}
         ]
 
     return warehouse_options, warehouse_options_initial
 
 
-def run_query(table_name, conn):
+def warehouse_status(http_path, start=False):
+    """Describes the state of the selected warehouse.
+
+    With `start`, a stopped warehouse is started in the background. Returns
+    (description, error, polling, startable), where `polling` is True while the
+    warehouse is being started and `startable` while it is stopped.
+    """
+    try:
+        wh = find_warehouse(http_path)
+    except Exception as e:
+        print(f"Error fetching warehouse state: {e}")
+        return None, f"Error fetching warehouse state: {e}", False, False
+    if wh is None:
+        return "Choose a running SQL warehouse.", None, False, False
+
+    state = warehouse_state(wh)
+    if start:
+        warehouse_starter.ensure_running(wh.id, state)
+    status = warehouse_starter.status(wh.id)
+    if status is not None and status["following"]:
+        return (
+            f"Starting the warehouse in the background ({status['elapsed']:.0f}s, "
+            f"currently {status['state'].lower()}). You can run a query once it is "
+            "running.",
+            None,
+            True,
+            False,
+        )
+    startable = state in ("STOPPED", "STOPPING")
+    if status is not None and status["state"] == "ERROR":
+        return (
+            None,
+            f"Could not start the warehouse: {status['message']}",
+            False,
+            startable,
+        )
+    if status is not None and status["message"]:
+        return status["message"], None, False, startable
+    if state == "RUNNING":
+        return f"{warehouse_details(wh)}. Ready for queries.", None, False, False
+    return (
+        f"{warehouse_details(wh)}. Start it now so it can warm up, or the first "
+        "query will start it, which can take a few minutes.",
+        None,
+        False,
+        startable,
+    )
+
+
+# pyarrow and normalize are imported inside the query functions so that they
+# are not loaded with the app (the startup warm-up loads them in the background).
+
+
+def stream_batches(cursor, batch_size, timer):
+    from normalize import normalize_table
+
+    while True:
+        with timer.stage("fetch"):
+            batch = cursor.fetchmany_arrow(batch_size)
+        with timer.stage("normalize"):
+            batch = normalize_table(batch)
+        yield batch
+        if batch.num_rows < batch_size:
+            return
+
+
+def execute_table(query, conn, job=None, timer=NULL_TIMER):
+    import pyarrow as pa
+
+    from normalize import normalize_table
+
+    try:
+        with conn.cursor() as cursor:
+            if job:
+                job.set_cursor(cursor)
+                job.set_progress("Running query")
+            with timer.stage("execute"):
+                execute(cursor, query, job.check_cancelled if job else None)
+
+            if not job or not SQL_STREAM_BATCH_SIZE:
+                if job:
+                    job.set_progress("Fetching results")
+                with timer.stage("fetch"):
+                    table = cursor.fetchall_arrow()
+                with timer.stage("normalize"):
+                    return normalize_table(table)
+
+            batches = []
+            for batch in stream_batches(cursor, SQL_STREAM_BATCH_SIZE, timer):
+                batches.append(batch)
+                if batch.num_rows:
+                    job.add_batch(batch)
+                job.set_progress(f"Fetched {job.rows_streamed} rows")
+            return pa.concat_tables(batches)
+    except Exception as e:
+        print(f"Error running query '{query}': {e}")
+        raise
+
+
+def parse_describe(rows):
+    # DESCRIBE TABLE lists the columns first, followed by a blank row and
+    # "# Partition Information" and similar sections.
+    columns = []
+    for row in rows:
+        name, data_type = row[0], row[1]
+        if not name or name.startswith("#"):
+            break
+        columns.append((name, data_type))
+    return columns
+
+
+def describe_table(auth, http_path, table_name):
+    """Returns the table's columns as (name, type) pairs, cached per identity."""
+    quoted = quote_table_name(table_name)
+
+    def load():
+        with admitted(auth, http_path):
+            with connection_for(auth, http_path) as conn:
+                with conn.cursor() as cursor:
+                    execute(cursor, f"DESCRIBE TABLE {quoted}")
+                    return parse_describe(cursor.fetchall())
+
+    return schema_cache.get((cache_identity(auth), http_path, quoted), load)
+
+
+def select_columns(auth, http_path, table_name, columns):
+    """Checks the requested columns against the table's schema.
+
+    Returns them in table order, or None (all columns) when none are requested.
+    """
+    if not columns:
+        return None
+    names = [name for name, _ in describe_table(auth, http_path, table_name)]
+    unknown = set(columns) - set(names)
+    if unknown:
+        raise ValueError(
+            f"Unknown column(s) in {table_name}: {', '.join(sorted(unknown))}"
+        )
+    return [name for name in names if name in set(columns)]
+
+
+def row_limit(limit):
+    if not limit:
+        return SQL_ROW_LIMIT
+    return max(1, min(int(limit), SQL_ROW_LIMIT_MAX))
+
+
+def fetch_table(table_name, conn, columns=None, limit=SQL_ROW_LIMIT):
     if not table_name or not conn:
-        return pd.DataFrame()
+        import pyarrow as pa
+
+        return pa.table({})
+
+    return execute_table(build_select(table_name, columns, limit=limit), conn)
+
+
+@contextmanager
+def admitted(auth, http_path, job=None, timer=NULL_TIMER):
+    """Waits for a slot on the warehouse (see admission.py), reporting the queue
+    position as the job's progress."""
+
+    def on_wait(position):
+        if job:
+            job.set_progress(f"Warehouse busy, position {position} in the queue")
+
+    with ExitStack() as stack:
+        with timer.stage("queue"):
+            stack.enter_context(
+                admission.admit(http_path, cache_identity(auth), on_wait)
+            )
+        yield
+
+
+def fetch_table_cached(
+    auth,
+    http_path,
+    table_name,
+    force_refresh=False,
+    job=None,
+    columns=None,
+    limit=SQL_ROW_LIMIT,
+):
+    if columns and job:
+        job.set_progress("Checking the table's columns")
+    columns = select_columns(auth, http_path, table_name, columns)
+    query = build_select(table_name, columns, limit=row_limit(limit))
+    key = result_key(cache_identity(auth), http_path, query)
+    if not force_refresh:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
+    def run():
+        timer = StageTimer(auth["mode"], http_path)
+        try:
+            with admitted(auth, http_path, job, timer):
+                if job:
+                    job.set_progress("Waiting for a connection")
+                with connection_for(auth, http_path) as conn:
+                    table = execute_table(query, conn, job, timer)
+        finally:
+            timer.observe()
+        result_cache.put(key, table)
+        return table
+
+    if auth["mode"] != "sp":
+        return run(), None
+
+    def wait():
+        job.set_progress("Waiting for an identical query to finish")
+
+    while True:
+        try:
+            table, _ = sp_queries.do(key, run, check=wait if job else None)
+            return table, None
+        except JobCancelled:
+            # A waiter only gives up when its own job is cancelled; if the
+            # query it was waiting on was cancelled by its owner, it runs again.
+            if job is not None and job.cancelled:
+                raise
+
+
+def export_table(auth, http_path, table_name, export_format, columns=None):
+    """Runs a query for the whole table for a download.
+
+    Returns a generator of CSV or Parquet chunks and a `close` function that the
+    caller must call when the download ends. The statement is executed before
+    this returns, so errors such as a missing table are raised here rather than
+    halfway through the download.
+    """
+    from export import export_chunks
+
+    columns = select_columns(auth, http_path, table_name, columns)
+    query = build_select(table_name, columns)
+    with ExitStack() as stack:
+        # The slot is held until the download ends.
+        stack.enter_context(admitted(auth, http_path))
+        conn = stack.enter_context(connection_for(auth, http_path))
+        cursor = stack.enter_context(conn.cursor())
+        try:
+            execute(cursor, query)
+        except Exception as e:
+            print(f"Error running query '{query}': {e}")
+            raise
+        stack = stack.pop_all()
+
+    finished = False
+
+    def chunks():
+        nonlocal finished
+        yield from export_chunks(cursor, export_format)
+        finished = True
+
+    def close():
+        if not finished:
+            # The client disconnected before the download was complete, so
+            # stop the statement on the warehouse.
+            try:
+                cursor.cancel()
+            except Exception as e:
+                print(f"Error cancelling export of {table_name}: {e}")
+        stack.close()
+
+    return chunks(), close
+
+
+def run_query(table_name, conn, columns=None, limit=SQL_ROW_LIMIT):
+    return fetch_table(table_name, conn, columns, limit).to_pandas()
+
+
+def run_page_query(
+    table_name,
+    conn,
+    page_current,
+    page_size,
+    sort_by=None,
+    filter_query=None,
+    with_count=True,
+    timer=NULL_TIMER,
+    columns=None,
+):
+    from normalize import normalize_table
 
-    query = f"SELECT * FROM {table_name} LIMIT 1000"
+    where = build_where(filter_query)
+    query = build_select(
+        table_name,
+        columns,
+        where=where,
+        order_by=build_order_by(sort_by),
+        limit=page_size,
+        offset=page_current * page_size,
+    )
     try:
         with conn.cursor() as cursor:
-            cursor.execute(query)
-            df = cursor.fetchall_arrow().to_pandas()
-            for col in df.columns:
-                if pd.api.types.is_datetime64_any_dtype(
-                    df[col]
-                ) or pd.api.types.is_timedelta64_dtype(df[col]):
-                    try:
-                        df[col] = pd.to_datetime(df[col]).dt.strftime(
-                            "%Y-%m-%d %H:%M:%S"
-                        )
-                    except Exception:
-                        df[col] = df[col].astype(str)
-                elif isinstance(df[col].dtype, (pd.ArrowDtype)):
-                    df[col] = df[col].astype(str)
-                elif not pd.api.types.is_numeric_dtype(
-                    df[col]
-                ) and not pd.api.types.is_string_dtype(df[col]):
-                    df[col] = df[col].astype(str)
-            return df
+            with timer.stage("execute"):
+                execute(cursor, query)
+            with timer.stage("fetch"):
+                table = cursor.fetchall_arrow()
+            with timer.stage("normalize"):
+                table = normalize_table(table)
+            total_rows = None
+            if with_count:
+                with timer.stage("count"):
+                    execute(cursor, build_count(table_name, where))
+                    total_rows = cursor.fetchone()[0]
+            return table, total_rows
     except Exception as e:
         print(f"Error running query '{query}': {e}")
         raise
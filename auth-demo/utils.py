@@ -1,6 +1,12 @@
 from dash import dash_table
 from dash_iconify import DashIconify
 
+CELL_MAX_WIDTH_PX = 300
+CELL_PADDING_PX = 10
+# Average glyph width of DM Sans at the table's font size.
+AVG_CHAR_WIDTH_PX = 7
+TOOLTIP_MIN_CHARS = (CELL_MAX_WIDTH_PX - 2 * CELL_PADDING_PX) // AVG_CHAR_WIDTH_PX
+
 
 def get_icon(icon):
     return DashIconify(icon=icon, height=16)
@@ -18,11 +24,11 @@ def create_data_table(id):
         },
         style_cell={
             "textAlign": "left",
-            "padding": "10px",
+            "padding": f"{CELL_PADDING_PX}px",
             "fontFamily": "DM Sans, sans-serif",
             "minWidth": "100px",
             "width": "150px",
-            "maxWidth": "300px",
+            "maxWidth": f"{CELL_MAX_WIDTH_PX}px",
             "overflow": "hidden",
             "textOverflow": "ellipsis",
             "border": "1px solid #DCDCDC",
@@ -43,13 +49,28 @@ def create_data_table(id):
         filter_action="native",
         tooltip_delay=0,
         tooltip_duration=None,
-        tooltip_data=[
-            {
-                column: {"value": str(value), "type": "markdown"}
-                for column, value in row.items()
-            }
-            for row in [{}]
-        ],
+        tooltip_data=[],
         virtualization=True,
         fixed_rows={"headers": True},
     )
+
+
+def can_truncate(value, min_chars=TOOLTIP_MIN_CHARS):
+    # Cells wrap at whitespace (style_data sets "whiteSpace": "normal"), so text
+    # is only cut off when a single word is wider than the column.
+    if len(value) <= min_chars:
+        return False
+    return any(len(word) > min_chars for word in value.split())
+
+
+def create_tooltips(data, min_chars=TOOLTIP_MIN_CHARS):
+    # Only cells that can be truncated get a tooltip; other values are fully
+    # visible already.
+    return [
+        {
+            column: {"value": value, "type": "markdown"}
+            for column, value in row.items()
+            if isinstance(value, str) and can_truncate(value, min_chars)
+        }
+        for row in data
+    ]
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+
+import auth
+from cache import workspace_cache
+
+# Start a stopped warehouse as soon as it is selected in the list, instead of
+# only when the user clicks "Start warehouse".
+WAREHOUSE_AUTO_START = os.getenv("WAREHOUSE_AUTO_START", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+WAREHOUSE_POLL_INTERVAL = float(os.getenv("WAREHOUSE_POLL_INTERVAL", "5"))
+WAREHOUSE_START_TIMEOUT = float(os.getenv("WAREHOUSE_START_TIMEOUT", "900"))
+
+# Running warehouses are listed first, then the ones that will be ready soonest.
+STATE_ORDER = {"RUNNING": 0, "STARTING": 1, "STOPPED": 2, "STOPPING": 3}
+
+
+def warehouse_state(wh):
+    state = getattr(wh, "state", None)
+    if state is None:
+        return "UNKNOWN"
+    return getattr(state, "value", state)
+
+
+def warehouse_details(wh):
+    """Short description of a warehouse's state, size and load."""
+    state = warehouse_state(wh)
+    parts = [state.title()]
+    if getattr(wh, "cluster_size", None):
+        parts.append(wh.cluster_size)
+    if state == "RUNNING":
+        clusters = wh.num_clusters or 0
+        max_clusters = wh.max_num_clusters or max(clusters, 1)
+        parts.append(f"{clusters}/{max_clusters} clusters")
+        parts.append(f"{wh.num_active_sessions or 0} active sessions")
+    return " · ".join(parts)
+
+
+def warehouse_option(wh):
+    return {
+        "label": f"{wh.name} ({warehouse_details(wh)})",
+        "value": wh.odbc_params.path,
+    }
+
+
+def sort_warehouses(warehouses):
+    return sorted(
+        warehouses,
+        key=lambda wh: (STATE_ORDER.get(warehouse_state(wh), 4), wh.name),
+    )
+
+
+class WarehouseStarter:
+    """Starts stopped SQL warehouses and follows their state on a background thread.
+
+    One thread polls each warehouse that is being started, however many users
+    selected it, and the page reads the latest state from `status`.
+    """
+
+    def __init__(
+        self,
+        get_client=None,
+        poll_interval=WAREHOUSE_POLL_INTERVAL,
+        timeout=WAREHOUSE_START_TIMEOUT,
+    ):
+        self.get_client = get_client or (lambda: auth.get_workspace_client())
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._status = {}
+        self._pollers = set()
+        self._lock = threading.Lock()
+        self.starts = 0
+        self.errors = 0
+
+    def ensure_running(self, warehouse_id, state):
+        """Starts following `warehouse_id` unless it is running or already followed."""
+        if state == "RUNNING":
+            return False
+        with self._lock:
+            if warehouse_id in self._pollers:
+                return False
+            self._pollers.add(warehouse_id)
+            self._status[warehouse_id] = {
+                "state": state,
+                "message": None,
+                "since": time.monotonic(),
+            }
+        threading.Thread(
+            target=self._follow,
+            args=(warehouse_id,),
+            name=f"warehouse-start-{warehouse_id}",
+            daemon=True,
+        ).start()
+        return True
+
+    def status(self, warehouse_id):
+        with self._lock:
+            status = self._status.get(warehouse_id)
+            if status is None:
+                return None
+            return {
+                **status,
+                "following": warehouse_id in self._pollers,
+                "elapsed": time.monotonic() - status["since"],
+            }
+
+    def reset_after_fork(self):
+        self._status = {}
+        self._pollers = set()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "following": sorted(self._pollers),
+                "starts": self.starts,
+                "errors": self.errors,
+            }
+
+    def _set(self, warehouse_id, state, message=None):
+        with self._lock:
+            self._status[warehouse_id]["state"] = state
+            self._status[warehouse_id]["message"] = message
+
+    def _follow(self, warehouse_id):
+        deadline = time.monotonic() + self.timeout
+        started = False
+        try:
+            client = self.get_client()
+            while True:
+                wh = client.warehouses.get(warehouse_id)
+                state = warehouse_state(wh)
+                self._set(warehouse_id, state)
+                if state == "RUNNING":
+                    # The cached list still shows the old state.
+                    workspace_cache.invalidate("warehouses")
+                    return
+                if state in ("DELETED", "DELETING"):
+                    self._set(warehouse_id, state, "The warehouse has been deleted.")
+                    return
+                # A stopping warehouse has to stop before it can be started again.
+                if state == "STOPPED" and not started:
+                    client.warehouses.start(warehouse_id)
+                    started = True
+                    self.starts += 1
+                    self._set(warehouse_id, "STARTING")
+                if time.monotonic() >= deadline:
+                    self._set(
+                        warehouse_id,
+                        state,
+                        f"Still {state.lower()} after {self.timeout:.0f}s.",
+                    )
+                    return
+                time.sleep(self.poll_interval)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error starting warehouse {warehouse_id}: {e}")
+            self._set(warehouse_id, "ERROR", str(e))
+        finally:
+            with self._lock:
+                self._pollers.discard(warehouse_id)
+
+
+warehouse_starter = WarehouseStarter()
@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+from auth import fetch_sp_details, get_config, sp_credentials, sp_pool
+from sql import fetch_warehouses
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() not in (
+    "0",
+    "false",
+    "no",
+)
+
+warmup_state = {"status": "not started", "steps": {}, "seconds": None}
+
+
+def _step(name, fn):
+    start = time.perf_counter()
+    try:
+        fn()
+        warmup_state["steps"][name] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        warmup_state["steps"][name] = f"error: {e}"
+        print(f"Warm-up step {name} failed: {e}")
+
+
+def import_query_modules():
+    import pyarrow  # noqa: F401
+
+    import normalize  # noqa: F401
+
+
+def _open_default_connection():
+    _, http_path = fetch_warehouses()
+    if not http_path:
+        return
+    # Open one service principal connection and leave it idle in the pool, so
+    # the first query on the default warehouse does not wait for it.
+    with sp_pool.connection(http_path):
+        pass
+
+
+def warm_up():
+    warmup_state["status"] = "running"
+    start = time.perf_counter()
+    _step("imports", import_query_modules)
+    _step("config", get_config)
+    _step("sp_token", sp_credentials.headers)
+    _step("warehouses", fetch_warehouses)
+    _step("sp_identity", fetch_sp_details)
+    _step("connection", _open_default_connection)
+    warmup_state["seconds"] = round(time.perf_counter() - start, 3)
+    warmup_state["status"] = "done"
+    print(f"Warm-up finished in {warmup_state['seconds']}s: {warmup_state['steps']}")
+
+
+def start_warmup():
+    """Runs `warm_up` on a background thread, so the server accepts requests
+    while it loads the SDK, lists warehouses, resolves the service principal and
+    opens a connection to the default warehouse."""
+    if not STARTUP_WARMUP:
+        warmup_state["status"] = "disabled"
+        return None
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,313 @@
+"""Offline end-to-end benchmarks of the query paths in both apps, run against
+the fake SQL connector in `fake_sql.py` instead of a SQL warehouse.
+
+Cases:
+
+- `run_query`: `sql.run_query` in `auth-demo`.
+- `read_table`: `functions.read_table` in `apps-shell`.
+- `auth_demo_callback`: the `auth-demo` service principal query callback, from
+  clicking **Run query** until the last poll has delivered the result.
+- `apps_shell_callback`: the `apps-shell` "Read a table" callback.
+
+Every case runs in its own process for each table size and reports the median
+wall time, the peak Python (tracemalloc) and Arrow memory and the size of the
+JSON the callbacks send to the browser. Results are printed as a table and can
+be written as JSON with `--output`; `--baseline` compares against an earlier
+output file and exits with status 1 if a case regressed.
+
+    python benchmarks/callback_bench.py [--rows 1000 10000 100000] [--output results.json]
+    python benchmarks/callback_bench.py --baseline results.json [--tolerance 0.25]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pyarrow as pa
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_sql  # noqa: E402
+
+TABLE_NAME = "samples.bench.synthetic"
+HTTP_PATH = "/sql/1.0/warehouses/benchmark"
+CASES = {
+    "run_query": "auth-demo",
+    "read_table": "apps-shell",
+    "auth_demo_callback": "auth-demo",
+    "apps_shell_callback": "apps-shell",
+}
+# Metrics compared against a baseline; lower is better for all of them.
+COMPARED = ("median_s", "python_peak_bytes", "arrow_peak_bytes", "payload_bytes")
+
+
+def payload_size(outputs):
+    from plotly.io.json import to_json_plotly
+
+    return len(to_json_plotly(outputs).encode("utf-8"))
+
+
+def setup_run_query():
+    import sql
+
+    from databricks import sql as dbsql
+
+    def run():
+        conn = dbsql.connect()
+        df = sql.run_query(TABLE_NAME, conn)
+        return len(df), 0
+
+    return run
+
+
+def setup_read_table():
+    from components.tables.functions import read_table
+
+    def run():
+        # read_table prints the result frame.
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = read_table(TABLE_NAME)
+        return len(df), 0
+
+    return run
+
+
+def setup_auth_demo_callback(poll_interval):
+    import app
+    from jobs import job_runner
+
+    poll_query_callback, _ = app.register_job_callbacks("sp")
+
+    def run():
+        with app.server.test_request_context():
+            outputs = app.run_sp_query_callback(
+                1, HTTP_PATH, TABLE_NAME, False, True, None
+            )
+            payload = payload_size(outputs)
+            job_info = outputs[15]
+            job = job_runner.get(job_info["id"])
+            n_intervals = 0
+            while True:
+                time.sleep(poll_interval)
+                n_intervals += 1
+                done = job.done
+                outputs = poll_query_callback(n_intervals, job_info)
+                payload += payload_size(outputs)
+                # The browser stores the acknowledged row offset.
+                if isinstance(outputs[15], dict):
+                    job_info = outputs[15]
+                if done:
+                    break
+            if job.status != "done":
+                raise RuntimeError(f"Query {job.status}: {job.error}")
+            rows = job.result[0].num_rows
+        return rows, payload
+
+    return run
+
+
+def setup_apps_shell_callback():
+    import app
+    from components.tables.ui_tables_read import read_table_callback
+
+    def run():
+        # The callback reads the user from the request headers. Cached results
+        # are bypassed so that every run queries the (fake) warehouse.
+        with app.server.test_request_context():
+            with contextlib.redirect_stdout(io.StringIO()):
+                outputs = read_table_callback(1, TABLE_NAME, None, None, True)
+        return len(outputs[0]), payload_size(outputs)
+
+    return run
+
+
+def run_case(case, table_path, repeat, latency, poll_interval):
+    """Runs one case in this process and returns its measurements."""
+    app_dir = os.path.join(ROOT, CASES[case])
+    os.chdir(app_dir)
+    sys.path.insert(0, app_dir)
+    os.environ.setdefault("DATABRICKS_HOST", "https://example.cloud.databricks.com")
+    os.environ.setdefault("DATABRICKS_TOKEN", "benchmark")
+
+    # Memory mapping keeps the synthetic table out of Arrow's memory pool, so
+    # the pool's peak only counts what the app allocates.
+    table = pa.ipc.open_file(pa.memory_map(table_path)).read_all()
+    connector = fake_sql.install(table, latency=latency)
+
+    # Imported up front so that a query thread and JSON encoding in this
+    # thread do not race to import it.
+    import pandas  # noqa: F401
+
+    if case in ("read_table", "apps_shell_callback"):
+        import app  # noqa: F401  (registers the pages)
+    if case == "run_query":
+        run = setup_run_query()
+    elif case == "read_table":
+        run = setup_read_table()
+    elif case == "auth_demo_callback":
+        run = setup_auth_demo_callback(poll_interval)
+    else:
+        run = setup_apps_shell_callback()
+
+    run()  # warm up imports and caches
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows, payload = run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "case": case,
+        "rows": table.num_rows,
+        "columns": table.num_columns,
+        "rows_returned": rows,
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "python_peak_bytes": python_peak,
+        "arrow_peak_bytes": pa.default_memory_pool().max_memory(),
+        "payload_bytes": payload,
+        "connections": connector.connections,
+    }
+
+
+def run_all(args):
+    results = []
+    with tempfile.TemporaryDirectory(prefix="callback-bench-") as tmp:
+        for rows in args.rows:
+            table = fake_sql.make_table(rows, args.columns)
+            table_path = os.path.join(tmp, f"table-{rows}.arrow")
+            with pa.OSFile(table_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            for case in args.cases:
+                command = [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    "--run-case",
+                    case,
+                    "--table",
+                    table_path,
+                    "--repeat",
+                    str(args.repeat),
+                    "--latency",
+                    str(args.latency),
+                    "--poll-interval",
+                    str(args.poll_interval),
+                ]
+                output = subprocess.run(
+                    command, check=True, capture_output=True, text=True
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                results.append(result)
+                print_result(result)
+    return results
+
+
+def print_header():
+    print(
+        f"{'case':<20} {'rows':>7} {'median s':>9} {'python MB':>10} "
+        f"{'arrow MB':>9} {'payload MB':>11}"
+    )
+
+
+def print_result(result):
+    mb = 1024 * 1024
+    print(
+        f"{result['case']:<20} {result['rows']:>7} {result['median_s']:>9.3f} "
+        f"{result['python_peak_bytes'] / mb:>10.1f} "
+        f"{result['arrow_peak_bytes'] / mb:>9.1f} "
+        f"{result['payload_bytes'] / mb:>11.2f}"
+    )
+
+
+def compare(results, baseline, tolerance):
+    previous = {(r["case"], r["rows"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["case"], result["rows"]))
+        if before is None:
+            continue
+        for metric in COMPARED:
+            # Differences below the floor are mostly noise (thread timing decides
+            # how many streamed batches are held at once, for example).
+            floor = 0.05 if metric == "median_s" else 4 * 1024 * 1024
+            if result[metric] > max(before[metric], floor) * (1 + tolerance):
+                regressions.append(
+                    f"{result['case']} at {result['rows']} rows: {metric} "
+                    f"{before[metric]:.4g} -> {result[metric]:.4g}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--columns", type=int, default=len(fake_sql.COLUMN_TYPES))
+    parser.add_argument(
+        "--cases", nargs="+", choices=sorted(CASES), default=list(CASES)
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="fake query latency in seconds"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.05,
+        help="seconds between polls of a background query",
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="earlier --output file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--run-case", choices=sorted(CASES), help=argparse.SUPPRESS)
+    parser.add_argument("--table", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        result = run_case(
+            args.run_case, args.table, args.repeat, args.latency, args.poll_interval
+        )
+        print(json.dumps(result))
+        return
+
+    print_header()
+    results = run_all(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "columns": args.columns,
+                    "latency": args.latency,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
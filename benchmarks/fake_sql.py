@@ -0,0 +1,176 @@
+"""Local stand-ins for `databricks.sql.connect` and `WorkspaceClient` used by
+the offline benchmarks.
+
+`install()` replaces `databricks.sql.connect` so the example apps open fake
+connections whose cursors return a synthetic Arrow table of the configured
+shape after the configured latency, whatever SQL they are given. It must be
+called before the benchmarked code opens a connection.
+"""
+
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import numpy as np
+import pyarrow as pa
+
+COLUMN_TYPES = ("int", "double", "string", "text", "timestamp", "decimal", "struct")
+
+
+def _column(kind, rows, seed):
+    rng = np.random.default_rng(seed)
+    if kind == "int":
+        return pa.array(rng.integers(0, 1_000_000, rows), pa.int64())
+    if kind == "double":
+        return pa.array(rng.random(rows) * 1000)
+    if kind == "string":
+        return pa.array([f"label {i % 50}" for i in range(rows)])
+    if kind == "text":
+        # Long enough to be truncated in the table and get a tooltip.
+        return pa.array(
+            [
+                f"row {i}: " + "lorem ipsum dolor sit amet " * (i % 5)
+                for i in range(rows)
+            ]
+        )
+    if kind == "timestamp":
+        start = np.datetime64(datetime(2024, 1, 1), "us")
+        offsets = rng.integers(0, 365 * 24 * 3600, rows).astype("timedelta64[s]")
+        return pa.array(start + offsets, pa.timestamp("us", tz="UTC"))
+    if kind == "decimal":
+        cents = rng.integers(0, 10_000_000, rows)
+        return pa.array(
+            [Decimal(int(c)).scaleb(-2) for c in cents], pa.decimal128(18, 2)
+        )
+    if kind == "struct":
+        return pa.StructArray.from_arrays(
+            [
+                pa.array(rng.integers(0, 100, rows), pa.int32()),
+                pa.array([f"tag {i % 7}" for i in range(rows)]),
+            ],
+            names=["id", "tag"],
+        )
+    raise ValueError(f"Unknown column type {kind!r}")
+
+
+def make_table(rows, columns=len(COLUMN_TYPES), types=COLUMN_TYPES):
+    """Synthetic table cycling through `types` (see COLUMN_TYPES) for its columns."""
+    return pa.table(
+        {
+            f"{types[i % len(types)]}_{i}": _column(types[i % len(types)], rows, i)
+            for i in range(columns)
+        }
+    )
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._table = None
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._table = None
+
+    def cancel(self):
+        pass
+
+    def execute(self, operation, parameters=None):
+        self.connection.queries.append(operation)
+        time.sleep(self.connection.latency)
+        self._table = self.connection.table
+        self._position = 0
+
+    def _take(self, size=None):
+        remaining = self._table.num_rows - self._position
+        size = remaining if size is None else min(size, remaining)
+        batch = self._table.slice(self._position, size)
+        self._position += size
+        return batch
+
+    def fetchall_arrow(self):
+        return self._take()
+
+    def fetchmany_arrow(self, size):
+        return self._take(size)
+
+    def fetchone(self):
+        rows = self._take(1).to_pylist()
+        return tuple(rows[0].values()) if rows else None
+
+    def fetchall(self):
+        return [tuple(row.values()) for row in self._take().to_pylist()]
+
+
+class FakeConnection:
+    def __init__(self, table, latency, **connect_kwargs):
+        self.table = table
+        self.latency = latency
+        self.connect_kwargs = connect_kwargs
+        self.queries = []
+        self.open = True
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.open = False
+
+
+class FakeConnector:
+    """Callable installed as `databricks.sql.connect`."""
+
+    def __init__(self, table, latency=0.0, connect_latency=0.0):
+        self.table = table
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        time.sleep(self.connect_latency)
+        with self._lock:
+            self.connections += 1
+        return FakeConnection(self.table, self.latency, **kwargs)
+
+
+def install(table, latency=0.0, connect_latency=0.0):
+    from databricks import sql
+
+    connector = FakeConnector(table, latency, connect_latency)
+    sql.connect = connector
+    return connector
+
+
+class FakeWorkspaceClient:
+    """Stand-in for the parts of `WorkspaceClient` the apps use at startup:
+    listing SQL warehouses and looking up the current service principal."""
+
+    def __init__(self, warehouses=3, latency=0.0):
+        self.latency = latency
+        self._warehouses = [
+            SimpleNamespace(
+                name=f"Warehouse {i}",
+                id=f"wh{i}",
+                odbc_params=SimpleNamespace(path=f"/sql/1.0/warehouses/wh{i}"),
+            )
+            for i in range(warehouses)
+        ]
+        self.warehouses = SimpleNamespace(list=self._list_warehouses)
+        self.current_user = SimpleNamespace(me=self._me)
+
+    def _list_warehouses(self):
+        time.sleep(self.latency)
+        return list(self._warehouses)
+
+    def _me(self):
+        time.sleep(self.latency)
+        return SimpleNamespace(service_principal_name="benchmark-sp", user_name=None)
@@ -0,0 +1,103 @@
+"""Compares the pandas column loop formerly used by `sql.run_query` with the
+Arrow-native normalization in `auth-demo/normalize.py`.
+
+    python benchmarks/normalize_bench.py [--repeat 5]
+"""
+
+import argparse
+import datetime
+import decimal
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "auth-demo"))
+
+from normalize import normalize_table, to_records  # noqa: E402
+
+
+def legacy_records(table):
+    df = table.to_pandas()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(
+            df[col]
+        ) or pd.api.types.is_timedelta64_dtype(df[col]):
+            try:
+                df[col] = pd.to_datetime(df[col]).dt.strftime("%Y-%m-%d %H:%M:%S")
+            except Exception:
+                df[col] = df[col].astype(str)
+        elif isinstance(df[col].dtype, (pd.ArrowDtype)):
+            df[col] = df[col].astype(str)
+        elif not pd.api.types.is_numeric_dtype(
+            df[col]
+        ) and not pd.api.types.is_string_dtype(df[col]):
+            df[col] = df[col].astype(str)
+    return df.to_dict("records")
+
+
+def arrow_records(table):
+    return to_records(normalize_table(table))
+
+
+def make_table(rows, columns):
+    start = datetime.datetime(2024, 1, 1)
+    generators = [
+        lambda: pa.array(range(rows), pa.int64()),
+        lambda: pa.array([i * 0.5 for i in range(rows)], pa.float64()),
+        lambda: pa.array([f"value {i}" for i in range(rows)], pa.string()),
+        lambda: pa.array(
+            [start + datetime.timedelta(seconds=i) for i in range(rows)],
+            pa.timestamp("us"),
+        ),
+        lambda: pa.array(
+            [decimal.Decimal(i) / 100 for i in range(rows)], pa.decimal128(12, 2)
+        ),
+        lambda: pa.array(
+            [start.date() + datetime.timedelta(days=i % 365) for i in range(rows)],
+            pa.date32(),
+        ),
+    ]
+    return pa.table(
+        {f"col_{i}": generators[i % len(generators)]() for i in range(columns)}
+    )
+
+
+def best_of(fn, table, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(table)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    shapes = {"wide": (1000, 200), "long": (100_000, 12)}
+    results = []
+    for name, (rows, columns) in shapes.items():
+        table = make_table(rows, columns)
+        legacy = best_of(legacy_records, table, args.repeat)
+        arrow = best_of(arrow_records, table, args.repeat)
+        results.append(
+            {
+                "shape": name,
+                "rows": rows,
+                "columns": columns,
+                "legacy_seconds": round(legacy, 4),
+                "arrow_seconds": round(arrow, 4),
+                "speedup": round(legacy / arrow, 2),
+            }
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
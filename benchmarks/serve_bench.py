@@ -0,0 +1,196 @@
+"""Compares request throughput of the Dash development server (`python app.py`)
+with the gunicorn production entry point (`gunicorn app:server -c
+gunicorn.conf.py`) for one of the example apps.
+
+Each server is started in turn on a free local port and loaded with concurrent
+keep-alive clients requesting pages that do not need a Databricks workspace
+(the page shell, the layout and the callback graph), so only the web server is
+measured.
+
+    python benchmarks/serve_bench.py [--app apps-shell] [--clients 32] [--duration 10]
+"""
+
+import argparse
+import http.client
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+PATHS = {
+    "apps-shell": ["/", "/_dash-layout", "/_dash-dependencies"],
+    "auth-demo": ["/_dash-dependencies", "/api/connection-stats"],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_env(port):
+    env = dict(os.environ)
+    # Placeholder credentials let the apps import without a workspace; the
+    # benchmarked paths never call it.
+    env.setdefault("DATABRICKS_HOST", "https://example.cloud.databricks.com")
+    env.setdefault("DATABRICKS_TOKEN", "benchmark")
+    env["PORT"] = str(port)
+    env["DATABRICKS_APP_PORT"] = str(port)
+    return env
+
+
+def start_server(app_dir, command, port):
+    return subprocess.Popen(
+        command,
+        cwd=app_dir,
+        env=server_env(port),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def stop_server(proc):
+    # The dev server's reloader and gunicorn's workers are child processes.
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=15)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+
+
+def wait_until_ready(port, path, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", path)
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+
+def client(port, paths, stop_at, latencies, errors):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    i = 0
+    while time.monotonic() < stop_at:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run_load(port, paths, clients, duration):
+    latencies = []
+    errors = []
+    stop_at = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=client, args=(port, paths, stop_at, latencies, errors))
+        for _ in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def benchmark(name, app_dir, command, paths, clients, duration):
+    port = free_port()
+    proc = start_server(app_dir, command, port)
+    try:
+        wait_until_ready(port, paths[0])
+        run_load(port, paths, clients, 1)  # warm up
+        latencies, errors = run_load(port, paths, clients, duration)
+    finally:
+        stop_server(proc)
+    return {
+        "server": name,
+        "requests_per_s": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else float("nan"),
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--app", choices=sorted(PATHS), default="apps-shell")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument(
+        "--workers", help="GUNICORN_WORKERS for the gunicorn run (app default if unset)"
+    )
+    args = parser.parse_args()
+
+    if args.workers:
+        os.environ["GUNICORN_WORKERS"] = args.workers
+    app_dir = os.path.join(ROOT, args.app)
+    paths = PATHS[args.app]
+    runs = [
+        ("dev server", [sys.executable, "app.py"]),
+        (
+            "gunicorn",
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "app:server",
+                "--config",
+                "gunicorn.conf.py",
+            ],
+        ),
+    ]
+    print(
+        f"{args.app}: {args.clients} clients for {args.duration:g}s "
+        f"on {', '.join(paths)}"
+    )
+    print(
+        f"{'server':<12} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'mean ms':>9} {'errors':>7}"
+    )
+    for name, command in runs:
+        result = benchmark(name, app_dir, command, paths, args.clients, args.duration)
+        print(
+            f"{result['server']:<12} {result['requests_per_s']:>9.1f} "
+            f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+            f"{result['mean_ms']:>9.1f} {result['errors']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
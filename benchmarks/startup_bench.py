@@ -0,0 +1,165 @@
+"""Measures the cold start of `auth-demo`: the time to import the app, and the
+latency of the first page load (warehouse list and service principal name) and
+the first service principal query, with and without the startup warm-up.
+
+The SQL connector and the workspace client are replaced by the stand-ins in
+`fake_sql.py`, with latencies set by `--api-latency` and `--connect-latency`;
+the Databricks SDK itself is still imported and configured, since that is part
+of what the warm-up moves out of the first request.
+
+    python benchmarks/startup_bench.py [--api-latency 0.3] [--connect-latency 1.0]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+APP_DIR = os.path.join(ROOT, "auth-demo")
+TABLE_NAME = "samples.bench.synthetic"
+
+
+def run_scenario(args):
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+
+    start = time.perf_counter()
+    import app
+
+    import_s = time.perf_counter() - start
+    imported_sdk = "databricks.sdk" in sys.modules
+    imported_pyarrow = "pyarrow" in sys.modules
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import auth
+    import fake_sql
+
+    fake_sql.install(
+        fake_sql.make_table(args.rows), connect_latency=args.connect_latency
+    )
+    workspace = fake_sql.FakeWorkspaceClient(latency=args.api_latency)
+    auth.get_workspace_client = lambda: workspace
+
+    warmup_s = None
+    thread = app.start_warmup()
+    if thread is not None:
+        # The first user arrives after the warm-up has finished.
+        start = time.perf_counter()
+        thread.join()
+        warmup_s = time.perf_counter() - start
+
+    with app.server.test_request_context():
+        start = time.perf_counter()
+        outputs = app.update_header_and_warehouses(None)
+        first_page_s = time.perf_counter() - start
+        http_path = outputs[8]
+
+        poll_query_callback, _ = app.register_job_callbacks("sp")
+        start = time.perf_counter()
+        outputs = app.run_sp_query_callback(1, http_path, TABLE_NAME, False, True, None)
+        job_info = outputs[15]
+        job = app.job_runner.get(job_info["id"])
+        n_intervals = 0
+        while True:
+            time.sleep(0.01)
+            n_intervals += 1
+            done = job.done
+            poll_query_callback(n_intervals, job_info)
+            if done:
+                break
+        first_query_s = time.perf_counter() - start
+        if job.status != "done":
+            raise RuntimeError(f"Query {job.status}: {job.error}")
+
+    return {
+        "warmup": thread is not None,
+        "import_s": import_s,
+        "sdk_imported_with_app": imported_sdk,
+        "pyarrow_imported_with_app": imported_pyarrow,
+        "warmup_s": warmup_s,
+        "first_page_s": first_page_s,
+        "first_query_s": first_query_s,
+    }
+
+
+def sdk_import_time():
+    code = (
+        "import time; start = time.perf_counter(); import databricks.sdk; "
+        "print(time.perf_counter() - start)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    ).stdout
+    return float(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--api-latency",
+        type=float,
+        default=0.3,
+        help="seconds per workspace API call (warehouse list, current user)",
+    )
+    parser.add_argument(
+        "--connect-latency",
+        type=float,
+        default=1.0,
+        help="seconds to open a SQL connection",
+    )
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--run-scenario", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args)))
+        return
+
+    env = dict(os.environ)
+    env.setdefault("DATABRICKS_HOST", "https://example.cloud.databricks.com")
+    env.setdefault("DATABRICKS_TOKEN", "benchmark")
+    results = []
+    for warmup in ("false", "true"):
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--run-scenario",
+            "--api-latency",
+            str(args.api_latency),
+            "--connect-latency",
+            str(args.connect_latency),
+            "--rows",
+            str(args.rows),
+        ]
+        output = subprocess.run(
+            command,
+            check=True,
+            capture_output=True,
+            text=True,
+            env={**env, "STARTUP_WARMUP": warmup},
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"importing databricks.sdk on its own: {sdk_import_time():.3f}s")
+    print(
+        f"{'warm-up':<8} {'import s':>9} {'warm-up s':>10} {'first page s':>13} "
+        f"{'first query s':>14}"
+    )
+    for result in results:
+        warmup_s = result["warmup_s"]
+        print(
+            f"{'on' if result['warmup'] else 'off':<8} {result['import_s']:>9.3f} "
+            f"{warmup_s if warmup_s is not None else float('nan'):>10.3f} "
+            f"{result['first_page_s']:>13.3f} {result['first_query_s']:>14.3f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compares building a tooltip for every cell with the truncation-aware tooltips
+from `auth-demo/utils.py` for a 1000-row x 20-column result.
+
+    python benchmarks/tooltip_bench.py [--rows 1000] [--columns 20]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "auth-demo"))
+
+from utils import create_tooltips  # noqa: E402
+
+
+def legacy_tooltips(data):
+    return [
+        {
+            column: {"value": str(value), "type": "markdown"}
+            for column, value in row.items()
+        }
+        for row in data
+    ]
+
+
+def make_records(rows, columns):
+    # A mix of numbers, short labels, a few long free-text columns (which wrap)
+    # and long URLs (which cannot wrap and are cut off).
+    records = []
+    for i in range(rows):
+        row = {}
+        for c in range(columns):
+            if c % 4 == 0:
+                row[f"col_{c}"] = i * c
+            elif c % 4 == 1:
+                row[f"col_{c}"] = i * 0.25
+            elif c % 4 == 2:
+                row[f"col_{c}"] = f"label {i % 50}"
+            elif c % 8 == 3:
+                row[f"col_{c}"] = f"free text for row {i} " * (1 + i % 4)
+            else:
+                row[f"col_{c}"] = f"https://example.com/files/{i:08d}/" + "a" * (i % 40)
+        records.append(row)
+    return records
+
+
+def measure(fn, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tooltips = fn(data)
+        payload = json.dumps({"data": data, "tooltip_data": tooltips})
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = make_records(args.rows, args.columns)
+    data_only = len(json.dumps({"data": data}))
+    legacy_seconds, legacy_bytes = measure(legacy_tooltips, data, args.repeat)
+    lazy_seconds, lazy_bytes = measure(create_tooltips, data, args.repeat)
+    print(
+        json.dumps(
+            {
+                "rows": args.rows,
+                "columns": args.columns,
+                "data_only_bytes": data_only,
+                "legacy_bytes": legacy_bytes,
+                "truncated_only_bytes": lazy_bytes,
+                "legacy_seconds": round(legacy_seconds, 4),
+                "truncated_only_seconds": round(lazy_seconds, 4),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()